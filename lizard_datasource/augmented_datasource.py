@@ -69,6 +69,13 @@ class AugmentedDataSource(datasource.DataSource):
         self._choices_made = choices_made
         self.original_datasource.set_choices_made(choices_made)
 
+    def copy(self):
+        """Return a shallow copy, with its own copy of the original
+        datasource (set_choices_made sets choices on that too)."""
+        copied = super(AugmentedDataSource, self).copy()
+        copied.__dict__.pop('_original_datasource', None)
+        return copied
+
     def criteria(self):
         return self.original_datasource.criteria()
 
@@ -214,6 +221,12 @@ class AugmentedDataSource(datasource.DataSource):
 
         return timeseries
 
+    def latest_values(self, location_ids, start_datetime=None,
+                      end_datetime=None):
+        """The extra graph lines don't change the latest values."""
+        return self.original_datasource.latest_values(
+            location_ids, start_datetime, end_datetime)
+
     def has_percentiles(self):
         return models.PercentileLayer.objects.filter(
             layer_to_add_percentile_to=self.datasource_layer
@@ -4,18 +4,32 @@
 from __future__ import print_function, unicode_literals
 from __future__ import absolute_import, division
 
+import copy
 import itertools
 import logging
 import pkg_resources
+import threading
+import time
 
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 from django.utils import simplejson
 
+from lizard_map.utility import get_host
+
 from lizard_datasource import models
 from lizard_datasource import criteria
+from lizard_datasource.functools import bump_cache_version
+from lizard_datasource.functools import cache_version
 from lizard_datasource.functools import memoize
 
 logger = logging.getLogger(__name__)
 
+CRITERIA_CACHE_TIMEOUT = getattr(
+    settings, 'DATASOURCE_CRITERIA_CACHE_TIMEOUT', 5 * 60)
+REGISTRY_TIMEOUT = getattr(settings, 'DATASOURCE_REGISTRY_TIMEOUT', 5 * 60)
+
 
 class ChoicesMade(object):
     """Represents a set of choices made. Dict-like.
@@ -115,6 +129,25 @@ class ChoicesMade(object):
     def items(self):
         return self._choices.items()
 
+    def __eq__(self, other):
+        return isinstance(other, ChoicesMade) and self.json() == other.json()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.json())
+
+
+def _criteria_key(datasource):
+    """Chooseable criteria are remembered per host, datasource and
+    choices made.
+
+    The host is the request's, or in celery tasks and their threads the
+    one whose database was set with lizard_ui.multitenancy.set_host."""
+    return (get_host(), datasource.originating_app, datasource.identifier,
+            datasource._choices_made)
+
 
 class DataSource(object):
     """Base class for all the DataSource classes. Defines the interface of
@@ -141,10 +174,16 @@ class DataSource(object):
                     identifier=self.identifier,
                     originating_app=self.originating_app)
             except models.DatasourceModel.DoesNotExist:
-                self._dsm = models.DatasourceModel(
+                # bulk_create() sends no post_save: a new, invisible
+                # datasource doesn't need to invalidate the datasource
+                # registry and criteria caches of all processes.
+                models.DatasourceModel.objects.bulk_create([
+                        models.DatasourceModel(
+                            identifier=self.identifier,
+                            originating_app=self.originating_app)])
+                self._dsm = models.DatasourceModel.objects.get(
                     identifier=self.identifier,
                     originating_app=self.originating_app)
-                self._dsm.save()
         return self._dsm
 
     @property
@@ -181,6 +220,13 @@ class DataSource(object):
     def get_choices_made(self):
         return self.expand(self._choices_made)
 
+    def copy(self):
+        """Return a shallow copy, to set other choices made on.
+
+        The datasource registry hands out copies, so that the choices made
+        of one request don't end up in another."""
+        return copy.copy(self)
+
     def criteria(self):
         return ()
 
@@ -198,10 +244,28 @@ class DataSource(object):
         return criteria.EmptyOptions()
 
     def chooseable_criteria(self):
+        """Return the criteria that can be chosen next, given the choices
+        made, as a list of {'criterion': ..., 'options': ...} dicts.
+
+        Finding them asks the backend for options of every criterion and
+        whether choices are drawable, so they are remembered per
+        ChoicesMade for DATASOURCE_CRITERIA_CACHE_TIMEOUT seconds, or until
+        a datasource is configured differently. Callers get their own
+        copy, which they may annotate."""
+        return copy.deepcopy(self._chooseable_criteria())
+
+    @memoize(key=_criteria_key, timeout=CRITERIA_CACHE_TIMEOUT,
+             invalidated_by=(models.DatasourceModel,
+                             models.AugmentedDataSource))
+    def _chooseable_criteria(self):
         all_criteria = self.criteria()
+        # Options can be expensive to get, ask for them once per criterion
+        all_options = dict(
+            (criterion.identifier, self.options_for_criterion(criterion))
+            for criterion in all_criteria)
         chosen_identifiers = set()
         for criterion in all_criteria:
-            options = self.options_for_criterion(criterion)
+            options = all_options[criterion.identifier]
             if (criterion.identifier in self._choices_made or
                 len(options) == 1):
                 chosen_identifiers.add(criterion.identifier)
@@ -216,7 +280,7 @@ class DataSource(object):
                 # Not all prerequisites chosen
                 continue
 
-            options = self.options_for_criterion(criterion)
+            options = all_options[criterion.identifier]
             if len(options) > 1:
                 criterions.append({
                         'criterion': criterion,
@@ -280,6 +344,18 @@ class DataSource(object):
         there are no timeseries available."""
         return None
 
+    def latest_values(self, location_ids, start_datetime=None,
+                      end_datetime=None):
+        """Return the latest values of the relevant timeseries at many
+        locations at once, as a dict with location ids as keys and
+        (UTC datetime, value) tuples as values. Locations without
+        values are left out. Used by the cache_latest_values() script.
+
+        Optional: return None if the datasource can't do this faster
+        than one timeseries() call per location, the script then calls
+        timeseries() for each location."""
+        return None
+
     def location_annotations(self):
         """A datasource may add annotations (extra fields) to the
         Locations it returns.
@@ -444,12 +520,89 @@ def datasources_from_entrypoints():
     return datasources
 
 
+class DatasourceRegistry(object):
+    """All datasources defined by entrypoints, per process and host.
+
+    Loading the entrypoints and instantiating the datasources (which
+    queries their configuration models) is done once, instead of every
+    time a datasource is needed. The registry hands out copies, see
+    DataSource.copy.
+
+    Datasources are loaded per host, because with Lizard 5 multitenancy
+    every site has its own configuration models. They are loaded again
+    after DATASOURCE_REGISTRY_TIMEOUT seconds (default 300), and when a
+    DatasourceModel or AugmentedDataSource is saved or deleted. That bumps
+    a version in the Django cache, so the other processes notice too."""
+
+    VERSION_KEY = 'lizard_datasource.datasource_registry::version'
+
+    def __init__(self, timeout=REGISTRY_TIMEOUT):
+        self.timeout = timeout
+        # host -> (version, loaded, datasources, by_key)
+        self._registered_per_host = {}
+        self._lock = threading.RLock()
+
+    def _registered(self):
+        host = get_host()
+        version = cache_version(self.VERSION_KEY)
+        now = time.time()
+        with self._lock:
+            found = self._registered_per_host.get(host)
+            if (found is None or found[0] != version or
+                now - found[1] > self.timeout):
+                datasources = datasources_from_entrypoints()
+                by_key = {}
+                for datasource in datasources:
+                    # Fetch (or create) its model now, so copies don't
+                    # all have to.
+                    datasource.datasource_model
+                    by_key.setdefault(
+                        (datasource.originating_app, datasource.identifier),
+                        datasource)
+                found = (version, now, datasources, by_key)
+                self._registered_per_host[host] = found
+            return found[2], found[3]
+
+    def datasources(self):
+        """Return copies of all datasources."""
+        datasources, by_key = self._registered()
+        return [datasource.copy() for datasource in datasources]
+
+    def get(self, originating_app, identifier):
+        """Return copy of the datasource identified by originating_app
+        and identifier, or None."""
+        datasources, by_key = self._registered()
+        datasource = by_key.get((originating_app, identifier))
+        if datasource is not None:
+            return datasource.copy()
+
+    def invalidate(self, sender=None, **kwargs):
+        """Forget all datasources, in all processes. They are loaded
+        again when needed.
+
+        Connected to the post_save and post_delete signals of the
+        datasource configuration models."""
+        logger.debug("Invalidating datasource registry...")
+        with self._lock:
+            self._registered_per_host.clear()
+        bump_cache_version(self.VERSION_KEY)
+
+
+datasource_registry = DatasourceRegistry()
+
+for config_model in (models.DatasourceModel, models.AugmentedDataSource):
+    post_save.connect(datasource_registry.invalidate, sender=config_model,
+                      weak=False)
+    post_delete.connect(datasource_registry.invalidate, sender=config_model,
+                        weak=False)
+
+
 def get_datasources(choices_made=ChoicesMade()):
     """Return all the datasources defined by entrypoints that are
     applicable to the given choices_made."""
 
     datasources = []
-    for datasource in datasources_from_entrypoints():
+    for datasource in datasource_registry.datasources():
         if datasource.visible and datasource.is_applicable(choices_made):
             datasource.set_choices_made(choices_made)
             datasources.append(datasource)
@@ -465,13 +618,10 @@ def get_datasource_by_model(datasource_model, exclude=None):
     plus some central configuration options for the datasources. If you
     have a datasource_model instance, use this function to get the
     corresponding datasource."""
-    for datasource in datasources_from_entrypoints():
-        if exclude and datasource is exclude:
-            continue
-
-        if (datasource_model.originating_app == datasource.originating_app
-            and datasource.identifier == datasource_model.identifier):
-            return datasource
+    key = (datasource_model.originating_app, datasource_model.identifier)
+    if exclude and (exclude.originating_app, exclude.identifier) == key:
+        return None
+    return datasource_registry.get(*key)
 
 
 def get_datasource_by_layer(datasource_layer):
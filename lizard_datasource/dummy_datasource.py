@@ -149,6 +149,11 @@ class DummyDataSource(datasource.DataSource):
             utc(2012, 11, 13, 14, 0): 14.0
             })
 
+    def latest_values(self, location_ids, start_datetime=None,
+                      end_datetime=None):
+        return dict((location_id, (utc(2012, 11, 13, 14, 0), 14.0))
+                    for location_id in location_ids)
+
 
 def factory():
     return [DummyDataSource()]
@@ -4,22 +4,206 @@
 from __future__ import print_function, unicode_literals
 from __future__ import absolute_import, division
 
-from functools import wraps
+from collections import OrderedDict
+from functools import partial
+from functools import update_wrapper
+import hashlib
+import logging
+import threading
+import time
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 
-def memoize(f):
+logger = logging.getLogger(__name__)
+
+MEMOIZE_MAX_SIZE = getattr(settings, 'DATASOURCE_MEMOIZE_MAX_SIZE', 1000)
+# Versions are kept as long as memcached allows a relative timeout.
+VERSION_TIMEOUT = 30 * 24 * 60 * 60
+
+# All memoized functions, for memoize_stats().
+_memoized = []
+
+
+class Memoized(object):
+    """Function f with remembered results, see memoize."""
+
+    def __init__(self, f, max_size=MEMOIZE_MAX_SIZE, timeout=None,
+                 use_django_cache=False, invalidated_by=(), key=None):
+        if use_django_cache and key is None:
+            # The default key is the repr of the arguments, which for most
+            # objects contains their address and so differs per process.
+            raise ValueError(
+                "memoize(use_django_cache=True) needs a key function.")
+        self.f = f
+        self.key = key
+        self.name = '%s.%s' % (f.__module__, f.__name__)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.use_django_cache = use_django_cache
+        self.invalidated_by = tuple(invalidated_by)
+        self.hits = 0
+        self.misses = 0
+        # key -> (expires, result), least recently used first.
+        self._results = OrderedDict()
+        # Version of the results, see _check_version.
+        self._version = None
+        self._lock = threading.Lock()
+        update_wrapper(self, f)
+
+        for model in invalidated_by:
+            post_save.connect(self.invalidate, sender=model, weak=False)
+            post_delete.connect(self.invalidate, sender=model, weak=False)
+        _memoized.append(self)
+
+    def __get__(self, instance, owner=None):
+        """Support memoized methods; the instance is part of the key."""
+        if instance is None:
+            return self
+        return partial(self.__call__, instance)
+
+    def __call__(self, *args, **kwargs):
+        if self.key is not None:
+            key = self.key(*args, **kwargs)
+        else:
+            key = (tuple(args), tuple(sorted(kwargs.items())))
+        if self.use_django_cache:
+            return self._call_django_cache(key, args, kwargs)
+
+        if self.invalidated_by:
+            self._check_version()
+
+        now = time.time()
+        with self._lock:
+            found = self._results.pop(key, None)
+            if found is not None and (found[0] is None or found[0] > now):
+                # Mark as recently used.
+                self._results[key] = found
+                self.hits += 1
+                return found[1]
+            self.misses += 1
+
+        result = self.f(*args, **kwargs)
+        expires = now + self.timeout if self.timeout else None
+        with self._lock:
+            self._results[key] = (expires, result)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return result
+
+    def _version_key(self):
+        return 'lizard_datasource.memoize::%s::version' % self.name
+
+    def _check_version(self):
+        """Forget all results if another process invalidated them."""
+        version = cache_version(self._version_key())
+        with self._lock:
+            if version != self._version:
+                self._results.clear()
+                self._version = version
+
+    def _call_django_cache(self, key, args, kwargs):
+        """Remember results in the Django cache, shared by all processes.
+
+        Invalidation bumps a version that is part of the cache keys.
+        """
+        version = cache_version(self._version_key())
+        cache_key = 'lizard_datasource.memoize::%s::%s::%s' % (
+            self.name, version, hashlib.md5(repr(key)).hexdigest())
+        found = cache.get(cache_key)
+        if found is not None:
+            # Results are wrapped in a tuple, so None can be remembered.
+            with self._lock:
+                self.hits += 1
+            return found[0]
+        with self._lock:
+            self.misses += 1
+
+        result = self.f(*args, **kwargs)
+        if self.timeout is None:
+            # No timeout means the default timeout of the cache backend.
+            cache.set(cache_key, (result,))
+        else:
+            cache.set(cache_key, (result,), self.timeout)
+        return result
+
+    def invalidate(self, sender=None, **kwargs):
+        """Forget all results.
+
+        Connected to the post_save and post_delete signals of the models
+        in invalidated_by.
+        """
+        logger.debug("Invalidating memoized %s.", self.name)
+        with self._lock:
+            self._results.clear()
+        if self.use_django_cache or self.invalidated_by:
+            bump_cache_version(self._version_key())
+
+    def stats(self):
+        """Return hits, misses and number of remembered results."""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._results)}
+
+
+def memoize(f=None, max_size=MEMOIZE_MAX_SIZE, timeout=None,
+            use_django_cache=False, invalidated_by=(), key=None):
     """Remember the results of function f and immediately return a
-    remembered result if it's called with the same arguments again."""
-    memo_cache = dict()
+    remembered result if it's called with the same arguments again.
+
+    Use as @memoize, or with arguments:
+
+    - max_size: number of results remembered, the least recently used are
+      forgotten first (default DATASOURCE_MEMOIZE_MAX_SIZE, 1000).
+    - timeout: seconds a result is remembered (default forever, or with
+      use_django_cache the default timeout of the cache backend, which is
+      CACHES['default']['TIMEOUT'], 300 seconds unless configured).
+    - use_django_cache: remember results in the Django cache instead of in
+      this process, so they are shared by all processes. Results must be
+      picklable, max_size doesn't apply. Needs a key function that
+      returns the same key for the same arguments in every process.
+    - invalidated_by: models whose saves and deletes make the function
+      forget all results, in all processes: a save bumps a version in the
+      Django cache that every call checks.
+    - key: function that returns the key a result is remembered under,
+      given the same arguments (default: the arguments themselves).
+
+    The memoized function has invalidate() and stats() methods.
+    """
+    def decorator(f):
+        return Memoized(f, max_size=max_size, timeout=timeout,
+                        use_django_cache=use_django_cache,
+                        invalidated_by=invalidated_by, key=key)
+    if f is not None:
+        return decorator(f)
+    return decorator
+
+
+def cache_version(version_key):
+    """Return the version stored in the Django cache under version_key.
+
+    Versions let all processes know that something they cached changed,
+    see bump_cache_version. A missing version is started at the current
+    time, so it can't come back as a version that was used before."""
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, int(time.time()), VERSION_TIMEOUT)
+        version = cache.get(version_key, 0)
+    return version
 
-    @wraps(f)
-    def memoed(*args, **kwargs):
-        # Construct a key to use in the memo_cache
-        key = (tuple(args), tuple(kwargs.items()))
 
-        if key not in memo_cache:
-            memo_cache[key] = f(*args, **kwargs)
+def bump_cache_version(version_key):
+    """Change the version stored in the Django cache under version_key."""
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        # Not in the cache (anymore).
+        cache.set(version_key, int(time.time()), VERSION_TIMEOUT)
 
-        return memo_cache[key]
 
-    return memoed
+def memoize_stats():
+    """Return {name: stats} of all memoized functions of this process."""
+    return dict((memoized.name, memoized.stats()) for memoized in _memoized)
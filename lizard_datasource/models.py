@@ -6,6 +6,7 @@ import logging
 import math
 
 from django.db import models
+from django.utils import simplejson
 from django.utils.translation import ugettext_lazy as _
 import colorful.fields
 
@@ -38,6 +39,9 @@ class DatasourceModel(models.Model):
     script_times_to_run_per_day = models.IntegerField(default=24)
     script_last_run_started = models.DateTimeField(null=True)
     script_run_next_opportunity = models.BooleanField(default=False)
+    # JSON list of the choices_made of the drawable layers that the
+    # script found the last time it ran, to compare the next run with.
+    discovered_layers = models.TextField(null=True, blank=True)
 
     def __unicode__(self):
         return "'{0}' from app '{1}'".format(
@@ -49,16 +53,37 @@ class DatasourceModel(models.Model):
         if will do nothing this time.
 
         If True is returned, it is assumed that the script will run now,
-        and that is recorded."""
+        and that is recorded. Like update_discovered_layers(), without
+        save(), so the caches that listen to post_save stay valid."""
 
         if self.cache_script_is_due():
             self.script_last_run_started = dates.utc_now()
             self.script_run_next_opportunity = False
-            self.save()
+            DatasourceModel.objects.filter(pk=self.pk).update(
+                script_last_run_started=self.script_last_run_started,
+                script_run_next_opportunity=False)
             return True
         else:
             return False
 
+    def update_discovered_layers(self, choices_mades):
+        """Record the choices_made JSON of the drawable layers found by
+        the cache script.
+
+        Only that field is updated, and without save(), so that the
+        post_save signal doesn't invalidate the cached datasources and
+        criteria on every run of the script.
+
+        Returns (new, gone): the layers that weren't found the last time
+        and the layers that aren't found anymore. The first time, all
+        layers are new."""
+        previous = set(simplejson.loads(self.discovered_layers or '[]'))
+        current = set(choices_mades)
+        self.discovered_layers = simplejson.dumps(sorted(current))
+        DatasourceModel.objects.filter(pk=self.pk).update(
+            discovered_layers=self.discovered_layers)
+        return sorted(current - previous), sorted(previous - current)
+
     def cache_script_is_due(self):
         if self.script_run_next_opportunity:
             return True
@@ -1,7 +1,17 @@
+from collections import OrderedDict
+from collections import deque
+from multiprocessing.pool import ThreadPool
 import datetime
 import logging
+import threading
 import time
 
+from django.conf import settings
+from django.db import close_connection
+from django.db import transaction
+
+from lizard_ui.multitenancy import set_host
+
 from lizard_datasource import datasource
 from lizard_datasource import dates
 from lizard_datasource import models
@@ -9,39 +19,231 @@ from lizard_datasource import properties
 
 logger = logging.getLogger(__name__)
 
+# Latest values are fetched for this many locations at a time.
+CACHE_BATCH_SIZE = getattr(settings, 'DATASOURCE_CACHE_BATCH_SIZE', 100)
+# Requests to the datasources per second, for all layers together. 0
+# means no limit.
+CACHE_REQUESTS_PER_SECOND = getattr(
+    settings, 'DATASOURCE_CACHE_REQUESTS_PER_SECOND', 1)
+# Locations without a cached value are searched this far back.
+CACHE_DAYS_BACK = 60
+# Threads that explore the criteria of a datasource to find its drawable
+# layers. 1 explores them one at a time, in this thread.
+DISCOVERY_WORKERS = getattr(settings, 'DATASOURCE_DISCOVERY_WORKERS', 4)
+# Criteria tree nodes explored per second, by all discovery workers
+# together. Separate from the latest values requests, because most nodes
+# are answered from the criteria cache. 0 means no limit.
+DISCOVERY_REQUESTS_PER_SECOND = getattr(
+    settings, 'DATASOURCE_DISCOVERY_REQUESTS_PER_SECOND', 0)
+
+
+class RequestBudget(object):
+    """Limits the requests done by cache_latest_values() to
+    requests_per_second, over all datasources and layers.
+
+    Requests are only slowed down when they would go over budget: spend()
+    then sleeps until the budget is back to zero. Budget that isn't used
+    accumulates, up to one second worth of requests."""
+
+    def __init__(self, requests_per_second):
+        self.requests_per_second = requests_per_second
+        self._available = max(1, requests_per_second)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def spend(self, requests=1):
+        if not self.requests_per_second:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._available = min(
+                max(1, self.requests_per_second),
+                self._available +
+                (now - self._updated) * self.requests_per_second)
+            self._updated = now
+            self._available -= requests
+            wait = -self._available / self.requests_per_second
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+request_budget = RequestBudget(CACHE_REQUESTS_PER_SECOND)
+discovery_budget = RequestBudget(DISCOVERY_REQUESTS_PER_SECOND)
+
 
-def _yield_drawable_datasources(ds):
+def _explore(ds, choices_made, budget):
+    """Explore the node of the criteria tree of ds at choices_made.
+
+    Returns (drawable, children): whether ds is drawable with these
+    choices made and, if it isn't, the choices_mades of the nodes below
+    it. Works on a copy of ds, so nodes can be explored in parallel.
+
+    Exploring a node may query the datasource, so it is spent from
+    budget like a request."""
+    budget.spend()
+    node = ds.copy()
+    node.set_choices_made(choices_made)
+    if node.is_drawable(choices_made):
+        return True, []
+
+    children = []
+    criteria = node.chooseable_criteria()
+    if criteria:
+        criterion = criteria[0]['criterion']
+        options = criteria[0]['options']
+        logger.debug("Choices made {0}: {1} options for criterion {2}".format(
+                choices_made, len(options), criterion))
+        for option in options.iter_options():
+            children.append(choices_made.add(
+                    criterion.identifier, option.identifier))
+    return False, children
+
+
+def _explore_in_thread(ds, choices_made, host, budget):
+    if host is not None:
+        # The database host of Lizard 5 multitenancy is per thread.
+        set_host(host)
+    try:
+        return _explore(ds, choices_made, budget)
+    finally:
+        # Django opened a database connection for this thread, if the
+        # datasource used the database.
+        close_connection()
+
+
+def _yield_drawable_datasources(ds, workers=None, host=None, budget=None):
     # This implements a breadth-first search that tries to visit all
     # drawable layers and yields their choices made objects. The case
     # where ChoicesMade is empty functions as the root of the tree.
-    choices_mades = [datasource.ChoicesMade()]
-
-    while choices_mades:
-        choices_made = choices_mades.pop(0)
-        ds.set_choices_made(choices_made)
-
-        if ds.is_drawable(choices_made):
-            yield ds
-        else:
-            criteria = ds.chooseable_criteria()
-            print("CHOICES_MADE: {0}".format(choices_made))
-            if criteria:
-                criterion = criteria[0]['criterion']
-                print("CRITERION: {0}".format(criterion))
-                options = criteria[0]['options']
-                for option in options.iter_options():
-                    print("CHOICE: {0}".format(option))
-                    choices_mades.append(choices_made.add(
-                            criterion.identifier, option.identifier))
-
-
-def cache_latest_values(ds):
+    #
+    # With more than one worker, nodes are explored by a pool of
+    # threads as soon as they are found, but their results are
+    # handled in the order in which they were found. So the order of
+    # the layers doesn't depend on the number of workers.
+    #
+    # Every explored node is spent from budget (default: the shared
+    # discovery_budget, DATASOURCE_DISCOVERY_REQUESTS_PER_SECOND).
+    if workers is None:
+        workers = DISCOVERY_WORKERS
+    budget = budget or discovery_budget
+    pool = ThreadPool(workers) if workers > 1 else None
+
+    def explore_later(choices_made):
+        if pool is None:
+            return choices_made, None
+        return choices_made, pool.apply_async(
+            _explore_in_thread, (ds, choices_made, host, budget))
+
+    pending = deque([explore_later(datasource.ChoicesMade())])
+    try:
+        while pending:
+            choices_made, result = pending.popleft()
+            if result is None:
+                drawable, children = _explore(ds, choices_made, budget)
+            else:
+                drawable, children = result.get()
+
+            if drawable:
+                ds.set_choices_made(choices_made)
+                yield ds
+            pending.extend(explore_later(child) for child in children)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _implements_latest_values(drawable):
+    """Return whether the class of drawable overrides the latest_values()
+    of DataSource, which returns None without doing a request."""
+    method = getattr(type(drawable), 'latest_values', None)
+    return (getattr(method, 'im_func', method) is not
+            datasource.DataSource.latest_values.im_func)
+
+
+def _latest_values(drawable, start_datetimes, end_datetime, budget):
+    """Return {location_id: (timestamp, value)} of the locations in
+    start_datetimes, a dict {location_id: start_datetime}.
+
+    Uses the latest_values() of the datasource, which costs one request
+    for all locations, if it has one; one timeseries() per location
+    otherwise. If the datasource implements latest_values(), it is spent
+    from budget before it is asked, as it may do a request before it
+    returns.
+
+    Only the dummy datasource implements latest_values() so far, the
+    others fall back to timeseries(). At the default of 1 request per
+    second, a layer of 2,000 locations then still takes over half an
+    hour."""
+    if _implements_latest_values(drawable):
+        budget.spend()
+    latest_values = drawable.latest_values(
+        list(start_datetimes),
+        start_datetime=min(start_datetimes.values()),
+        end_datetime=end_datetime)
+    if latest_values is not None:
+        return latest_values
+
+    latest_values = {}
+    for location_id, start_datetime in start_datetimes.items():
+        budget.spend()
+        timeseries = drawable.timeseries(
+            location_id,
+            start_datetime=start_datetime,
+            end_datetime=end_datetime)
+        if timeseries is None or len(timeseries) == 0:
+            continue
+
+        latest = timeseries.latest()
+        if len(latest) == 0:
+            continue
+        latest_values[location_id] = (latest.keys()[0], latest[0])
+    return latest_values
+
+
+def _store_latest_values(datasource_layer, caches, latest_values):
+    """Store latest_values in DatasourceCache, in one transaction.
+
+    caches are the existing DatasourceCache objects of the layer, by
+    location id. New ones are inserted at once, but changed ones are
+    updated with one query each: Django has no bulk update or upsert."""
+    new_caches = []
+    with transaction.commit_on_success():
+        for location_id, (timestamp, value) in latest_values.items():
+            cache = caches.get(location_id)
+            if cache is None:
+                new_caches.append(models.DatasourceCache(
+                        datasource_layer=datasource_layer,
+                        locationid=location_id,
+                        timestamp=timestamp,
+                        value=value))
+            elif cache.timestamp != timestamp or cache.value != value:
+                models.DatasourceCache.objects.filter(pk=cache.pk).update(
+                    timestamp=timestamp, value=value)
+        models.DatasourceCache.objects.bulk_create(new_caches)
+
+
+def cache_latest_values(ds, budget=None, host=None):
     """IF the datasource has both LAYER_POINTS and
     DATA_CAN_HAVE_VALUE_LAYER_SCRIPT source, then we can make an
     instance of DatasourceLayer for each of its layers, get a
     timeseries for each location in each layer and cache its latest
     value. Then this information can be used for colouring,
-    thresholding, et cetera."""
+    thresholding, et cetera.
+
+    Latest values are fetched CACHE_BATCH_SIZE locations at a time, with
+    the requests to the datasource limited by budget (default: the
+    request_budget shared by all datasources), and stored per layer.
+
+    Pass the host for Lizard 5 multitenancy, if it was set, so that
+    threads that explore the layers of ds use its database too."""
+    budget = budget or request_budget
 
     if (not ds.has_property(properties.LAYER_POINTS) or
         not ds.has_property(
@@ -52,10 +254,12 @@ def cache_latest_values(ds):
     if not ds.activation_for_cache_script():
         return
 
-    for drawable in _yield_drawable_datasources(ds):
+    discovered_layers = []
+    for drawable in _yield_drawable_datasources(ds, host=host):
         # This creates the datasource layer in the database, if it
         # didn't exist yet
         datasource_layer = drawable.datasource_layer
+        discovered_layers.append(datasource_layer.choices_made)
 
         # Cache the datasource layer's unit, if it wasn't filled in yet
         drawable.cached_unit()
@@ -65,32 +269,43 @@ def cache_latest_values(ds):
         if not datasource_layer.latest_values_used:
             continue
 
-        locations = drawable.locations()
-        for location in locations:
-            try:
-                cache = models.DatasourceCache.objects.get(
-                    datasource_layer=datasource_layer,
-                    locationid=location.identifier)
-            except models.DatasourceCache.DoesNotExist:
-                cache = models.DatasourceCache(
-                    datasource_layer=datasource_layer,
-                    locationid=location.identifier)
-
-            if cache.timestamp:
-                start_datetime = cache.timestamp
+        caches = dict(
+            (cache.locationid, cache) for cache in
+            models.DatasourceCache.objects.filter(
+                datasource_layer=datasource_layer))
+
+        end_datetime = dates.utc_now()
+        default_start_datetime = end_datetime - datetime.timedelta(
+            days=CACHE_DAYS_BACK)
+        start_datetimes = OrderedDict()
+        for location in drawable.locations():
+            cache = caches.get(location.identifier)
+            if cache is not None and cache.timestamp:
+                start_datetimes[location.identifier] = cache.timestamp
             else:
-                start_datetime = dates.utc_now() - datetime.timedelta(days=60)
+                start_datetimes[location.identifier] = (
+                    default_start_datetime)
 
-            timeseries = drawable.timeseries(
-                location.identifier,
-                start_datetime=start_datetime,
-                end_datetime=dates.utc_now())
-            if timeseries is None or len(timeseries) == 0:
-                continue
+        latest_values = {}
+        for location_ids in _batches(list(start_datetimes), CACHE_BATCH_SIZE):
+            try:
+                latest_values.update(_latest_values(
+                        drawable,
+                        OrderedDict((location_id, start_datetimes[location_id])
+                                    for location_id in location_ids),
+                        end_datetime, budget))
+            except Exception:
+                logger.exception(
+                    "Skipping latest values of {0} locations of {1}".format(
+                        len(location_ids), datasource_layer))
 
-            latest = timeseries.latest()
+        _store_latest_values(datasource_layer, caches, latest_values)
 
-            cache.timestamp = latest.keys()[0]
-            cache.value = latest[0]
-            cache.save()
-            time.sleep(1)
+    new_layers, gone_layers = ds.datasource_model.update_discovered_layers(
+        discovered_layers)
+    if new_layers or gone_layers:
+        logger.info(
+            "{0}: {1} drawable layers, {2} new and {3} gone since the "
+            "last run".format(
+                ds.datasource_model, len(discovered_layers),
+                len(new_layers), len(gone_layers)))
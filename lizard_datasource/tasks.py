@@ -22,6 +22,6 @@ def cache_latest_values(*args, **options):
 
     for ds in datasource.datasources_from_entrypoints():
         try:
-            scripts.cache_latest_values(ds)
+            scripts.cache_latest_values(ds, host=options.get('host'))
         except:
             logger.exception('skipping datasource {0}'.format(ds))
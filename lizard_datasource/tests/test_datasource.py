@@ -1,10 +1,12 @@
 import mock
+import time
 
 from unittest import TestCase
 
 from lizard_datasource import datasource
 from lizard_datasource import dummy_datasource
 from lizard_datasource import criteria
+from lizard_datasource import functools
 
 
 class TestChoicesMade(TestCase):
@@ -83,6 +85,13 @@ class TestChoicesMade(TestCase):
                           """{"a": "b", "test": "value"}""")
         cm = datasource.ChoicesMade(a="value", b="value")
 
+    def test_equal_choices_made_are_equal(self):
+        cm1 = datasource.ChoicesMade(test="value")
+        cm2 = datasource.ChoicesMade(json='{"test": "value"}')
+        self.assertEquals(cm1, cm2)
+        self.assertEquals(hash(cm1), hash(cm2))
+        self.assertNotEquals(cm1, cm1.add("test2", "value"))
+
     def test_unicode_gives_useful_repr(self):
         cm = datasource.ChoicesMade(test="value")
         from lizard_datasource.datasource import ChoicesMade
@@ -295,10 +304,17 @@ class TestDatasourcesFromEntrypointsFunction(TestCase):
 
 
 class TestGetDatasources(TestCase):
+    def setUp(self):
+        datasource.datasource_registry.invalidate()
+
+    def tearDown(self):
+        datasource.datasource_registry.invalidate()
+
     def test_returns_applicable_datasource(self):
         ds = mock.MagicMock()
         ds.visible = True
         ds.is_applicable = lambda choices_made: True
+        ds.copy.return_value = ds
 
         with mock.patch(
             'lizard_datasource.datasource.datasources_from_entrypoints',
@@ -308,6 +324,129 @@ class TestGetDatasources(TestCase):
                 [ds])
 
 
+class TestChooseableCriteria(TestCase):
+    def setUp(self):
+        datasource.DataSource._chooseable_criteria.invalidate()
+        self.ds = dummy_datasource.DummyDataSource()
+        self.ds.set_choices_made(datasource.ChoicesMade())
+
+    def tearDown(self):
+        datasource.DataSource._chooseable_criteria.invalidate()
+
+    def test_first_letter_is_chooseable(self):
+        criteria = self.ds.chooseable_criteria()
+        self.assertEquals(
+            [crit['criterion'].identifier for crit in criteria],
+            ['first_letter'])
+
+    def test_criteria_are_remembered_per_choices_made(self):
+        options_for_criterion = self.ds.options_for_criterion
+        with mock.patch.object(
+            dummy_datasource.DummyDataSource, 'options_for_criterion',
+            side_effect=options_for_criterion) as mocked:
+            self.ds.chooseable_criteria()
+            calls = mocked.call_count
+            other = dummy_datasource.DummyDataSource()
+            other.set_choices_made(datasource.ChoicesMade())
+            other.chooseable_criteria()
+            self.assertEquals(mocked.call_count, calls)
+
+            other.set_choices_made(datasource.ChoicesMade(appname='other'))
+            other.chooseable_criteria()
+            self.assertTrue(mocked.call_count > calls)
+
+    def test_criteria_are_remembered_per_host(self):
+        with mock.patch('lizard_datasource.datasource.get_host',
+                        return_value='a.example.com'):
+            key_a = datasource._criteria_key(self.ds)
+        with mock.patch('lizard_datasource.datasource.get_host',
+                        return_value='b.example.com'):
+            key_b = datasource._criteria_key(self.ds)
+        self.assertNotEquals(key_a, key_b)
+
+    def test_callers_get_their_own_copy(self):
+        criteria1 = self.ds.chooseable_criteria()
+        criteria2 = self.ds.chooseable_criteria()
+        self.assertFalse(criteria1 is criteria2)
+        self.assertFalse(criteria1[0]['options'] is criteria2[0]['options'])
+
+
+class RegisteredDataSource(datasource.DataSource):
+    identifier = 'test'
+    originating_app = 'testapp'
+
+
+class TestDatasourceRegistry(TestCase):
+    def setUp(self):
+        self.registry = datasource.DatasourceRegistry()
+        self.ds = RegisteredDataSource()
+        self.ds._dsm = mock.MagicMock()
+
+    def patched_entrypoints(self):
+        return mock.patch(
+            'lizard_datasource.datasource.datasources_from_entrypoints',
+            return_value=[self.ds])
+
+    def test_entrypoints_are_loaded_once(self):
+        with self.patched_entrypoints() as patched:
+            self.registry.datasources()
+            self.registry.get('testapp', 'test')
+            self.assertEquals(patched.call_count, 1)
+
+    def test_invalidate_loads_entrypoints_again(self):
+        with self.patched_entrypoints() as patched:
+            self.registry.datasources()
+            self.registry.invalidate()
+            self.registry.datasources()
+            self.assertEquals(patched.call_count, 2)
+
+    def test_datasources_are_loaded_per_host(self):
+        with self.patched_entrypoints() as patched:
+            with mock.patch('lizard_datasource.datasource.get_host',
+                            return_value='a.example.com'):
+                self.registry.datasources()
+            with mock.patch('lizard_datasource.datasource.get_host',
+                            return_value='b.example.com'):
+                self.registry.datasources()
+                self.registry.datasources()
+            self.assertEquals(patched.call_count, 2)
+
+    def test_invalidation_by_other_process_loads_entrypoints_again(self):
+        with self.patched_entrypoints() as patched:
+            self.registry.datasources()
+            functools.bump_cache_version(self.registry.VERSION_KEY)
+            self.registry.datasources()
+            self.assertEquals(patched.call_count, 2)
+
+    def test_entrypoints_are_loaded_again_after_timeout(self):
+        self.registry.timeout = 10
+        with self.patched_entrypoints() as patched:
+            self.registry.datasources()
+            with mock.patch('time.time', return_value=time.time() + 11):
+                self.registry.datasources()
+            self.assertEquals(patched.call_count, 2)
+
+    def test_get_returns_copy(self):
+        with self.patched_entrypoints():
+            found = self.registry.get('testapp', 'test')
+        self.assertTrue(isinstance(found, datasource.DataSource))
+        self.assertFalse(found is self.ds)
+        self.assertEquals(found.identifier, 'test')
+
+    def test_get_returns_none_for_unknown_datasource(self):
+        with self.patched_entrypoints():
+            self.assertEquals(self.registry.get('testapp', 'other'), None)
+
+    def test_copies_have_their_own_choices_made(self):
+        with self.patched_entrypoints():
+            ds1, = self.registry.datasources()
+            ds2, = self.registry.datasources()
+        ds1.set_choices_made(datasource.ChoicesMade(test='1'))
+        ds2.set_choices_made(datasource.ChoicesMade(test='2'))
+        self.assertEquals(ds1._choices_made['test'], '1')
+        self.assertEquals(ds2._choices_made['test'], '2')
+
+
 class TestDataSourceFunction(TestCase):
     def test_if_there_are_no_datasources_returns_none(self):
         with mock.patch('lizard_datasource.datasource.get_datasources',
@@ -1,8 +1,14 @@
 """Tests for lizard_datasource.functools"""
 
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_save
 from django.test import TestCase
+import mock
 
 from lizard_datasource import functools
+from lizard_datasource.models import DatasourceLayer
 
 
 class TestMemoized(TestCase):
@@ -24,3 +30,105 @@ class TestMemoized(TestCase):
         o1 = helper(1)
         o2 = helper(2)
         self.assertFalse(o1 is o2)
+
+    def test_least_recently_used_is_forgotten(self):
+        @functools.memoize(max_size=2)
+        def helper(arg):
+            return object()
+
+        o1 = helper(1)
+        helper(2)
+        helper(1)
+        helper(3)  # Forgets 2
+        self.assertTrue(helper(1) is o1)
+        self.assertEquals(helper.stats()['size'], 2)
+
+    def test_timeout(self):
+        @functools.memoize(timeout=10)
+        def helper(arg):
+            return object()
+
+        o1 = helper(1)
+        with mock.patch('time.time', return_value=time.time() + 11):
+            o2 = helper(1)
+        self.assertFalse(o1 is o2)
+
+    def test_stats(self):
+        @functools.memoize
+        def helper(arg):
+            return arg
+
+        helper(1)
+        helper(1)
+        helper(2)
+        self.assertEquals(helper.stats(),
+                          {'hits': 1, 'misses': 2, 'size': 2})
+        self.assertTrue(helper.name in functools.memoize_stats())
+
+    def test_invalidated_by_model(self):
+        @functools.memoize(invalidated_by=(DatasourceLayer,))
+        def helper(arg):
+            return object()
+
+        o1 = helper(1)
+        post_save.send(sender=DatasourceLayer, instance=None)
+        self.assertFalse(helper(1) is o1)
+
+    def test_invalidated_by_other_process(self):
+        @functools.memoize(invalidated_by=(DatasourceLayer,))
+        def helper(arg):
+            return object()
+
+        o1 = helper(1)
+        functools.bump_cache_version(helper._version_key())
+        self.assertFalse(helper(1) is o1)
+
+    def test_method(self):
+        class Helper(object):
+            @functools.memoize
+            def helper(self, arg):
+                return object()
+
+        instance = Helper()
+        self.assertTrue(instance.helper(1) is instance.helper(1))
+        self.assertFalse(instance.helper(1) is Helper().helper(1))
+
+    def test_key(self):
+        @functools.memoize(key=lambda arg: arg.lower())
+        def helper(arg):
+            return object()
+
+        self.assertTrue(helper('a') is helper('A'))
+
+
+class TestMemoizedDjangoCache(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_django_cache(self):
+        calls = []
+
+        @functools.memoize(use_django_cache=True, key=lambda arg: arg)
+        def helper(arg):
+            calls.append(arg)
+            return None
+
+        self.assertEquals(helper(1), None)
+        self.assertEquals(helper(1), None)
+        self.assertEquals(calls, [1])
+
+        helper.invalidate()
+        helper(1)
+        self.assertEquals(calls, [1, 1])
+
+    def test_django_cache_needs_key(self):
+        self.assertRaises(
+            ValueError, functools.memoize(use_django_cache=True),
+            lambda arg: arg)
+
+    def test_version_survives_missing_key(self):
+        version = functools.cache_version('test_version')
+        functools.bump_cache_version('test_version')
+        self.assertNotEquals(functools.cache_version('test_version'), version)
+        cache.delete('test_version')
+        self.assertNotEquals(functools.cache_version('test_version'), 0)
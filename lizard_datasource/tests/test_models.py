@@ -4,6 +4,7 @@ import mock
 
 from django.test import TestCase
 from lizard_datasource import dates
+from lizard_datasource import dummy_datasource
 from lizard_datasource import models
 
 
@@ -118,6 +119,46 @@ class TestDatasourceModel(TestCase):
                     script_last_run_started=dtlast,
                     script_run_next_opportunity=False).cache_script_is_due())
 
+    def test_update_discovered_layers_first_time_all_new(self):
+        dsm = DatasourceModelF.create()
+        self.assertEquals(
+            dsm.update_discovered_layers(['{"a": "1"}']),
+            (['{"a": "1"}'], []))
+
+    def test_update_discovered_layers_returns_new_and_gone(self):
+        dsm = DatasourceModelF.create()
+        dsm.update_discovered_layers(['{"a": "1"}', '{"a": "2"}'])
+        dsm = models.DatasourceModel.objects.get(pk=dsm.pk)
+        self.assertEquals(
+            dsm.update_discovered_layers(['{"a": "2"}', '{"a": "3"}']),
+            (['{"a": "3"}'], ['{"a": "1"}']))
+
+    def test_update_discovered_layers_doesnt_send_post_save(self):
+        dsm = DatasourceModelF.create()
+        with mock.patch('django.db.models.signals.post_save.send') as send:
+            dsm.update_discovered_layers(['{"a": "1"}'])
+            self.assertFalse(send.called)
+        self.assertEquals(
+            models.DatasourceModel.objects.get(pk=dsm.pk).discovered_layers,
+            '["{\\"a\\": \\"1\\"}"]')
+
+    def test_activation_for_cache_script_doesnt_send_post_save(self):
+        dsm = DatasourceModelF.create(script_run_next_opportunity=True)
+        with mock.patch('django.db.models.signals.post_save.send') as send:
+            self.assertTrue(dsm.activation_for_cache_script())
+            self.assertFalse(send.called)
+        dsm = models.DatasourceModel.objects.get(pk=dsm.pk)
+        self.assertFalse(dsm.script_run_next_opportunity)
+        self.assertTrue(dsm.script_last_run_started is not None)
+
+    def test_datasource_model_is_created_without_post_save(self):
+        ds = dummy_datasource.DummyDataSource()
+        with mock.patch('django.db.models.signals.post_save.send') as send:
+            dsm = ds.datasource_model
+            self.assertFalse(send.called)
+        self.assertEquals(dsm.identifier, ds.identifier)
+        self.assertTrue(dsm.pk is not None)
+
 
 class TestDatasourceLayer(TestCase):
     def test_has_unicode(self):
@@ -1,17 +1,166 @@
 """Tests for lizard_datasource.scripts."""
 
+import threading
+import time
+
 import mock
 
 from django.test import TestCase
 
 from lizard_datasource import datasource
+from lizard_datasource import dummy_datasource
+from lizard_datasource import models
 from lizard_datasource import scripts
+from lizard_datasource.dates import utc
 
 
 class TestYieldLayers(TestCase):
     def test_drawable_datasource_returned(self):
         ds = mock.MagicMock()
         ds.is_drawable.return_value = True
-        layers = list(scripts._yield_drawable_datasources(ds))
+        layers = list(scripts._yield_drawable_datasources(
+                ds, budget=scripts.RequestBudget(0)))
         self.assertEquals(len(layers), 1)
         self.assertTrue(layers[0] is ds)
+
+    def yielded_letters(self, workers, budget=None):
+        return [drawable.get_choices_made()['first_letter']
+                for drawable in scripts._yield_drawable_datasources(
+                dummy_datasource.DummyDataSource(), workers=workers,
+                budget=budget or scripts.RequestBudget(0))]
+
+    def test_finds_all_layers(self):
+        self.assertEquals(self.yielded_letters(workers=1), ['ae', 'gz'])
+
+    def test_workers_find_layers_in_same_order(self):
+        self.assertEquals(self.yielded_letters(workers=4), ['ae', 'gz'])
+
+    def test_workers_overlap(self):
+        lock = threading.Lock()
+        running = [0]
+        most = [0]
+        is_drawable = dummy_datasource.DummyDataSource.is_drawable
+
+        def slow_is_drawable(ds, choices_made=None):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+            return is_drawable(ds, choices_made)
+
+        with mock.patch.object(dummy_datasource.DummyDataSource,
+                               'is_drawable', slow_is_drawable):
+            self.assertEquals(self.yielded_letters(workers=4), ['ae', 'gz'])
+        # Both children of the root are explored at the same time.
+        self.assertEquals(most[0], 2)
+
+    def test_discovery_has_its_own_budget(self):
+        with mock.patch.object(scripts.request_budget, 'spend') as spend:
+            with mock.patch.object(scripts.discovery_budget, 'spend'):
+                list(scripts._yield_drawable_datasources(
+                        dummy_datasource.DummyDataSource(), workers=4))
+            self.assertFalse(spend.called)
+
+    def test_workers_spend_budget(self):
+        budget = mock.MagicMock()
+        self.yielded_letters(workers=4, budget=budget)
+        # The root node and its two children.
+        self.assertEquals(budget.spend.call_count, 3)
+
+
+class TestRequestBudget(TestCase):
+    def test_requests_within_budget_dont_sleep(self):
+        budget = scripts.RequestBudget(10)
+        with mock.patch('time.sleep') as sleep:
+            budget.spend()
+            self.assertFalse(sleep.called)
+
+    def test_requests_over_budget_sleep(self):
+        budget = scripts.RequestBudget(1)
+        with mock.patch('time.sleep') as sleep:
+            budget.spend()
+            budget.spend()
+            self.assertTrue(sleep.called)
+            self.assertTrue(0 < sleep.call_args[0][0] <= 1)
+
+    def test_no_requests_per_second_means_no_limit(self):
+        budget = scripts.RequestBudget(0)
+        with mock.patch('time.sleep') as sleep:
+            for i in range(100):
+                budget.spend()
+            self.assertFalse(sleep.called)
+
+
+class TestLatestValues(TestCase):
+    def setUp(self):
+        self.ds = dummy_datasource.DummyDataSource()
+        self.ds.set_choices_made(datasource.ChoicesMade(
+                appname='lizard_datasource', first_letter='ae'))
+        self.start_datetimes = {
+            'amsterdam': utc(2012, 11, 1, 0, 0),
+            'almere': utc(2012, 11, 1, 0, 0)}
+        self.budget = mock.MagicMock()
+
+    def test_uses_latest_values_of_datasource(self):
+        with mock.patch.object(self.ds, 'timeseries') as timeseries:
+            latest_values = scripts._latest_values(
+                self.ds, self.start_datetimes, None, self.budget)
+            self.assertFalse(timeseries.called)
+        self.assertEquals(
+            latest_values['almere'],
+            (utc(2012, 11, 13, 14, 0), 14.0))
+        self.assertEquals(self.budget.spend.call_count, 1)
+
+    def test_falls_back_to_timeseries(self):
+        # Like the datasources that don't implement latest_values().
+        with mock.patch.object(
+            dummy_datasource.DummyDataSource, 'latest_values',
+            datasource.DataSource.__dict__['latest_values']):
+            latest_values = scripts._latest_values(
+                self.ds, self.start_datetimes, None, self.budget)
+        self.assertEquals(sorted(latest_values), ['almere', 'amsterdam'])
+        self.assertEquals(latest_values['amsterdam'][1], 14.0)
+        # Only one timeseries() per location.
+        self.assertEquals(self.budget.spend.call_count, 2)
+
+    def test_implemented_latest_values_returning_none_is_spent(self):
+        with mock.patch.object(self.ds, 'latest_values', return_value=None):
+            scripts._latest_values(
+                self.ds, self.start_datetimes, None, self.budget)
+        # The latest_values() call and one timeseries() per location.
+        self.assertEquals(self.budget.spend.call_count, 3)
+
+    def test_spends_budget_before_request(self):
+        def latest_values(*args, **kwargs):
+            self.assertEquals(self.budget.spend.call_count, 1)
+            return {}
+        with mock.patch.object(self.ds, 'latest_values',
+                               side_effect=latest_values):
+            scripts._latest_values(
+                self.ds, self.start_datetimes, None, self.budget)
+
+
+class TestStoreLatestValues(TestCase):
+    def setUp(self):
+        dsm = models.DatasourceModel.objects.create(
+            identifier='test', originating_app='test')
+        self.layer = models.DatasourceLayer.objects.create(
+            datasource_model=dsm, choices_made='{}')
+        self.timestamp = utc(2012, 11, 13, 14, 0)
+
+    def test_creates_and_updates_caches(self):
+        existing = models.DatasourceCache.objects.create(
+            datasource_layer=self.layer, locationid='old',
+            timestamp=self.timestamp, value=1.0)
+
+        scripts._store_latest_values(
+            self.layer, {'old': existing},
+            {'old': (self.timestamp, 2.0), 'new': (self.timestamp, 3.0)})
+
+        values = dict(
+            (cache.locationid, cache.value) for cache in
+            models.DatasourceCache.objects.filter(
+                datasource_layer=self.layer))
+        self.assertEquals(values, {'old': 2.0, 'new': 3.0})
@@ -1,7 +1,6 @@
 import datetime
 import logging
 import mapnik
-import math
 import os
 import pytz
 
@@ -23,6 +22,8 @@ from lizard_datasource import properties
 from lizard_datasource import datasource
 from lizard_datasource import functools
 
+from lizard_fancylayers import location_index
+
 logger = logging.getLogger(__name__)
 
 DEFAULT_COLOR = '0000ff'
@@ -90,6 +91,10 @@ def symbol_url(color):
 class FancyLayersAdapter(workspace.WorkspaceItemAdapter):
     """Registered as adapter_fancylayers."""
 
+    support_flot_graph_width = True
+    # Location colours come from the latest values of the datasource.
+    reuse_mapnik_map = False
+
     def __init__(self, *args, **kwargs):
         super(FancyLayersAdapter, self).__init__(*args, **kwargs)
 
@@ -140,33 +145,27 @@ class FancyLayersAdapter(workspace.WorkspaceItemAdapter):
         layers.append(layer)
         return layers, styles
 
+    def _location_index(self):
+        return location_index.location_index(
+            self.datasource, self.choices_made)
+
     def search(self, google_x, google_y, radius=None):
         """Return list of dict {'distance': <float>, 'timeserie':
         <timeserie>} of closest fews point that matches x, y, radius.
         """
-        def distance(x1, y1, x2, y2):
-            return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-
-        locations = self.datasource.locations()
+        found = self._location_index().search(google_x, google_y, radius)
 
         result = []
-        for location in locations:
-            x, y = coordinates.wgs84_to_google(
-                location.longitude,
-                location.latitude)
-            dist = distance(google_x, google_y, x, y)
-
-            if dist < radius:
-                result.append(
-                    {'distance': dist,
-                     'name': location.description(),
-                     'shortname': location.identifier,
-                     'workspace_item': self.workspace_item,
-                     'identifier': {'identifier': location.identifier},
-                     'google_coords': (x, y),
-                     'object': None})
-        result.sort(key=lambda item: item['distance'])
-        return result[:3]  # Max 3.
+        for dist, location, (x, y) in found[:3]:  # Max 3.
+            result.append(
+                {'distance': dist,
+                 'name': location.description(),
+                 'shortname': location.identifier,
+                 'workspace_item': self.workspace_item,
+                 'identifier': {'identifier': location.identifier},
+                 'google_coords': (x, y),
+                 'object': None})
+        return result
 
     def html(self, identifiers=None, layout_options=None):
         """Adapted version of lizard-map's html_default. If there are
@@ -222,15 +221,12 @@ class FancyLayersAdapter(workspace.WorkspaceItemAdapter):
         return symbol_url(html_to_mapnik(DEFAULT_COLOR))
 
     def location(self, identifier, layout=None):
-        locations = self.datasource.locations()
-        for location in locations:
-            if location.identifier == identifier:
-                break
-        else:
+        index = self._location_index()
+        location = index.location(identifier)
+        if location is None:
             return None
 
-        google_x, google_y = coordinates.wgs84_to_google(
-            location.longitude, location.latitude)
+        google_x, google_y = index.google_coords(identifier)
 
         identifier_to_return = {
             'identifier': identifier
@@ -276,12 +272,12 @@ class FancyLayersAdapter(workspace.WorkspaceItemAdapter):
 
     def flot_graph_data(
         self, identifiers, start_date, end_date, layout_extra=None,
-        raise_404_if_empty=False
+        raise_404_if_empty=False, width=None
     ):
         return self._render_graph(
             identifiers, start_date, end_date, layout_extra=layout_extra,
             raise_404_if_empty=raise_404_if_empty,
-            GraphClass=FlotGraph)
+            GraphClass=FlotGraph, width=width)
 
     def _render_graph(
         self, identifiers, start_date, end_date, layout_extra=None,
@@ -329,7 +325,7 @@ class FancyLayersAdapter(workspace.WorkspaceItemAdapter):
 
         line_styles = self.line_styles(identifiers)
 
-        locations = list(self.datasource.locations())
+        index = self._location_index()
         today = datetime.datetime.now()
 
         graph = GraphClass(
@@ -348,9 +344,7 @@ class FancyLayersAdapter(workspace.WorkspaceItemAdapter):
         for identifier in identifiers:
             location_id = identifier['identifier']
 
-            location_name = [
-                location.description() for location in locations
-                if location.identifier == location_id][0]
+            location_name = index.location(location_id).description()
 
             timeseries = self.datasource.timeseries(
                 location_id, start_date, end_date)
@@ -0,0 +1,132 @@
+"""Cached index of the locations of a fancylayers datasource.
+
+Every click on the map used to loop over all locations of the datasource,
+projecting each of them to google coordinates with pyproj, and every popup
+and graph scanned the locations again to find one by identifier. With tens of
+thousands of FEWS locations that's noticeable on every click.
+
+A LocationIndex projects all locations once, in one pyproj call, and keeps
+them sorted on x so a radius search only has to look at the band of
+locations within radius of the click; identifiers are looked up in a dict.
+Indexes are kept per host and ChoicesMade, for
+FANCYLAYERS_LOCATION_INDEX_TIMEOUT seconds (default 300) or until a
+datasource model or layer is saved or deleted.
+"""
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import, division
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from django.conf import settings
+import numpy
+
+from lizard_map import coordinates
+from lizard_map.utility import get_host
+
+logger = logging.getLogger(__name__)
+
+LOCATION_INDEX_TIMEOUT = getattr(
+    settings, 'FANCYLAYERS_LOCATION_INDEX_TIMEOUT', 5 * 60)
+# Number of datasources (ChoicesMade) kept indexed per process.
+LOCATION_INDEX_SIZE = 50
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+class LocationIndex(object):
+    """Locations of a datasource, projected to google coordinates."""
+
+    def __init__(self, locations):
+        self.locations = list(locations)
+        # The first location with an identifier wins, like in a linear scan.
+        self._positions = {}
+        for position, location in enumerate(self.locations):
+            self._positions.setdefault(location.identifier, position)
+
+        if self.locations:
+            self.xs, self.ys = coordinates.wgs84_to_google(
+                numpy.array([location.longitude for location in
+                             self.locations], dtype=numpy.float64),
+                numpy.array([location.latitude for location in
+                             self.locations], dtype=numpy.float64))
+        else:
+            self.xs = self.ys = numpy.zeros(0)
+        self._order = numpy.argsort(self.xs, kind='mergesort')
+        self._sorted_xs = self.xs[self._order]
+
+    def __len__(self):
+        return len(self.locations)
+
+    def location(self, identifier):
+        """Return location with identifier, or None."""
+        position = self._positions.get(identifier)
+        if position is None:
+            return None
+        return self.locations[position]
+
+    def google_coords(self, identifier):
+        """Return google (x, y) of location with identifier, or None."""
+        position = self._positions.get(identifier)
+        if position is None:
+            return None
+        return float(self.xs[position]), float(self.ys[position])
+
+    def search(self, google_x, google_y, radius):
+        """Return list of (distance, location, (x, y)) of the locations
+        within radius of google_x, google_y, closest first.
+
+        Without a radius nothing is found, like the linear scan this
+        replaces."""
+        if radius is None:
+            return []
+        left = numpy.searchsorted(self._sorted_xs, google_x - radius, 'left')
+        right = numpy.searchsorted(
+            self._sorted_xs, google_x + radius, 'right')
+        candidates = self._order[left:right]
+        distances = numpy.hypot(self.xs[candidates] - google_x,
+                                self.ys[candidates] - google_y)
+        within = distances < radius
+        candidates = candidates[within]
+        distances = distances[within]
+
+        result = []
+        for i in numpy.argsort(distances, kind='mergesort'):
+            position = candidates[i]
+            result.append(
+                (float(distances[i]), self.locations[position],
+                 (float(self.xs[position]), float(self.ys[position]))))
+        return result
+
+
+def location_index(datasource, choices_made):
+    """Return LocationIndex of datasource, cached per ChoicesMade."""
+    key = (get_host(), choices_made.json())
+    now = time.time()
+    with _indexes_lock:
+        found = _indexes.pop(key, None)
+        if found is not None and now - found[0] < LOCATION_INDEX_TIMEOUT:
+            # Mark as recently used.
+            _indexes[key] = found
+            return found[1]
+
+    logger.debug("Indexing locations of %s...", choices_made)
+    index = LocationIndex(datasource.locations())
+    with _indexes_lock:
+        _indexes[key] = (now, index)
+        while len(_indexes) > LOCATION_INDEX_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear(sender=None, **kwargs):
+    """Drop all location indexes of this process.
+
+    Connected to the post_save and post_delete signals of the datasource
+    models.
+    """
+    with _indexes_lock:
+        _indexes.clear()
@@ -1,7 +1,19 @@
 # (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.rst.
 from __future__ import unicode_literals
 
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+from lizard_datasource.models import DatasourceLayer
+from lizard_datasource.models import DatasourceModel
+
+from lizard_fancylayers import location_index
+
 # from django.db import models
 # from django.utils.translation import ugettext_lazy as _
 
 # Create your models here.
+
+for datasource_model in (DatasourceModel, DatasourceLayer):
+    post_save.connect(location_index.clear, sender=datasource_model)
+    post_delete.connect(location_index.clear, sender=datasource_model)
@@ -5,6 +5,7 @@ from lizard_datasource import datasource
 from lizard_datasource import location
 
 from lizard_fancylayers import layers
+from lizard_fancylayers import location_index
 
 
 class MockDataSource(datasource.DataSource):
@@ -18,6 +19,9 @@ class MockDataSource(datasource.DataSource):
 @mock.patch('lizard_datasource.datasource.get_datasources',
             return_value=[MockDataSource()])
 class TestAdapter(TestCase):
+    def setUp(self):
+        location_index.clear()
+
     def test_constructor_trivial(self, patched_datasource):
         workspace_item = mock.MagicMock()
 
@@ -0,0 +1,77 @@
+from django.test import TestCase
+import mock
+
+from lizard_datasource import datasource
+from lizard_datasource import location
+from lizard_map import coordinates
+
+from lizard_fancylayers import location_index
+
+
+class TestLocationIndex(TestCase):
+    def setUp(self):
+        self.locations = [
+            location.Location('a', 52.0, 5.0),
+            location.Location('b', 52.0, 5.001),
+            location.Location('c', 53.0, 6.0),
+            location.Location('a', 51.0, 4.0)]
+        self.index = location_index.LocationIndex(self.locations)
+
+    def test_location(self):
+        self.assertTrue(self.index.location('a') is self.locations[0])
+        self.assertEquals(self.index.location('unknown'), None)
+
+    def test_google_coords(self):
+        x, y = coordinates.wgs84_to_google(6.0, 53.0)
+        google_x, google_y = self.index.google_coords('c')
+        self.assertAlmostEquals(google_x, x)
+        self.assertAlmostEquals(google_y, y)
+
+    def test_search(self):
+        x, y = coordinates.wgs84_to_google(5.0, 52.0)
+        found = self.index.search(x, y, 1000)
+        self.assertEquals([item[1].identifier for item in found],
+                          ['a', 'b'])
+        self.assertAlmostEquals(found[0][0], 0)
+
+    def test_search_nothing_near(self):
+        self.assertEquals(self.index.search(0, 0, 1000), [])
+
+    def test_search_without_radius(self):
+        x, y = coordinates.wgs84_to_google(5.0, 52.0)
+        self.assertEquals(self.index.search(x, y, None), [])
+
+    def test_empty(self):
+        index = location_index.LocationIndex([])
+        self.assertEquals(index.search(0, 0, 1000), [])
+        self.assertEquals(index.location('a'), None)
+
+
+class TestLocationIndexCache(TestCase):
+    def setUp(self):
+        location_index.clear()
+        self.datasource = mock.Mock()
+        self.datasource.locations.return_value = [
+            location.Location('a', 52.0, 5.0)]
+
+    def test_index_is_cached(self):
+        choices_made = datasource.ChoicesMade(json='{"a": "b"}')
+        index1 = location_index.location_index(self.datasource, choices_made)
+        index2 = location_index.location_index(self.datasource, choices_made)
+        self.assertTrue(index1 is index2)
+        self.assertEquals(self.datasource.locations.call_count, 1)
+
+    def test_clear(self):
+        choices_made = datasource.ChoicesMade(json='{"a": "b"}')
+        location_index.location_index(self.datasource, choices_made)
+        location_index.clear()
+        location_index.location_index(self.datasource, choices_made)
+        self.assertEquals(self.datasource.locations.call_count, 2)
+
+    def test_timeout(self):
+        choices_made = datasource.ChoicesMade(json='{"a": "b"}')
+        with mock.patch(
+            'lizard_fancylayers.location_index.LOCATION_INDEX_TIMEOUT', 0):
+            location_index.location_index(self.datasource, choices_made)
+            location_index.location_index(self.datasource, choices_made)
+        self.assertEquals(self.datasource.locations.call_count, 2)
@@ -2,12 +2,15 @@
 Helper classes and functions for adapters
 """
 from __future__ import division
+from collections import OrderedDict
+import calendar
 import datetime
 import locale
 import math
 import numpy
 import pkg_resources
 import pytz
+import threading
 
 from dateutil.relativedelta import relativedelta
 from dateutil.rrule import YEARLY, MONTHLY, DAILY, HOURLY, MINUTELY, SECONDLY
@@ -19,8 +22,8 @@ from django.utils.translation import ugettext as _
 
 from lizard_map.matplotlib_settings import FONT_SIZE
 from lizard_map.matplotlib_settings import SCREEN_DPI
+from lizard_map.render_pool import render_pool
 
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from matplotlib.dates import AutoDateFormatter
 from matplotlib.dates import AutoDateLocator
 from matplotlib.dates import DateFormatter
@@ -87,13 +90,69 @@ def adapter_serialize(o):
     return json.dumps(o).replace('"', '%22').replace(' ', '%20')
 
 
+class AdapterRegistry(object):
+    """Adapter classes from the ADAPTER_ENTRY_POINT entry points.
+
+    The entry points are scanned once per process and every adapter
+    class is imported only once, lookups are a dict access.
+    """
+
+    def __init__(self, group=ADAPTER_ENTRY_POINT):
+        self.group = group
+        self._entrypoints = None
+        self._classes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def entrypoints(self):
+        if self._entrypoints is None:
+            with self._lock:
+                if self._entrypoints is None:
+                    entrypoints = OrderedDict()
+                    for entrypoint in pkg_resources.iter_entry_points(
+                            group=self.group):
+                        entrypoints.setdefault(entrypoint.name, entrypoint)
+                    self._entrypoints = entrypoints
+        return self._entrypoints
+
+    def names(self):
+        return self.entrypoints.keys()
+
+    def adapter_class(self, name):
+        """Return (imported) adapter class for entry point name."""
+        try:
+            return self._classes[name]
+        except KeyError:
+            pass
+        try:
+            entrypoint = self.entrypoints[name]
+        except KeyError:
+            raise AdapterClassNotFoundError(
+                u'Entry point for %r not found' % name)
+        try:
+            adapter = entrypoint.load()
+        except ImportError, e:
+            logger.critical("Invalid entry point: %s", e)
+            raise
+        self._classes[name] = adapter
+        return adapter
+
+    def clear(self):
+        """Forget everything, for instance after installing packages."""
+        with self._lock:
+            self._entrypoints = None
+            self._classes = {}
+
+
+adapter_registry = AdapterRegistry()
+
+
 def adapter_class_names():
     """Return allowed layer method names (from entrypoints)
 
     in tuple of 2-tuples
     """
-    entrypoints = [(entrypoint.name, entrypoint.name) for entrypoint in
-                   pkg_resources.iter_entry_points(group=ADAPTER_ENTRY_POINT)]
+    entrypoints = [(name, name) for name in adapter_registry.names()]
     return tuple(entrypoints)
 
 
@@ -116,20 +175,10 @@ def adapter_entrypoint(adapter_class, layer_arguments, workspace_item=None):
 
     Optionally give workspace_item, for legacy (must be factored out).
     """
-    # TODO: this happens more often than needed! Cache it.
-    for entrypoint in pkg_resources.iter_entry_points(
-            group=ADAPTER_ENTRY_POINT):
-        if entrypoint.name == adapter_class:
-            try:
-                adapter = entrypoint.load()
-            except ImportError, e:
-                logger.critical("Invalid entry point: %s", e)
-                raise
-            return adapter(workspace_item,
-                           layer_arguments=layer_arguments,
-                           adapter_class=adapter_class)
-    raise AdapterClassNotFoundError(
-        u'Entry point for %r not found' % adapter_class)
+    adapter = adapter_registry.adapter_class(adapter_class)
+    return adapter(workspace_item,
+                   layer_arguments=layer_arguments,
+                   adapter_class=adapter_class)
 
 
 # Graph stuff
@@ -687,10 +736,8 @@ class Graph(object):
                 l.set_verticalalignment('baseline')
                 l.set_position((0, -0.05))
 
-        canvas = FigureCanvas(self.figure)
-        response = HttpResponse(content_type='image/png')
-        canvas.print_png(response)
-        return response
+        png = render_pool.render_png(self.figure)
+        return HttpResponse(png, content_type='image/png')
 
     def render(self):
         '''
@@ -735,10 +782,67 @@ def mk_js_timestamp(datetime_utc, timezone=pytz.timezone(settings.TIME_ZONE)):
     return iso
 
 
+def _flot_x_number(x):
+    """Return x, a datetime or a number, as a number."""
+    if isinstance(x, datetime.datetime):
+        return calendar.timegm(x.utctimetuple()) + x.microsecond / 10 ** 6
+    return x
+
+
+def downsample_flot_data(data, x_min, x_max, buckets):
+    """Return data reduced to at most two points per bucket.
+
+    The range x_min..x_max is divided into buckets (typically one per pixel
+    of the graph) and of every bucket only the points with the lowest and the
+    highest value are kept, in their original order. So peaks stay intact,
+    while a year of 5 minute data shrinks from 100k points to a couple of
+    thousand. Missing values (None) are kept as one gap marker per bucket,
+    flot wouldn't break the line otherwise.
+
+    Data is a list of (x, y) pairs sorted on x. The x values, x_min and
+    x_max are numbers or datetimes, not the strings of mk_js_timestamp, so
+    downsample before converting them.
+    """
+    if buckets < 1 or len(data) <= 2 * buckets:
+        return data
+    x_min, x_max = _flot_x_number(x_min), _flot_x_number(x_max)
+    if x_max <= x_min:
+        return data
+
+    xvalues = numpy.array([_flot_x_number(x) for x, y in data],
+                          dtype=numpy.float64)
+    yvalues = numpy.array([numpy.nan if y is None else y for x, y in data],
+                          dtype=numpy.float64)
+    bucket_ids = numpy.floor(
+        (xvalues - x_min) / (x_max - x_min) * buckets).astype(numpy.int64)
+    bucket_ids = numpy.clip(bucket_ids, 0, buckets - 1)
+    # Bucket boundaries as indices into data
+    boundaries = numpy.searchsorted(bucket_ids, numpy.arange(buckets + 1))
+
+    keep = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        if start == end:
+            continue
+        bucket = yvalues[start:end]
+        missing = numpy.isnan(bucket)
+        if missing.any():
+            keep.append(start + int(numpy.argmax(missing)))
+            if missing.all():
+                continue
+            bucket = numpy.where(missing, numpy.inf, bucket)
+            keep.append(start + int(numpy.argmin(bucket)))
+            bucket = numpy.where(missing, -numpy.inf, bucket)
+            keep.append(start + int(numpy.argmax(bucket)))
+        else:
+            keep.append(start + int(numpy.argmin(bucket)))
+            keep.append(start + int(numpy.argmax(bucket)))
+    return [data[index] for index in sorted(set(keep))]
+
+
 class FlotGraphAxes(object):
     legend_ = None
 
-    def __init__(self, x_min=None, x_max=None):
+    def __init__(self, x_min=None, x_max=None, downsample_to=None):
         self.flot_data = []
         # ^^^ list of dicts in the format {'label': x, 'data':[(x, y), (x, y)]}
         self.y_min = None
@@ -747,6 +851,17 @@ class FlotGraphAxes(object):
         # bit hackish, x_min and x_max are needed to implement axhline() method
         self.x_min = x_min
         self.x_max = x_max
+        # (start_date, end_date, width): if given, series are reduced to
+        # at most two points per pixel of width, see downsample_flot_data.
+        self.downsample_to = downsample_to
+
+    def flot_series_data(self, xvalues, yvalues):
+        """Return list of (js timestamp, y), downsampled if needed."""
+        data = zip(xvalues, yvalues)
+        if self.downsample_to is not None:
+            start_date, end_date, width = self.downsample_to
+            data = downsample_flot_data(data, start_date, end_date, width)
+        return [(mk_js_timestamp(x), y) for x, y in data]
 
     def set_ylabel(self, ylabel):
         self.ylabel = ylabel
@@ -788,12 +903,11 @@ class FlotGraphAxes(object):
         color=None,
         label=None
     ):
-        # convert xvalues to timestamps for flot.js
-        xvalues = [mk_js_timestamp(x) for x in xvalues]
         self._update_y_limits(yvalues)
         self.flot_data.append({
             'label': label,
-            'data': zip(xvalues, yvalues),
+            # convert xvalues to timestamps for flot.js
+            'data': self.flot_series_data(xvalues, yvalues),
             'color': color,
             'lines': {'show': True}
         })
@@ -806,12 +920,11 @@ class FlotGraphAxes(object):
         width=0,
         label=None
     ):
-        # convert xvalues to timestamps for flot.js
-        xvalues = [mk_js_timestamp(x) for x in xvalues]
         self._update_y_limits(yvalues)
         self.flot_data.append({
             'label': label,
-            'data': zip(xvalues, yvalues),
+            # convert xvalues to timestamps for flot.js
+            'data': self.flot_series_data(xvalues, yvalues),
             'color': edgecolor,
             'bars': {'show': True, 'barWidth': width, 'align': 'center'}
         })
@@ -847,17 +960,24 @@ class FlotGraph(object):
         start_date, end_date,
         today=datetime.datetime.now(),
         restrict_to_month=None,
-        tz=None
+        tz=None,
+        width=None
     ):
         self.start_date = start_date
         self.end_date = end_date
         self.today = today
         self.restrict_to_month = restrict_to_month
         self.tz = tz
+        self.width = width
+        # ^^^ Width of the graph in pixels. When given, series are reduced
+        # to at most two points per pixel.
 
         x_min = mk_js_timestamp(self.start_date)
         x_max = mk_js_timestamp(self.end_date)
-        self.axes = FlotGraphAxes(x_min, x_max)
+        downsample_to = None
+        if width:
+            downsample_to = (start_date, end_date, int(width))
+        self.axes = FlotGraphAxes(x_min, x_max, downsample_to=downsample_to)
         self.responseobject = None  # Unused
         self.xlabel = None
         self.ylabel = None
@@ -973,7 +1093,9 @@ class FlotGraph(object):
             id_string = "{0}-percentile-{1}".format(label, key)
 
             # Change UTC datetimes into JS timestamps here
-            data = [[mk_js_timestamp(ts), value] for ts, value in data]
+            data = [[ts, value] for ts, value in self.axes.flot_series_data(
+                    [ts for ts, value in data],
+                    [value for ts, value in data])]
 
             self.axes.flot_data.append({
                 "id": id_string,
@@ -1001,12 +1123,15 @@ class FlotGraph(object):
         else:
             ylabel = self.ylabel
 
+        x_min = mk_js_timestamp(self.start_date)
+        x_max = mk_js_timestamp(self.end_date)
+
         return {
             'data': self.axes.flot_data,
             'x_label': self.xlabel,
             'y_label': ylabel,
-            'x_min': mk_js_timestamp(self.start_date),
-            'x_max': mk_js_timestamp(self.end_date),
+            'x_min': x_min,
+            'x_max': x_max,
             'y_min': self.axes.y_min,
             'y_max': self.axes.y_max,
             'today': mk_js_timestamp(self.today)
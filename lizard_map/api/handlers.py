@@ -1,10 +1,9 @@
 # (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
-import pkg_resources
 from django.core.urlresolvers import reverse
 from piston.handler import BaseHandler
 from piston.doc import generate_doc
 
-from lizard_map.models import ADAPTER_ENTRY_POINT
+from lizard_map.adapter import adapter_registry
 
 
 def documentation(handler):
@@ -36,16 +35,14 @@ class MapPluginsHandler(BaseHandler):
         result = {}
         result['info'] = documentation(self.__class__)
 
-        entrypoints = pkg_resources.iter_entry_points(
-            group=ADAPTER_ENTRY_POINT)
         data = []
-        for entrypoint in entrypoints:
-            adapter = entrypoint.load()
+        for name in adapter_registry.names():
+            adapter = adapter_registry.adapter_class(name)
             if not hasattr(adapter, 'plugin_api_url_name'):
                 continue
             url = request.build_absolute_uri(
                 reverse(adapter.plugin_api_url_name))
-            plugin_info = {'name': entrypoint.name,
+            plugin_info = {'name': name,
                            'url': url}
             data.append(plugin_info)
         result['data'] = data
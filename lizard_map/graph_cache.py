@@ -0,0 +1,123 @@
+"""
+Cache for graphs rendered by AdapterImageView.
+
+A collage graph is requested with the same parameters by many users (and
+again on every page reload), and every request re-ran the adapter query and a
+complete matplotlib render. Rendered pngs are now cached, keyed on everything
+that determines the graph: adapter class, adapter_layer_json, identifiers,
+date range, size, layout_extra, the data version of the adapter (see
+WorkspaceItemAdapter.data_version), so new data results in a new graph right
+away, and the user, because adapters may show data depending on the
+permissions of the user. Graphs for anonymous users are shared.
+
+Responses get an ETag and a Last-Modified header, so browsers can revalidate
+a graph they already have with a cheap 304 Not Modified.
+
+Settings:
+
+- MAP_GRAPH_CACHE: name of the django cache to use (default 'default').
+- MAP_GRAPH_CACHE_TIMEOUT: seconds a rendered graph stays valid (default
+  five minutes), 0 disables the cache.
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.utils import simplejson as json
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.utils.http import parse_http_date_safe
+from django.utils.translation import get_language
+
+from lizard_map.utility import get_host
+
+logger = logging.getLogger(__name__)
+
+GRAPH_CACHE = getattr(settings, 'MAP_GRAPH_CACHE', 'default')
+GRAPH_CACHE_TIMEOUT = getattr(settings, 'MAP_GRAPH_CACHE_TIMEOUT', 5 * 60)
+
+
+def _user_id(user):
+    """Return id of an authenticated user, None for anonymous users."""
+    if user is not None and user.is_authenticated():
+        return user.id
+    return None
+
+
+def graph_key(adapter_class, adapter_layer_json, identifiers,
+              start_date, end_date, width, height, layout_extra,
+              data_version=None, user=None):
+    """Return cache key for a graph with the given parameters."""
+    parameters = json.dumps(
+        [adapter_class, adapter_layer_json, identifiers,
+         start_date.isoformat(), end_date.isoformat(), width, height,
+         layout_extra, unicode(data_version), get_language(),
+         _user_id(user)],
+        sort_keys=True)
+    # Keep the key short and memcached-safe.
+    return 'lizard_map.graph::%s::%s' % (
+        get_host(), hashlib.md5(parameters).hexdigest())
+
+
+class GraphCache(object):
+    """Rendered graphs, stored as (png, content_type, etag, last_modified).
+    """
+
+    def __init__(self, timeout=None):
+        self.cache = get_cache(GRAPH_CACHE)
+        if timeout is None:
+            timeout = GRAPH_CACHE_TIMEOUT
+        self.timeout = timeout
+
+    def get(self, key):
+        if not self.timeout:
+            return None
+        return self.cache.get(key)
+
+    def store(self, key, response):
+        """Return cache entry for response and cache it.
+
+        Only succesful responses are cached, for others None is
+        returned.
+        """
+        if response.status_code != 200:
+            return None
+        png = response.content
+        entry = (png, response['Content-Type'],
+                 '"%s"' % hashlib.md5(png).hexdigest(), int(time.time()))
+        if self.timeout:
+            self.cache.set(key, entry, self.timeout)
+        return entry
+
+    def response(self, request, entry):
+        """Return response for cache entry, or 304 Not Modified if the
+        browser already has it."""
+        png, content_type, etag, last_modified = entry
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match is not None:
+            not_modified = etag in [
+                tag.strip() for tag in if_none_match.split(',')]
+        else:
+            not_modified = (if_modified_since is not None and
+                            last_modified <= if_modified_since)
+
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(png, content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Let browsers always revalidate, the ETag makes that cheap.
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+        if _user_id(getattr(request, 'user', None)) is not None:
+            # Graphs can depend on the user, keep them out of shared
+            # caches.
+            patch_cache_control(response, private=True)
+        return response
@@ -0,0 +1,48 @@
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import, division
+
+import logging
+import pkg_resources
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from lizard_map.adapter import ADAPTER_ENTRY_POINT
+from lizard_map.adapter import adapter_registry
+
+logger = logging.getLogger(__name__)
+
+NUMBER = 1000
+
+
+def lookup_by_scan(name):
+    """The old way: scan all entry points on every lookup."""
+    for entrypoint in pkg_resources.iter_entry_points(
+            group=ADAPTER_ENTRY_POINT):
+        if entrypoint.name == name:
+            return entrypoint.load()
+
+
+class Command(BaseCommand):
+    args = '[adapter_class]'
+    help = """Compare the cost of looking up an adapter class by scanning
+the entry points (old) with the adapter registry (new)."""
+
+    def handle(self, *args, **options):
+        if args:
+            name = args[0]
+        else:
+            names = adapter_registry.names()
+            if not names:
+                print('No adapter entry points found.')
+                return
+            name = names[0]
+
+        scan = timeit.timeit(lambda: lookup_by_scan(name), number=NUMBER)
+        registry = timeit.timeit(
+            lambda: adapter_registry.adapter_class(name), number=NUMBER)
+        print('Looking up %s %d times:' % (name, NUMBER))
+        print('  entry point scan: %8.2f us per lookup' % (
+                scan / NUMBER * 1e6))
+        print('  adapter registry: %8.2f us per lookup' % (
+                registry / NUMBER * 1e6))
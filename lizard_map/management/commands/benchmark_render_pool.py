@@ -0,0 +1,64 @@
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import, division
+
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from multiprocessing.pool import ThreadPool
+
+from lizard_map.adapter import Graph
+from lizard_map.render_pool import RenderPool
+
+GRAPHS_PER_REQUEST = 4
+VALUES_PER_GRAPH = 5000
+
+
+def render_collage(render_pool):
+    """Build and render the graphs of a collage, like a page request."""
+    start_date = datetime.datetime(2012, 1, 1)
+    end_date = datetime.datetime(2013, 1, 1)
+    step = (end_date - start_date) // VALUES_PER_GRAPH
+    dates = [start_date + step * i for i in range(VALUES_PER_GRAPH)]
+    for i in range(GRAPHS_PER_REQUEST):
+        graph = Graph(start_date, end_date, width=600, height=300)
+        graph.axes.plot(dates, [random.random() for date in dates])
+        bar_dates = dates[::100]
+        graph.axes.bar(bar_dates, [random.random() for date in bar_dates])
+        graph.legend()
+        render_pool.render_png(graph.figure)
+
+
+def requests_per_second(render_pool, requests, concurrency):
+    threads = ThreadPool(concurrency)
+    started = time.time()
+    threads.map(lambda i: render_collage(render_pool), range(requests))
+    threads.close()
+    return requests / (time.time() - started)
+
+
+class Command(BaseCommand):
+    args = '[requests] [concurrency] [workers]'
+    help = """Compare the throughput of collage requests, each rendering
+%d graphs, handled by concurrent threads of one process, with rendering
+in-process (old) and with a render pool (new).""" % GRAPHS_PER_REQUEST
+
+    def handle(self, *args, **options):
+        requests = int(args[0]) if len(args) > 0 else 20
+        concurrency = int(args[1]) if len(args) > 1 else 4
+        workers = int(args[2]) if len(args) > 2 else concurrency
+
+        in_process = requests_per_second(
+            RenderPool(size=0), requests, concurrency)
+        render_pool = RenderPool(size=workers)
+        # Start the workers before timing.
+        render_pool.pool()
+        pooled = requests_per_second(render_pool, requests, concurrency)
+        render_pool.close()
+
+        print('%d collage requests, %d concurrent:' % (requests, concurrency))
+        print('  in-process:               %8.2f requests per second' %
+              in_process)
+        print('  render pool (%2d workers): %8.2f requests per second' % (
+                workers, pooled))
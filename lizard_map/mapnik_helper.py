@@ -153,3 +153,28 @@ def add_datasource_point(datasource, x, y, name, info, _id=0):
         feature.add_geometries_from_wkt('POINT(%s %s)' % (x + offset_x,
                                                           y + offset_y))
         datasource.add_feature(feature)
+
+
+def add_workspace_item_layers(mapnik_map, workspace_item, layer_ids=None,
+                              request=None):
+    """
+    Append the layers and styles of workspace_item to mapnik_map.
+
+    This part may NEVER crash: layers from workspace items should
+    prevent crashing themselves, but you never know. Returns True if
+    the layers were added.
+    """
+    logger.debug("Drawing layer for %s..." % workspace_item)
+    try:
+        layers, styles = workspace_item.adapter.layer(
+            layer_ids=layer_ids,
+            request=request)
+        layers.reverse()  # first item should be drawn on top (=last)
+        for layer in layers:
+            mapnik_map.layers.append(layer)
+        for name in styles:
+            mapnik_map.append_style(name, styles[name])
+    except:
+        logger.exception("Error in drawing layer for %s" % workspace_item)
+        return False
+    return True
@@ -0,0 +1,156 @@
+"""
+Process-local pool of prepared mapnik maps.
+
+Building a mapnik map for a workspace item (adapter layers, legend styles,
+symbol files, PostGIS datasources) is often more expensive than rendering a
+small tile. The pool keeps the prepared maps around, keyed by workspace item,
+adapter_layer_json, srs, requested layers and the legend version, so a
+request only has to resize and zoom.
+
+A mapnik map is not thread safe, so a map is handed out to one request at
+a time: acquire it with ``mapnik_map_pool.map(...)`` as context manager.
+
+Settings:
+
+- MAP_POOL_SIZE: number of different keys kept in the pool (default 100).
+- MAP_POOL_TIMEOUT: seconds a prepared map may be reused (default 300),
+  adapters whose layers depend on changing data are rebuilt at least that
+  often.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+import mapnik
+
+from lizard_map.mapnik_helper import add_workspace_item_layers
+from lizard_map.utility import get_host
+
+logger = logging.getLogger(__name__)
+
+MAP_POOL_SIZE = getattr(settings, 'MAP_POOL_SIZE', 100)
+MAP_POOL_TIMEOUT = getattr(settings, 'MAP_POOL_TIMEOUT', 5 * 60)
+# Idle maps kept per key; more than this are only needed under heavy load.
+MAX_IDLE_MAPS_PER_KEY = 4
+LEGEND_VERSION_KEY = 'lizard_map.mapnik_pool.legend_version'
+
+
+def legend_version():
+    """Return the current legend version, shared between processes."""
+    version = cache.get(LEGEND_VERSION_KEY)
+    if version is None:
+        version = 0
+        cache.add(LEGEND_VERSION_KEY, version, None)
+    return version
+
+
+def bump_legend_version(sender=None, **kwargs):
+    """Invalidate all pooled maps, because a legend (style) changed.
+
+    Connected to the post_save and post_delete signals of the legend
+    models.
+    """
+    logger.debug('Changed legend %s. Invalidating mapnik map pool...',
+                 sender)
+    try:
+        cache.incr(LEGEND_VERSION_KEY)
+    except ValueError:
+        # Not in the cache anymore.
+        cache.set(LEGEND_VERSION_KEY, int(time.time()), None)
+
+
+class MapnikMapPool(object):
+    """Pool of prepared mapnik maps, see module docstring."""
+
+    def __init__(self, max_size=MAP_POOL_SIZE, timeout=MAP_POOL_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+        # key -> list of (created, mapnik map), least recently used first.
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, workspace_item, srs, layer_ids=None):
+        return (get_host(),
+                workspace_item._meta.object_name,
+                workspace_item.id,
+                workspace_item.adapter_layer_json,
+                srs,
+                tuple(layer_ids or ()),
+                legend_version())
+
+    def _take(self, key):
+        """Return a fresh enough idle map for key, or None."""
+        with self._lock:
+            idle_maps = self._maps.get(key)
+            if not idle_maps:
+                return None
+            # Mark key as recently used.
+            del self._maps[key]
+            self._maps[key] = idle_maps
+            while idle_maps:
+                created, mapnik_map = idle_maps.pop()
+                if time.time() - created < self.timeout:
+                    return created, mapnik_map
+        return None
+
+    def _give_back(self, key, created, mapnik_map):
+        with self._lock:
+            idle_maps = self._maps.pop(key, [])
+            if len(idle_maps) < MAX_IDLE_MAPS_PER_KEY:
+                idle_maps.append((created, mapnik_map))
+            self._maps[key] = idle_maps
+            while len(self._maps) > self.max_size:
+                self._maps.popitem(last=False)
+
+    def build(self, workspace_item, srs, layer_ids=None, request=None):
+        """Return new mapnik map with the layers of workspace_item and
+        whether it can be reused."""
+        mapnik_map = mapnik.Map(256, 256)
+        mapnik_map.srs = srs
+        mapnik_map.background = mapnik.Color('transparent')
+        added = add_workspace_item_layers(
+            mapnik_map, workspace_item, layer_ids=layer_ids, request=request)
+        adapter = workspace_item.adapter
+        reusable = added and getattr(adapter, 'reuse_mapnik_map', True)
+        return mapnik_map, reusable
+
+    @contextmanager
+    def map(self, workspace_item, srs, width, height, layer_ids=None,
+            request=None, buffer_size=0):
+        """Context manager handing out a map for workspace_item, resized
+        to width x height. Zooming is up to the caller."""
+        key = self.key(workspace_item, srs, layer_ids)
+        found = self._take(key)
+        if found is None:
+            logger.debug("Building mapnik map for %s...", workspace_item)
+            mapnik_map, reusable = self.build(
+                workspace_item, srs, layer_ids=layer_ids, request=request)
+            created = time.time()
+        else:
+            created, mapnik_map = found
+            reusable = True
+        mapnik_map.resize(width, height)
+        mapnik_map.buffer_size = buffer_size
+        yield mapnik_map
+        if reusable:
+            self._give_back(key, created, mapnik_map)
+
+    def invalidate(self, workspace_item):
+        """Remove all maps of workspace_item from this process' pool."""
+        with self._lock:
+            for key in self._maps.keys():
+                if (key[1] == workspace_item._meta.object_name and
+                    key[2] == workspace_item.id):
+                    del self._maps[key]
+
+
+mapnik_map_pool = MapnikMapPool()
+
+
+def workspace_item_post_save_delete(sender, instance, **kwargs):
+    """Drop pooled maps of a changed workspace item."""
+    mapnik_map_pool.invalidate(instance)
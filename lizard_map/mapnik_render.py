@@ -0,0 +1,215 @@
+"""
+Mapnik render service: render maps in a pool of worker processes.
+
+Rendering in the web process means that a pathological layer blocks a
+request thread for as long as it takes, and that a mapnik segfault takes the
+whole web process down. With MAP_RENDER_SERVICE_SIZE set, the wms and tile
+views serialize the prepared map (``mapnik.save_map_to_string``: layers,
+styles, datasources) and queue it, with bbox and size, for a pool of worker
+processes, which return the encoded image.
+
+- Every render has a timeout (MAP_RENDER_SERVICE_TIMEOUT). A render that
+  times out, for instance because its worker crashed, raises RenderError,
+  and the workers are replaced because one of them may be stuck.
+
+- Workers are replaced after MAP_RENDER_SERVICE_MAX_TASKS renders, to bound
+  the memory growth of mapnik and its datasources.
+
+- Workers keep the last couple of loaded map definitions, so they don't
+  have to parse the same xml and open the same datasources for every tile.
+
+- Maps that can't be serialized, and maps with memory or python datasources
+  (``save_map_to_string`` writes those without their features), are
+  rendered in-process, like all maps when the service is disabled (the
+  default).
+
+``mapnik_render_service.stats()`` returns the queue depth and counters of
+this process, they are logged when the queue grows beyond the number of
+workers.
+"""
+from collections import OrderedDict
+import hashlib
+import logging
+import multiprocessing
+import threading
+
+from django.conf import settings
+import mapnik
+
+logger = logging.getLogger(__name__)
+
+RENDER_SERVICE_SIZE = getattr(settings, 'MAP_RENDER_SERVICE_SIZE', 0)
+RENDER_SERVICE_TIMEOUT = getattr(settings, 'MAP_RENDER_SERVICE_TIMEOUT', 30)
+RENDER_SERVICE_MAX_TASKS = getattr(
+    settings, 'MAP_RENDER_SERVICE_MAX_TASKS', 100)
+# Map definitions kept loaded per worker.
+WORKER_MAPS = 10
+# Names of datasources whose features only exist in this process.
+IN_PROCESS_DATASOURCES = ('memory', 'python')
+
+_worker_maps = OrderedDict()
+
+
+class RenderError(Exception):
+    """Render in the render service failed or timed out."""
+    pass
+
+
+def render_map(mapnik_map, bbox, views=None, image_format='png'):
+    """Return image of mapnik_map zoomed to bbox, encoded as image_format.
+
+    If views, a list of (x, y, width, height), is given, return a list
+    with the encoded image of every view instead.
+    """
+    img = mapnik.Image(mapnik_map.width, mapnik_map.height)
+    mapnik_map.zoom_to_box(mapnik.Box2d(*bbox))
+    mapnik.render(mapnik_map, img)
+    if views is None:
+        return img.tostring(image_format)
+    return [img.view(*view).tostring(image_format) for view in views]
+
+
+def needs_this_process(mapnik_map):
+    """Return True if a layer of mapnik_map has a memory or python
+    datasource, which can only be rendered in this process."""
+    for layer in mapnik_map.layers:
+        datasource = layer.datasource
+        if datasource is None or datasource.type() != mapnik.DataType.Vector:
+            continue
+        if (isinstance(datasource, mapnik.MemoryDatasource) or
+            datasource.describe().get('name') in IN_PROCESS_DATASOURCES):
+            return True
+    return False
+
+
+def _loaded_map(definition):
+    """Worker: return map for definition, loaded before if possible."""
+    key = hashlib.md5(definition).hexdigest()
+    mapnik_map = _worker_maps.pop(key, None)
+    if mapnik_map is None:
+        mapnik_map = mapnik.Map(256, 256)
+        mapnik.load_map_from_string(mapnik_map, definition)
+    _worker_maps[key] = mapnik_map
+    while len(_worker_maps) > WORKER_MAPS:
+        _worker_maps.popitem(last=False)
+    return mapnik_map
+
+
+def _render_definition(definition, width, height, buffer_size, bbox,
+                       views, image_format):
+    """Worker: render serialized map."""
+    mapnik_map = _loaded_map(definition)
+    mapnik_map.resize(width, height)
+    mapnik_map.buffer_size = buffer_size
+    return render_map(mapnik_map, bbox, views=views,
+                      image_format=image_format)
+
+
+class MapnikRenderService(object):
+    """Pool of mapnik render processes, see module docstring."""
+
+    def __init__(self, size=RENDER_SERVICE_SIZE,
+                 timeout=RENDER_SERVICE_TIMEOUT,
+                 max_tasks=RENDER_SERVICE_MAX_TASKS):
+        self.size = size
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self._pool = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'pending': 0,
+            'max_pending': 0,
+            'rendered': 0,
+            'in_process': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'restarts': 0}
+
+    def pool(self):
+        """Return the worker pool, started on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(
+                    self.size, maxtasksperchild=self.max_tasks)
+            return self._pool
+
+    def restart(self):
+        """Replace the workers.
+
+        Renders still running in the old workers get one more timeout to
+        finish, then the old workers are killed.
+        """
+        with self._lock:
+            old_pool, self._pool = self._pool, None
+            self._stats['restarts'] += 1
+        if old_pool is not None:
+            old_pool.close()
+            killer = threading.Timer(self.timeout, old_pool.terminate)
+            killer.daemon = True
+            killer.start()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def stats(self):
+        """Return queue depth and counters of this process."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _add(self, **counts):
+        """Add counts to the stats, return the number of pending renders."""
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+            self._stats['max_pending'] = max(
+                self._stats['max_pending'], self._stats['pending'])
+            return self._stats['pending']
+
+    def render(self, mapnik_map, bbox, views=None, image_format='png'):
+        """Return image(s) of mapnik_map, see render_map.
+
+        Rendered by a worker if the service is enabled and the map can be
+        serialized, in-process otherwise.
+        """
+        definition = None
+        if self.size and not needs_this_process(mapnik_map):
+            try:
+                definition = mapnik.save_map_to_string(mapnik_map)
+            except (RuntimeError, TypeError), e:
+                logger.debug("Can't serialize map, rendering in-process: %s",
+                             e)
+        if definition is None:
+            self._add(in_process=1)
+            return render_map(mapnik_map, bbox, views=views,
+                              image_format=image_format)
+
+        pending = self._add(pending=1)
+        if pending > self.size:
+            logger.info("Mapnik render queue: %d renders for %d workers.",
+                        pending, self.size)
+        try:
+            result = self.pool().apply_async(
+                _render_definition,
+                (definition, mapnik_map.width, mapnik_map.height,
+                 mapnik_map.buffer_size, tuple(bbox), views, image_format))
+            image = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self._add(timeouts=1)
+            logger.error("Mapnik render didn't finish within %s seconds, "
+                         "restarting render workers.", self.timeout)
+            self.restart()
+            raise RenderError("Render timed out.")
+        except Exception, e:
+            self._add(failed=1)
+            logger.exception("Mapnik render failed.")
+            raise RenderError(unicode(e))
+        finally:
+            self._add(pending=-1)
+        self._add(rendered=1)
+        return image
+
+
+mapnik_render_service = MapnikRenderService()
@@ -19,6 +19,7 @@ import pkg_resources
 
 from lizard_map import dateperiods
 from lizard_map import fields
+from lizard_map import mapnik_pool
 from lizard_map.adapter import AdapterClassNotFoundError
 from lizard_map.adapter import adapter_class_names
 from lizard_map.adapter import adapter_entrypoint
@@ -199,6 +200,16 @@ class WorkspaceItemMixin(models.Model):
 
     @property
     def adapter(self):
+        """Return adapter of this workspace item.
+
+        The adapter is constructed once per instance (so usually once per
+        request) and rebuilt only if adapter_class or adapter_layer_json
+        changed.
+        """
+        adapter_key = (self.adapter_class, self.adapter_layer_json)
+        cached = getattr(self, '_adapter_cache', None)
+        if cached is not None and cached[0] == adapter_key:
+            return cached[1]
         try:
             layer_arguments = self._adapter_layer_arguments
             current_adapter = adapter_entrypoint(
@@ -211,6 +222,7 @@ class WorkspaceItemMixin(models.Model):
                 # Only delete if it is saved in the first place.
                 self.delete()
             return None
+        self._adapter_cache = (adapter_key, current_adapter)
         return current_adapter
 
     def __unicode__(self):
@@ -222,7 +234,8 @@ class WorkspaceItemMixin(models.Model):
 
         Used when duplicating WorkspaceStorageItems to
         WorkspaceEditItems and vice versa."""
-        delete_fields = ['_state', '_workspace_cache', 'workspace_id', 'id']
+        delete_fields = ['_state', '_workspace_cache', 'workspace_id', 'id',
+                         '_adapter_cache']
 
         # Get current data in dict.
         kwargs = self.__dict__
@@ -809,36 +822,39 @@ class CollageEditItem(WorkspaceItemMixin, StatisticsMixin):
             return []
 
         # Calc periods based on aggregation period setting.
-        periods = dateperiods.calc_aggregation_periods(start_date, end_date,
-                                           self.aggregation_period)
-        statistics = []
-        for period_start_date, period_end_date in periods:
+        periods = [
+            (period_start_date, period_end_date) for
+            (period_start_date, period_end_date) in
+            dateperiods.calc_aggregation_periods(start_date, end_date,
+                                                 self.aggregation_period)
             if not self.restrict_to_month or (
                 self.aggregation_period != dateperiods.MONTH) or (
                 self.aggregation_period == dateperiods.MONTH and
-                self.restrict_to_month == period_start_date.month):
-
-                # Base statistics for each period.
-                statistics_row = adapter.value_aggregate(
-                    self.identifier,
-                    {'min': None,
-                     'max': None,
-                     'avg': None,
-                     'count_lt': self.boundary_value,
-                     'count_gte': self.boundary_value,
-                     'percentile': self.percentile_value},
-                    start_date=period_start_date,
-                    end_date=period_end_date)
-
-                # Add name.
-                if statistics_row:
-                    statistics_row['name'] = self.name
-                    statistics_row['period'] = dateperiods.fancy_period(
-                        period_start_date, period_end_date,
-                        self.aggregation_period)
-                    statistics_row['boundary_value'] = self.boundary_value
-                    statistics_row['percentile_value'] = self.percentile_value
-                    statistics.append(statistics_row)
+                self.restrict_to_month == period_start_date.month)]
+
+        # Base statistics for each period.
+        statistics_rows = adapter.value_aggregate_periods(
+            self.identifier,
+            {'min': None,
+             'max': None,
+             'avg': None,
+             'count_lt': self.boundary_value,
+             'count_gte': self.boundary_value,
+             'percentile': self.percentile_value},
+            periods)
+
+        statistics = []
+        for (period_start_date, period_end_date), statistics_row in zip(
+            periods, statistics_rows):
+            # Add name.
+            if statistics_row:
+                statistics_row['name'] = self.name
+                statistics_row['period'] = dateperiods.fancy_period(
+                    period_start_date, period_end_date,
+                    self.aggregation_period)
+                statistics_row['boundary_value'] = self.boundary_value
+                statistics_row['percentile_value'] = self.percentile_value
+                statistics.append(statistics_row)
         return statistics
 
 
@@ -1188,3 +1204,13 @@ def setting_post_save_delete(sender, **kwargs):
 
 post_save.connect(setting_post_save_delete, sender=Setting)
 post_delete.connect(setting_post_save_delete, sender=Setting)
+
+
+for legend_model in (Legend, LegendPoint):
+    post_save.connect(mapnik_pool.bump_legend_version, sender=legend_model)
+    post_delete.connect(mapnik_pool.bump_legend_version, sender=legend_model)
+for workspace_item_model in (WorkspaceEditItem, WorkspaceStorageItem):
+    post_save.connect(mapnik_pool.workspace_item_post_save_delete,
+                      sender=workspace_item_model)
+    post_delete.connect(mapnik_pool.workspace_item_post_save_delete,
+                        sender=workspace_item_model)
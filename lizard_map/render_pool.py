@@ -0,0 +1,107 @@
+"""
+Optional pool of worker processes that render matplotlib graphs.
+
+Rendering a Graph to png holds the GIL for the whole (often long) render, so
+one collage page with a couple of big graphs stalls every other request that
+is handled by threads of the same process. With MAP_RENDER_POOL_SIZE set,
+``Graph.http_png`` pickles its figure and lets one of the worker processes
+render it, so the web process only waits on a pipe.
+
+The workers import matplotlib and our matplotlib settings when they start,
+so a render never pays for those imports. Rendering falls back to the
+calling process when the pool is disabled, when a figure can't be pickled
+(matplotlib < 1.2) or when a worker doesn't answer within
+MAP_RENDER_TIMEOUT seconds.
+
+Settings:
+
+- MAP_RENDER_POOL_SIZE: number of worker processes (default 0, which
+  renders in-process like before).
+- MAP_RENDER_TIMEOUT: seconds to wait for a worker (default 30).
+- MAP_RENDER_MAX_TASKS: renders after which a worker is replaced by a fresh
+  one, to keep memory use of the workers in check (default 100).
+"""
+from cStringIO import StringIO
+import cPickle as pickle
+import logging
+import multiprocessing
+import threading
+
+from django.conf import settings
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_SIZE = getattr(settings, 'MAP_RENDER_POOL_SIZE', 0)
+RENDER_TIMEOUT = getattr(settings, 'MAP_RENDER_TIMEOUT', 30)
+RENDER_MAX_TASKS = getattr(settings, 'MAP_RENDER_MAX_TASKS', 100)
+
+
+def render_png_in_process(figure):
+    """Return png of figure, rendered in this process."""
+    canvas = FigureCanvas(figure)
+    output = StringIO()
+    canvas.print_png(output)
+    return output.getvalue()
+
+
+def _init_worker():
+    """Warm up a worker: import everything a render needs."""
+    from lizard_map import adapter  # NOQA
+    from lizard_map import matplotlib_settings  # NOQA
+
+
+def _render_pickled_figure(pickled_figure):
+    """Worker: return png of the pickled figure."""
+    return render_png_in_process(pickle.loads(pickled_figure))
+
+
+class RenderPool(object):
+    """Pool of render processes, see module docstring."""
+
+    def __init__(self, size=RENDER_POOL_SIZE, timeout=RENDER_TIMEOUT,
+                 max_tasks=RENDER_MAX_TASKS):
+        self.size = size
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        """Return the worker pool, started on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(
+                    self.size, initializer=_init_worker,
+                    maxtasksperchild=self.max_tasks)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def render_png(self, figure):
+        """Return png of figure, rendered by a worker if possible."""
+        if not self.size:
+            return render_png_in_process(figure)
+
+        try:
+            pickled_figure = pickle.dumps(figure, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError), e:
+            logger.debug("Can't pickle figure, rendering in-process: %s", e)
+            return render_png_in_process(figure)
+
+        try:
+            return self.pool().apply_async(
+                _render_pickled_figure, (pickled_figure,)).get(self.timeout)
+        except multiprocessing.TimeoutError:
+            logger.warn("Render worker didn't answer within %s seconds, "
+                        "rendering in-process.", self.timeout)
+        except Exception:
+            logger.exception("Render worker failed, rendering in-process.")
+        return render_png_in_process(figure)
+
+
+render_pool = RenderPool()
@@ -1790,6 +1790,11 @@ function reloadDynamicGraph($graph, callback, force) {
     }
     var url = (graph_type == 'flot') ? flot_graph_data_url : image_graph_url;
 
+    // let the server downsample flot data to the width of the graph
+    if (url && graph_type == 'flot' && $graph.width()) {
+        url += '&' + $.param({width: $graph.width()});
+    }
+
     // add currently selected date range to url
     // HACK: viewstate is currently globally accessible
     var view_state = get_view_state();
@@ -2,15 +2,21 @@
 """Purpose: Manage image files that are scaled, colorized and rotated.
 """
 
+from collections import OrderedDict
 import logging
 import os.path
 import fnmatch
+import threading
 from PIL import Image
 from PIL import ImageFilter
+import numpy
 import pkg_resources
 
 logger = logging.getLogger(__name__)
 
+# Number of generated symbol filenames remembered per process.
+GENERATED_SYMBOLS_CACHE_SIZE = 2000
+
 
 def list_image_file_names():
     """
@@ -36,12 +42,91 @@ def list_image_file_names():
     return icon_names
 
 
+class GeneratedSymbols(object):
+    """LRU of absolute filenames of symbols known to be generated.
+
+    Lets get_symbol_transformed skip the filesystem stat for symbols
+    generated earlier in this process (legends, popups).
+    """
+
+    def __init__(self, max_size=GENERATED_SYMBOLS_CACHE_SIZE):
+        self.max_size = max_size
+        self._filenames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, filename):
+        with self._lock:
+            if filename not in self._filenames:
+                return False
+            # Mark as recently used.
+            del self._filenames[filename]
+            self._filenames[filename] = True
+            return True
+
+    def add(self, filename):
+        with self._lock:
+            self._filenames.pop(filename, None)
+            self._filenames[filename] = True
+            while len(self._filenames) > self.max_size:
+                self._filenames.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._filenames.clear()
+
+
+generated_symbols = GeneratedSymbols()
+# Symbol paths that are known to exist.
+_existing_paths = set()
+
+
+def colorize(im, im_mask, color):
+    """Return im (RGBA) colorized with color where im_mask (RGBA) has
+    alpha. The alpha of im is unaltered."""
+    pixels = numpy.array(im)
+    rgb = pixels[:, :, :3].astype(numpy.int64)
+    mask = numpy.array(im_mask)[:, :, 3:4].astype(numpy.int64)
+    colored = numpy.floor(
+        rgb * numpy.array(color[:3], dtype=numpy.float64) * mask / 256.0)
+    colored = colored.astype(numpy.int64) + rgb * (255 - mask) // 256
+    pixels[:, :, :3] = numpy.clip(colored, 0, 255)
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def drop_shadow(im, shadow_height, factor_x=0.5, factor_y=1):
+    """Return im (RGBA) on top of a blurred grey shadow.
+
+    See also: http://en.wikipedia.org/wiki/Alpha_compositing, A over B
+    """
+    im_shadow = Image.new('RGBA', im.size)
+    im_shadow.paste((192, 192, 192, 255),
+                    (int(shadow_height * factor_x),
+                     int(shadow_height * factor_y)),
+                    im)
+    #now blur the im_shadow a little bit
+    im_shadow = im_shadow.filter(ImageFilter.BLUR)
+
+    #paste original image on top, using the alpha channel
+    shadow = numpy.array(im_shadow).astype(numpy.int64)
+    top = numpy.array(im).astype(numpy.int64)
+    rgb, a = shadow[:, :, :3], shadow[:, :, 3:4]
+    rgb2, a2 = top[:, :, :3], top[:, :, 3:4]
+    result = numpy.empty_like(shadow)
+    result[:, :, :3] = (rgb2 * a2 // 256 +
+                        rgb * a * (255 - a2) // 256 // 256)
+    result[:, :, 3:4] = a2 + (255 - a2) * a // 256
+    return Image.fromarray(
+        numpy.clip(result, 0, 255).astype(numpy.uint8), 'RGBA')
+
+
 class SymbolManager:
 
     def __init__(self, symbol_path_original, symbol_path_generated):
         # logger.debug('Initializing SymbolManager')
         self.symbol_path_original = symbol_path_original
         self.symbol_path_generated = symbol_path_generated
+        if (symbol_path_original, symbol_path_generated) in _existing_paths:
+            return
         if not(os.path.exists(self.symbol_path_original)):
             logger.critical('original path %s does not exist',
                          self.symbol_path_original)
@@ -51,6 +136,7 @@ class SymbolManager:
         if not(os.path.exists(self.symbol_path_generated)):
             os.makedirs(self.symbol_path_generated)
             logger.info('Created map %s' % self.symbol_path_generated)
+        _existing_paths.add((symbol_path_original, symbol_path_generated))
 
     def get_symbol_transformed(self, filename_nopath, **kwargs):
         """Returns relative filename,
@@ -84,13 +170,6 @@ class SymbolManager:
         shadow_height, = kwargs.get('shadow_height', (0,))
         force = kwargs.get('force', False)
 
-        # logger.debug('color: %s' % str(color))
-        # logger.debug('mask: %s' % fn_mask)
-        # logger.debug('size: %dx%d' % (sizex, sizey))
-        # logger.debug('rotate: %d' % (rotate))
-        # logger.debug('shadow_height: %d' % (shadow_height))
-        # logger.debug('force no cache: %s' % (force))
-
         filename_mask_abs = os.path.join(self.symbol_path_original, fn_mask)
 
         #result filename is :
@@ -105,6 +184,8 @@ class SymbolManager:
 
         result_filename = os.path.join(self.symbol_path_generated,
                                        result_filename_nopath)
+        if not force and result_filename in generated_symbols:
+            return result_filename_nopath
         if os.path.isfile(result_filename) and force == False:
             pass
             # logger.debug('image already exists, returning filename')
@@ -124,21 +205,7 @@ class SymbolManager:
             im_mask = Image.open(filename_mask_abs)
             if im_mask.mode != 'RGBA':
                 im_mask = im_mask.convert('RGBA')
-
-            # Create objects where you can read and write pixel values.
-            pix = im.load()
-            pix_mask = im_mask.load()
-            for x in range(im.size[0]):
-                for y in range(im.size[1]):
-                    mask = pix_mask[x, y][3]
-                    r, g, b, a = pix[x, y]
-                    r = (int(color[0] * r * mask / 256) +
-                         r * (255 - mask) / 256)
-                    g = (int(color[1] * g * mask / 256) +
-                         g * (255 - mask) / 256)
-                    b = (int(color[2] * b * mask / 256) +
-                         b * (255 - mask) / 256)
-                    pix[x, y] = (r, g, b, a)
+            im = colorize(im, im_mask, color)
 
             if sizex > 0 and sizey > 0:
                 if sizex != im.size[0] or sizey != im.size[1]:
@@ -149,32 +216,10 @@ class SymbolManager:
                 im = im.rotate(rotate, Image.BICUBIC)
 
             #drop shadow
-            #see also: http://en.wikipedia.org/wiki/Alpha_compositing, A over B
             if shadow_height > 0:
-                im_shadow = Image.new('RGBA', im.size)
-                im_shadow.paste((192, 192, 192, 255),
-                                (int(shadow_height * SHADOW_FACTOR_X),
-                                 int(shadow_height * SHADOW_FACTOR_Y)),
-                                im)
-                #now blur the im_shadow a little bit
-                im_shadow = im_shadow.filter(ImageFilter.BLUR)
-
-                #im_shadow.paste(im, (0,0))
-                #paste original image on top, using the alpha channel
-                pix = im.load()
-                pix_shadow = im_shadow.load()
-                # logger.debug('shadow x: %d' % im_shadow.size[0])
-                for x in range(im_shadow.size[0]):
-                    for y in range(im_shadow.size[1]):
-                        r, g, b, a = pix_shadow[x, y]
-                        r2, g2, b2, a2 = pix[x, y]
-                        r_res = r2 * a2 / 256 + r * a * (255 - a2) / 256 / 256
-                        g_res = g2 * a2 / 256 + g * a * (255 - a2) / 256 / 256
-                        b_res = b2 * a2 / 256 + b * a * (255 - a2) / 256 / 256
-                        a_res = a2 + (255 - a2) * a / 256
-                        pix_shadow[x, y] = (r_res, g_res, b_res, a_res)
-
-                im = im_shadow
+                im = drop_shadow(im, shadow_height,
+                                 factor_x=SHADOW_FACTOR_X,
+                                 factor_y=SHADOW_FACTOR_Y)
 
             if os.path.isfile(result_filename):
                 # logger.debug('deleting existing result file')
@@ -183,4 +228,5 @@ class SymbolManager:
             # logger.debug('saving image (%s)' % result_filename)
             im.save(result_filename)
 
+        generated_symbols.add(result_filename)
         return result_filename_nopath  # result_filename
@@ -572,6 +572,16 @@ class WorkspaceItemTest(TestCase):
                 workspace_item.adapter,
                 lizard_map.layers.AdapterDummy))
 
+    def test_adapter_memoized(self):
+        """The adapter is constructed once, unless its arguments change."""
+        workspace_item = WorkspaceEditItem()
+        workspace_item.adapter_class = 'adapter_dummy'
+        workspace_item.adapter_layer_json = ("{}")
+        adapter = workspace_item.adapter
+        self.assertTrue(workspace_item.adapter is adapter)
+        workspace_item.adapter_layer_json = '{"bla": "yes"}'
+        self.assertFalse(workspace_item.adapter is adapter)
+
     def test_adapter_arguments(self):
         """The layer method probably needs arguments. You can store them as a
         json string."""
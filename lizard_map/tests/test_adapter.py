@@ -1,5 +1,6 @@
 import datetime
 
+import mock
 import pytz
 
 from django.test import TestCase
@@ -80,3 +81,88 @@ class TestMakePercentileLabel(TestCase):
             self.assertEquals(
                 label,
                 u"label (met 10% - 90% percentiel, 20% - 80% percentiel)")
+
+
+class TestAdapterRegistry(TestCase):
+    def setUp(self):
+        self.entrypoint = mock.Mock()
+        self.entrypoint.name = 'adapter_test'
+        self.entrypoint.load.return_value = mock.Mock
+
+    def test_entrypoints_scanned_once(self):
+        registry = adapter.AdapterRegistry()
+        with mock.patch('pkg_resources.iter_entry_points',
+                        return_value=iter([self.entrypoint])) as scan:
+            registry.adapter_class('adapter_test')
+            registry.adapter_class('adapter_test')
+            registry.names()
+        self.assertEquals(scan.call_count, 1)
+        self.assertEquals(self.entrypoint.load.call_count, 1)
+
+    def test_unknown_adapter(self):
+        registry = adapter.AdapterRegistry()
+        with mock.patch('pkg_resources.iter_entry_points',
+                        return_value=iter([self.entrypoint])):
+            self.assertRaises(adapter.AdapterClassNotFoundError,
+                              registry.adapter_class, 'adapter_unknown')
+
+    def test_names(self):
+        registry = adapter.AdapterRegistry()
+        with mock.patch('pkg_resources.iter_entry_points',
+                        return_value=iter([self.entrypoint])):
+            self.assertEquals(registry.names(), ['adapter_test'])
+
+
+class TestDownsampleFlotData(TestCase):
+    def setUp(self):
+        self.data = [(x, (x % 100) / 10.0) for x in range(10000)]
+        self.data[5000] = (5000, 1000.0)
+        self.data[6000] = (6000, None)
+
+    def test_small_data_is_untouched(self):
+        data = self.data[:100]
+        self.assertTrue(adapter.downsample_flot_data(data, 0, 100, 50) is data)
+
+    def test_two_points_per_bucket(self):
+        result = adapter.downsample_flot_data(self.data, 0, 10000, 100)
+        self.assertTrue(len(result) <= 2 * 100 + 1)
+        self.assertEquals(result, sorted(result))
+
+    def test_peaks_and_gaps_are_kept(self):
+        result = adapter.downsample_flot_data(self.data, 0, 10000, 100)
+        self.assertTrue((5000, 1000.0) in result)
+        self.assertTrue((6000, None) in result)
+        self.assertEquals(min(y for x, y in result if y is not None), 0.0)
+
+    def test_datetimes_are_downsampled(self):
+        start = utc_datetime(2013, 1, 1)
+        data = [(start + datetime.timedelta(hours=hour), 1.0)
+                for hour in range(1000)]
+        result = adapter.downsample_flot_data(
+            data, start, start + datetime.timedelta(hours=1000), 10)
+        self.assertTrue(len(result) <= 2 * 10)
+
+    def test_flot_graph_render_downsamples(self):
+        graph = adapter.FlotGraph(
+            utc_datetime(2013, 1, 1), utc_datetime(2014, 1, 1), width=100)
+        dates = [utc_datetime(2013, 1, 1) + datetime.timedelta(hours=hour)
+                 for hour in range(365 * 24)]
+        values = [1.0] * len(dates)
+        values[1000] = 50.0
+        graph.axes.plot(dates, values)
+        graph.axes.bar(dates, [1.0] * len(dates))
+        result = graph.render()
+        for series in result['data']:
+            self.assertTrue(len(series['data']) <= 2 * 100)
+        self.assertTrue(
+            (adapter.mk_js_timestamp(dates[1000]), 50.0) in
+            result['data'][0]['data'])
+        self.assertEquals(result['y_max'], 50.0)
+
+    def test_flot_graph_without_width_keeps_all_points(self):
+        graph = adapter.FlotGraph(
+            utc_datetime(2013, 1, 1), utc_datetime(2014, 1, 1))
+        dates = [utc_datetime(2013, 1, 1) + datetime.timedelta(hours=hour)
+                 for hour in range(1000)]
+        graph.axes.plot(dates, [1.0] * len(dates))
+        self.assertEquals(len(graph.render()['data'][0]['data']), len(dates))
@@ -0,0 +1,84 @@
+import datetime
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.http import http_date
+import mock
+
+from lizard_map import graph_cache
+
+
+class TestGraphCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.graph_cache = graph_cache.GraphCache(timeout=60)
+        self.factory = RequestFactory()
+        self.start_date = datetime.datetime(2013, 1, 1)
+        self.end_date = datetime.datetime(2013, 2, 1)
+
+    def _key(self, **kwargs):
+        parameters = dict(
+            adapter_class='adapter_test', adapter_layer_json='{}',
+            identifiers=[{'location': 'a'}], start_date=self.start_date,
+            end_date=self.end_date, width=300, height=200,
+            layout_extra={})
+        parameters.update(kwargs)
+        return graph_cache.graph_key(**parameters)
+
+    def test_key_depends_on_parameters(self):
+        self.assertEquals(self._key(), self._key())
+        self.assertNotEquals(self._key(), self._key(width=301))
+        self.assertNotEquals(self._key(), self._key(data_version=1))
+
+    def test_key_depends_on_authenticated_user(self):
+        anonymous = AnonymousUser()
+        user1 = mock.Mock(id=1)
+        user2 = mock.Mock(id=2)
+        self.assertEquals(self._key(user=anonymous), self._key())
+        self.assertNotEquals(self._key(user=user1), self._key())
+        self.assertNotEquals(self._key(user=user1), self._key(user=user2))
+
+    def test_store_and_get(self):
+        response = HttpResponse('png', content_type='image/png')
+        entry = self.graph_cache.store(self._key(), response)
+        self.assertEquals(self.graph_cache.get(self._key()), entry)
+
+    def test_errors_are_not_stored(self):
+        response = HttpResponse('error', status=500)
+        self.assertEquals(self.graph_cache.store(self._key(), response), None)
+        self.assertEquals(self.graph_cache.get(self._key()), None)
+
+    def test_disabled(self):
+        disabled = graph_cache.GraphCache(timeout=0)
+        response = HttpResponse('png', content_type='image/png')
+        self.assertTrue(disabled.store(self._key(), response))
+        self.assertEquals(disabled.get(self._key()), None)
+
+    def test_response(self):
+        response = HttpResponse('png', content_type='image/png')
+        entry = self.graph_cache.store(self._key(), response)
+        response = self.graph_cache.response(self.factory.get('/'), entry)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, 'png')
+        self.assertEquals(response['ETag'], entry[2])
+
+    def test_if_none_match(self):
+        response = HttpResponse('png', content_type='image/png')
+        entry = self.graph_cache.store(self._key(), response)
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH=entry[2])
+        response = self.graph_cache.response(request, entry)
+        self.assertEquals(response.status_code, 304)
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"other"')
+        response = self.graph_cache.response(request, entry)
+        self.assertEquals(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        response = HttpResponse('png', content_type='image/png')
+        entry = self.graph_cache.store(self._key(), response)
+        request = self.factory.get(
+            '/', HTTP_IF_MODIFIED_SINCE=http_date(entry[3]))
+        response = self.graph_cache.response(request, entry)
+        self.assertEquals(response.status_code, 304)
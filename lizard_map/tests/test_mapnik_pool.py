@@ -0,0 +1,60 @@
+from django.test import TestCase
+import mock
+
+from lizard_map import mapnik_pool
+
+
+class TestMapnikMapPool(TestCase):
+    def setUp(self):
+        self.pool = mapnik_pool.MapnikMapPool()
+        self.workspace_item = mock.Mock()
+        self.workspace_item.id = 1
+        self.workspace_item.adapter_layer_json = '{}'
+        self.workspace_item._meta.object_name = 'WorkspaceEditItem'
+
+    def _use_map(self):
+        with self.pool.map(self.workspace_item, 'srs', 256, 256) as m:
+            return m
+
+    def test_map_is_reused(self):
+        with mock.patch.object(self.pool, 'build',
+                               side_effect=lambda *a, **kw: (mock.Mock(),
+                                                              True)) as build:
+            map1 = self._use_map()
+            map2 = self._use_map()
+        self.assertEquals(build.call_count, 1)
+        self.assertTrue(map1 is map2)
+
+    def test_map_in_use_is_not_handed_out(self):
+        with mock.patch.object(self.pool, 'build',
+                               side_effect=lambda *a, **kw: (mock.Mock(),
+                                                              True)):
+            with self.pool.map(self.workspace_item, 'srs', 1, 1) as map1:
+                map2 = self._use_map()
+        self.assertFalse(map1 is map2)
+
+    def test_unreusable_map_is_not_pooled(self):
+        with mock.patch.object(self.pool, 'build',
+                               side_effect=lambda *a, **kw: (mock.Mock(),
+                                                              False)) as build:
+            self._use_map()
+            self._use_map()
+        self.assertEquals(build.call_count, 2)
+
+    def test_invalidate(self):
+        with mock.patch.object(self.pool, 'build',
+                               side_effect=lambda *a, **kw: (mock.Mock(),
+                                                              True)) as build:
+            self._use_map()
+            self.pool.invalidate(self.workspace_item)
+            self._use_map()
+        self.assertEquals(build.call_count, 2)
+
+    def test_legend_change_invalidates(self):
+        with mock.patch.object(self.pool, 'build',
+                               side_effect=lambda *a, **kw: (mock.Mock(),
+                                                              True)) as build:
+            self._use_map()
+            mapnik_pool.bump_legend_version()
+            self._use_map()
+        self.assertEquals(build.call_count, 2)
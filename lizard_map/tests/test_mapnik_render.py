@@ -0,0 +1,80 @@
+import multiprocessing
+
+from django.test import TestCase
+import mapnik
+import mock
+
+from lizard_map import mapnik_render
+
+
+class TestMapnikRenderService(TestCase):
+    def setUp(self):
+        self.mapnik_map = mock.Mock()
+        self.mapnik_map.width = 256
+        self.mapnik_map.height = 256
+        self.mapnik_map.buffer_size = 0
+        self.mapnik_map.layers = []
+        self.bbox = (0, 0, 1, 1)
+
+    def test_disabled_renders_in_process(self):
+        service = mapnik_render.MapnikRenderService(size=0)
+        with mock.patch('lizard_map.mapnik_render.render_map',
+                        return_value='png') as render_map:
+            self.assertEquals(service.render(self.mapnik_map, self.bbox),
+                              'png')
+        self.assertTrue(render_map.called)
+        self.assertEquals(service.stats()['in_process'], 1)
+
+    def test_unserializable_map_renders_in_process(self):
+        service = mapnik_render.MapnikRenderService(size=1)
+        with mock.patch('mapnik.save_map_to_string', side_effect=RuntimeError):
+            with mock.patch('lizard_map.mapnik_render.render_map',
+                            return_value='png'):
+                self.assertEquals(
+                    service.render(self.mapnik_map, self.bbox), 'png')
+        self.assertEquals(service.stats()['in_process'], 1)
+
+    def test_memory_datasource_renders_in_process(self):
+        mapnik_map = mapnik.Map(256, 256)
+        layer = mapnik.Layer('points')
+        layer.datasource = mapnik.MemoryDatasource()
+        mapnik_map.layers.append(layer)
+        self.assertTrue(mapnik_render.needs_this_process(mapnik_map))
+
+        service = mapnik_render.MapnikRenderService(size=1)
+        with mock.patch.object(service, 'pool') as pool:
+            with mock.patch('lizard_map.mapnik_render.render_map',
+                            return_value='png'):
+                self.assertEquals(
+                    service.render(mapnik_map, self.bbox), 'png')
+        self.assertFalse(pool.called)
+        self.assertEquals(service.stats()['in_process'], 1)
+
+    def test_worker_renders(self):
+        service = mapnik_render.MapnikRenderService(size=1)
+        pool = mock.Mock()
+        pool.apply_async.return_value.get.return_value = 'png'
+        with mock.patch('mapnik.save_map_to_string', return_value='<Map/>'):
+            with mock.patch.object(service, 'pool', return_value=pool):
+                self.assertEquals(
+                    service.render(self.mapnik_map, self.bbox), 'png')
+        stats = service.stats()
+        self.assertEquals(stats['rendered'], 1)
+        self.assertEquals(stats['pending'], 0)
+        self.assertEquals(stats['max_pending'], 1)
+
+    def test_timeout_restarts_workers(self):
+        service = mapnik_render.MapnikRenderService(size=1, timeout=0.1)
+        pool = mock.Mock()
+        pool.apply_async.return_value.get.side_effect = (
+            multiprocessing.TimeoutError)
+        with mock.patch('mapnik.save_map_to_string', return_value='<Map/>'):
+            with mock.patch.object(service, 'pool', return_value=pool):
+                with mock.patch.object(service, 'restart') as restart:
+                    self.assertRaises(mapnik_render.RenderError,
+                                      service.render,
+                                      self.mapnik_map, self.bbox)
+        self.assertTrue(restart.called)
+        stats = service.stats()
+        self.assertEquals(stats['timeouts'], 1)
+        self.assertEquals(stats['pending'], 0)
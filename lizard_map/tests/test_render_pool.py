@@ -0,0 +1,55 @@
+import datetime
+import multiprocessing
+
+from django.test import TestCase
+import mock
+
+from lizard_map.adapter import Graph
+from lizard_map.render_pool import RenderPool
+
+PNG_SIGNATURE = '\x89PNG'
+
+
+def graph():
+    graph = Graph(datetime.datetime(2010, 7, 1),
+                  datetime.datetime(2010, 10, 1))
+    graph.axes.plot([datetime.datetime(2010, 8, 1),
+                     datetime.datetime(2010, 9, 1)], [1, 2])
+    return graph
+
+
+class TestRenderPool(TestCase):
+    def test_disabled_renders_in_process(self):
+        render_pool = RenderPool(size=0)
+        with mock.patch('multiprocessing.Pool') as pool:
+            png = render_pool.render_png(graph().figure)
+        self.assertTrue(png.startswith(PNG_SIGNATURE))
+        self.assertFalse(pool.called)
+
+    def test_unpicklable_figure_renders_in_process(self):
+        render_pool = RenderPool(size=1)
+        with mock.patch('cPickle.dumps', side_effect=TypeError):
+            with mock.patch('multiprocessing.Pool') as pool:
+                png = render_pool.render_png(graph().figure)
+        self.assertTrue(png.startswith(PNG_SIGNATURE))
+        self.assertFalse(pool.called)
+
+    def test_timeout_renders_in_process(self):
+        render_pool = RenderPool(size=1, timeout=0.1)
+        pool = mock.Mock()
+        pool.apply_async.return_value.get.side_effect = (
+            multiprocessing.TimeoutError)
+        with mock.patch('cPickle.dumps', return_value='figure'):
+            with mock.patch.object(render_pool, 'pool', return_value=pool):
+                png = render_pool.render_png(graph().figure)
+        self.assertTrue(png.startswith(PNG_SIGNATURE))
+        self.assertTrue(pool.apply_async.called)
+
+    def test_worker_renders(self):
+        render_pool = RenderPool(size=1)
+        pool = mock.Mock()
+        pool.apply_async.return_value.get.return_value = 'png from worker'
+        with mock.patch('cPickle.dumps', return_value='figure'):
+            with mock.patch.object(render_pool, 'pool', return_value=pool):
+                png = render_pool.render_png(graph().figure)
+        self.assertEquals(png, 'png from worker')
@@ -0,0 +1,52 @@
+import time
+
+from django.test import TestCase
+import mock
+
+from lizard_map import views
+
+
+class TestSearch(TestCase):
+    def _workspace(self, *search_functions):
+        workspace_items = []
+        for index, search_function in enumerate(search_functions):
+            workspace_item = mock.Mock()
+            workspace_item.name = 'item %s' % index
+            workspace_item.adapter.search_with_request = False
+            workspace_item.adapter.search.side_effect = search_function
+            workspace_items.append(workspace_item)
+        workspace = mock.Mock()
+        workspace.workspace_items.filter.return_value = workspace_items
+        return workspace
+
+    def test_results_are_combined(self):
+        workspace = self._workspace(
+            lambda x, y, radius: [{'name': 'a'}],
+            lambda x, y, radius: [{'name': 'b'}])
+        found = views.search(workspace, 0, 0, 1)
+        self.assertEquals(found, [{'name': 'a'}, {'name': 'b'}])
+
+    def test_crashing_adapter_is_left_out(self):
+        def crash(x, y, radius):
+            raise ValueError
+
+        timings = []
+        workspace = self._workspace(
+            crash, lambda x, y, radius: [{'name': 'b'}])
+        found = views.search(workspace, 0, 0, 1, timings=timings)
+        self.assertEquals(found, [{'name': 'b'}])
+        self.assertEquals([timing['status'] for timing in timings],
+                          ['error', 'ok'])
+
+    def test_slow_adapter_times_out(self):
+        def slow(x, y, radius):
+            time.sleep(1)
+            return [{'name': 'slow'}]
+
+        timings = []
+        workspace = self._workspace(
+            slow, lambda x, y, radius: [{'name': 'fast'}])
+        with mock.patch('lizard_map.views.SEARCH_TIMEOUT', 0.1):
+            found = views.search(workspace, 0, 0, 1, timings=timings)
+        self.assertEquals(found, [{'name': 'fast'}])
+        self.assertEquals(timings[0]['status'], 'timeout')
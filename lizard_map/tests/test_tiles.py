@@ -0,0 +1,95 @@
+from django.test import TestCase
+import mock
+
+from lizard_map import daterange
+from lizard_map import mapnik_pool
+from lizard_map import tiles
+
+
+class TestTileMath(TestCase):
+    def test_valid_tile(self):
+        self.assertTrue(tiles.valid_tile(0, 0, 0))
+        self.assertTrue(tiles.valid_tile(3, 7, 7))
+        self.assertFalse(tiles.valid_tile(3, 8, 0))
+        self.assertFalse(tiles.valid_tile(3, 0, -1))
+
+    def test_metatile_size_small_zoom(self):
+        # The whole world is smaller than a metatile.
+        self.assertEquals(tiles.metatile_size(0), 1)
+        self.assertEquals(tiles.metatile_size(2), 4)
+
+    def test_metatile_origin(self):
+        n = tiles.metatile_size(10)
+        self.assertEquals(tiles.metatile_origin(10, n + 1, 2 * n + 3),
+                          (n, 2 * n))
+
+    def test_tile_bbox_world(self):
+        bbox = tiles.tile_bbox(0, 0, 0)
+        self.assertEquals(bbox, (-tiles.GOOGLE_EXTENT, -tiles.GOOGLE_EXTENT,
+                                 tiles.GOOGLE_EXTENT, tiles.GOOGLE_EXTENT))
+
+    def test_tile_bbox_block(self):
+        # Upper left quarter of the world, y counts from the top.
+        x_min, y_min, x_max, y_max = tiles.tile_bbox(2, 0, 0, n=2)
+        self.assertEquals((x_min, x_max), (-tiles.GOOGLE_EXTENT, 0))
+        self.assertEquals((y_min, y_max), (0, tiles.GOOGLE_EXTENT))
+
+
+class TestTileCache(TestCase):
+    def setUp(self):
+        self.workspace_item = mock.Mock()
+        self.workspace_item.id = 1
+        self.workspace_item.adapter_class = 'adapter_dummy'
+        self.workspace_item.adapter_layer_json = '{"a": 1}'
+        self.workspace_item._meta.object_name = 'WorkspaceStorageItem'
+
+    def test_key_depends_on_layer_json(self):
+        key1 = tiles.TileCache(self.workspace_item).key(1, 0, 0)
+        self.workspace_item.adapter_layer_json = '{"a": 2}'
+        key2 = tiles.TileCache(self.workspace_item).key(1, 0, 0)
+        self.assertNotEquals(key1, key2)
+
+    def test_key_depends_on_time(self):
+        key1 = tiles.TileCache(self.workspace_item).key(1, 0, 0)
+        key2 = tiles.TileCache(
+            self.workspace_item, time_value='2013-01-01').key(1, 0, 0)
+        self.assertNotEquals(key1, key2)
+
+    def test_key_depends_on_session_date_range(self):
+        request = mock.Mock()
+        request.session = {}
+        key1 = tiles.TileCache(
+            self.workspace_item, request=request).key(1, 0, 0)
+        request.session = {daterange.SESSION_DT_START: '2013-01-01',
+                           daterange.SESSION_DT_END: '2013-02-01'}
+        key2 = tiles.TileCache(
+            self.workspace_item, request=request).key(1, 0, 0)
+        self.assertNotEquals(key1, key2)
+
+    def test_key_depends_on_legend_version(self):
+        key1 = tiles.TileCache(self.workspace_item).key(1, 0, 0)
+        mapnik_pool.bump_legend_version()
+        key2 = tiles.TileCache(self.workspace_item).key(1, 0, 0)
+        self.assertNotEquals(key1, key2)
+
+    def test_cached_tile_skips_rendering(self):
+        tile_cache = tiles.TileCache(self.workspace_item)
+        tile_cache.cache = mock.Mock()
+        tile_cache.cache.get.return_value = 'png'
+        with mock.patch.object(tile_cache, 'render_metatile') as render:
+            self.assertEquals(tile_cache.tile(1, 0, 0), 'png')
+            self.assertFalse(render.called)
+
+    def test_missing_tile_renders_metatile(self):
+        tile_cache = tiles.TileCache(self.workspace_item)
+        tile_cache.cache = mock.Mock()
+        tile_cache.cache.get.return_value = None
+        tile_cache.cache.add.return_value = True
+        rendered = {tile_cache.key(1, 0, 0): 'png',
+                    tile_cache.key(1, 1, 0): 'other png'}
+        with mock.patch.object(tile_cache, 'render_metatile',
+                               return_value=rendered):
+            self.assertEquals(tile_cache.tile(1, 0, 0), 'png')
+        tile_cache.cache.set_many.assert_called_with(
+            rendered, tiles.TILE_CACHE_TIMEOUT)
+        self.assertTrue(tile_cache.cache.delete.called)
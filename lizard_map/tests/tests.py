@@ -1,6 +1,7 @@
 import datetime
 import unittest
 
+from PIL import Image
 from django.core.urlresolvers import reverse
 from django.http import HttpRequest
 from django.test import TestCase
@@ -30,6 +31,7 @@ import lizard_map.admin
 import lizard_map.coordinates
 import lizard_map.layers
 import lizard_map.models
+import lizard_map.symbol_manager
 import lizard_map.urls
 import lizard_map.views
 
@@ -337,6 +339,62 @@ class WorkspaceItemAdapterTest(TestCase):
         self.assertTrue(aggregated_values['percentile'] >= 5.0)
         self.assertTrue(aggregated_values['percentile'] <= 6.0)
 
+    def test_value_aggregate_periods_default(self):
+        start_date = datetime.datetime(2010, 5, 25, tzinfo=pytz.UTC)
+        end_date = datetime.datetime(2010, 5, 30, tzinfo=pytz.UTC)
+        values = [{'datetime': start_date + datetime.timedelta(hours=i),
+                   'value': float(i % 7), 'unit': 'none'}
+                  for i in range(5 * 24 + 1)]
+        # Like real adapters, values() includes both ends.
+        self.adapter.values = (
+            lambda identifier, start_date, end_date:
+                [value for value in values
+                 if start_date <= value['datetime'] <= end_date])
+        aggregate_functions = {
+            'min': None, 'max': None, 'avg': None, 'count_lt': 3,
+            'count_gte': 3, 'percentile': 50}
+        periods = dateperiods.calc_aggregation_periods(
+            start_date, end_date, dateperiods.DAY)
+        expected = [
+            self.adapter.value_aggregate_default(
+                {}, aggregate_functions, period_start, period_end)
+            for period_start, period_end in periods]
+        aggregated_values = self.adapter.value_aggregate_periods_default(
+            {}, aggregate_functions, periods)
+        self.assertEqual(aggregated_values, expected)
+        # The value at midnight counts in both days.
+        self.assertEqual(
+            aggregated_values[0]['count_lt'] +
+            aggregated_values[0]['count_gte'], 25)
+
+    def test_value_aggregate_periods_default_strings(self):
+        start_date = datetime.datetime(2010, 5, 25)
+        end_date = datetime.datetime(2010, 5, 26)
+        self.adapter.values = (
+            lambda identifier, start_date, end_date:
+                [{'datetime': start_date, 'value': 'a', 'unit': 'none'}])
+        aggregated_values = self.adapter.value_aggregate_periods_default(
+            {}, {'avg': None, 'max': None}, [(start_date, end_date)])
+        self.assertEqual(aggregated_values, [{'avg': None, 'max': 'a'}])
+
+    def test_values_chunks(self):
+        start_date = datetime.datetime(2010, 5, 25)
+        end_date = datetime.datetime(2010, 5, 30)
+        values = [{'datetime': start_date + datetime.timedelta(hours=i),
+                   'value': i, 'unit': 'none'}
+                  for i in range(5 * 24 + 1)]
+        # Both start and end date are included.
+        self.adapter.values = (
+            lambda identifier, start_date, end_date:
+                [value for value in values
+                 if start_date <= value['datetime'] <= end_date])
+        chunks = list(self.adapter.values_chunks({}, start_date, end_date))
+        self.assertEqual(len(chunks), 1)
+        self.adapter.values_chunk_size = datetime.timedelta(days=2)
+        chunks = list(self.adapter.values_chunks({}, start_date, end_date))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(chunks, []), values)
+
     def test_symbol_url(self):
         self.assertTrue(self.adapter.symbol_url())
 
@@ -713,6 +771,27 @@ class SymbolManagerTest(TestCase):
         icon_names_list = lizard_map.symbol_manager.list_image_file_names()
         self.assertTrue(len(icon_names_list) > 5)
 
+    def test_colorize(self):
+        im = Image.new('RGBA', (2, 1), (200, 100, 50, 255))
+        im_mask = Image.new('RGBA', (2, 1), (0, 0, 0, 0))
+        im_mask.putpixel((0, 0), (0, 0, 0, 255))
+        result = lizard_map.symbol_manager.colorize(
+            im, im_mask, (0.5, 1.0, 0.0, 1.0))
+        # Masked pixel is colored, the other one is (almost) unaltered.
+        self.assertEquals(result.getpixel((0, 0)), (99, 99, 0, 255))
+        self.assertEquals(result.getpixel((1, 0)), (199, 99, 49, 255))
+
+    def test_generated_symbols_lru(self):
+        generated = lizard_map.symbol_manager.GeneratedSymbols(max_size=2)
+        generated.add('a.png')
+        generated.add('b.png')
+        self.assertTrue('a.png' in generated)
+        generated.add('c.png')
+        # b.png was least recently used.
+        self.assertFalse('b.png' in generated)
+        self.assertTrue('a.png' in generated)
+        self.assertTrue('c.png' in generated)
+
 
 # class DateRangeStore(unittest.TestCase):
 #     """Implements the tests for function compute_and_store_start_end."""
@@ -902,3 +981,10 @@ class ViewStateServiceTest(unittest.TestCase):
                 'dt_end': str(date2)}
         response = client.put(url, data=data)
         self.assertEqual(response.status_code, 200)
+
+
+class CsvStreamTest(TestCase):
+
+    def test_csv_stream(self):
+        lines = list(lizard_map.views.csv_stream([['a', 1], ['b', 2]]))
+        self.assertEqual(lines, ['a,1\r\n', 'b,2\r\n'])
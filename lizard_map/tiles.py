@@ -0,0 +1,178 @@
+"""
+Tile cache for the layers we render ourselves with mapnik.
+
+Next to the regular (BBOX) WMS view, workspace items can be requested as
+z/x/y tiles in the google projection. Tiles are rendered as metatiles of
+METATILE_SIZE x METATILE_SIZE tiles in one mapnik render, sliced and stored
+in the tile cache, so neighbouring tiles (and other users looking at the same
+stored workspace) are served without touching mapnik at all.
+
+Settings:
+
+- MAP_TILE_CACHE: name of the django cache to use (default 'default'),
+  configure a file based or memcached cache there.
+- MAP_TILE_CACHE_TIMEOUT: seconds a tile stays valid (default one hour).
+- MAP_METATILE_SIZE: number of tiles per metatile side (default 8).
+- MAP_METATILE_BUFFER: extra pixels rendered around a metatile so labels and
+  symbols on the edges are not cut off (default 128).
+"""
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+from lizard_map import coordinates
+from lizard_map.daterange import SESSION_DT_END
+from lizard_map.daterange import SESSION_DT_START
+from lizard_map.mapnik_pool import legend_version
+from lizard_map.mapnik_pool import mapnik_map_pool
+from lizard_map.mapnik_render import mapnik_render_service
+from lizard_map.utility import get_host
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+# Half the width of the google projection, in meters.
+GOOGLE_EXTENT = 20037508.342789244
+
+TILE_CACHE = getattr(settings, 'MAP_TILE_CACHE', 'default')
+TILE_CACHE_TIMEOUT = getattr(settings, 'MAP_TILE_CACHE_TIMEOUT', 60 * 60)
+METATILE_SIZE = getattr(settings, 'MAP_METATILE_SIZE', 8)
+METATILE_BUFFER = getattr(settings, 'MAP_METATILE_BUFFER', 128)
+# Maximum number of seconds to wait for another process that is
+# rendering the same metatile.
+METATILE_LOCK_TIMEOUT = 10
+
+
+def valid_tile(z, x, y):
+    """Return True if x and y are within the tile grid of zoom level z."""
+    return z >= 0 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def metatile_size(z):
+    """Return number of tiles per metatile side for zoom level z.
+
+    At the lowest zoom levels the whole world is smaller than a
+    metatile.
+    """
+    return min(METATILE_SIZE, 2 ** z)
+
+
+def metatile_origin(z, x, y):
+    """Return (x, y) of the upper left tile of the metatile containing
+    tile (x, y)."""
+    n = metatile_size(z)
+    return x - x % n, y - y % n
+
+
+def tile_bbox(z, x, y, n=1):
+    """Return google bbox (x_min, y_min, x_max, y_max) of the block of
+    n x n tiles with (x, y) as upper left tile.
+
+    Tiles are numbered like google/osm: y counts from the top.
+    """
+    tile_meters = 2 * GOOGLE_EXTENT / 2 ** z
+    return (
+        -GOOGLE_EXTENT + x * tile_meters,
+        GOOGLE_EXTENT - (y + n) * tile_meters,
+        -GOOGLE_EXTENT + (x + n) * tile_meters,
+        GOOGLE_EXTENT - y * tile_meters)
+
+
+def session_date_range(request):
+    """Return the date range chosen in the session of request, as a string.
+
+    Without a chosen range, layers use the default range relative to now,
+    which the tile cache timeout already allows to be a bit off.
+    """
+    session = getattr(request, 'session', None)
+    if session is None:
+        return ''
+    return '%s/%s' % (session.get(SESSION_DT_START, ''),
+                      session.get(SESSION_DT_END, ''))
+
+
+class TileCache(object):
+    """Cached tiles of a single workspace item.
+
+    Tiles are keyed by workspace item, a hash of its adapter_layer_json,
+    the requested style, time and layers, the date range of the session,
+    the legend version and of course z/x/y.
+    """
+
+    def __init__(self, workspace_item, layer_ids=None, style='',
+                 time_value='', request=None):
+        self.workspace_item = workspace_item
+        self.layer_ids = layer_ids
+        self.cache = get_cache(TILE_CACHE)
+
+        # Keep the key short and memcached-safe.
+        layer_hash = hashlib.md5()
+        for part in (workspace_item.adapter_class,
+                     workspace_item.adapter_layer_json,
+                     style, time_value, ','.join(layer_ids or []),
+                     session_date_range(request), legend_version()):
+            layer_hash.update(unicode(part).encode('utf-8'))
+            layer_hash.update('|')
+        self.key_prefix = 'lizard_map.tile::%s::%s::%s::%s' % (
+            get_host(), workspace_item._meta.object_name,
+            workspace_item.id, layer_hash.hexdigest())
+
+    def key(self, z, x, y):
+        return '%s::%d/%d/%d' % (self.key_prefix, z, x, y)
+
+    def tile(self, z, x, y, request=None):
+        """Return png of tile z/x/y, render its metatile if needed."""
+        key = self.key(z, x, y)
+        png = self.cache.get(key)
+        if png is not None:
+            return png
+
+        # Only one process renders a metatile, the others wait for it.
+        lock_key = '%s::lock' % self.key(z, *metatile_origin(z, x, y))
+        locked = self.cache.add(lock_key, True, METATILE_LOCK_TIMEOUT)
+        if not locked:
+            deadline = time.time() + METATILE_LOCK_TIMEOUT
+            while time.time() < deadline:
+                time.sleep(0.1)
+                png = self.cache.get(key)
+                if png is not None:
+                    return png
+            logger.warn("Waited too long for metatile of %s, "
+                        "rendering it myself.", key)
+
+        try:
+            tiles = self.render_metatile(z, x, y, request=request)
+            self.cache.set_many(tiles, TILE_CACHE_TIMEOUT)
+        finally:
+            if locked:
+                self.cache.delete(lock_key)
+        return tiles[key]
+
+    def render_metatile(self, z, x, y, request=None):
+        """Render the metatile containing tile z/x/y.
+
+        Return a dict with cache key: png for every tile in the metatile.
+        """
+        n = metatile_size(z)
+        meta_x, meta_y = metatile_origin(z, x, y)
+        size = n * TILE_SIZE
+
+        offsets = [(dx, dy) for dx in range(n) for dy in range(n)]
+        views = [(dx * TILE_SIZE, dy * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+                 for dx, dy in offsets]
+        with mapnik_map_pool.map(self.workspace_item, coordinates.GOOGLE,
+                                 size, size, layer_ids=self.layer_ids,
+                                 request=request,
+                                 buffer_size=METATILE_BUFFER) as mapnik_map:
+            logger.debug("Rendering metatile %d/%d/%d (%dx%d)...",
+                         z, meta_x, meta_y, n, n)
+            pngs = mapnik_render_service.render(
+                mapnik_map, tile_bbox(z, meta_x, meta_y, n), views=views)
+
+        tiles = {}
+        for (dx, dy), png in zip(offsets, pngs):
+            tiles[self.key(z, meta_x + dx, meta_y + dy)] = png
+        return tiles
@@ -27,6 +27,10 @@ urlpatterns = patterns(
     url(r'^myworkspace/wms/(?P<workspace_item_id>\d+)/$',
         'lizard_map.views.wms',
         name="lizard_map_workspace_edit_wms"),
+    url(r'^myworkspace/tiles/(?P<workspace_item_id>\d+)/'
+        r'(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$',
+        'lizard_map.views.wms_tile',
+        name="lizard_map_workspace_edit_tile"),
     url(r'^myworkspace/empty/$',
         lizard_map.views.WorkspaceEmptyView.as_view(),
         name="lizard_map_workspace_empty"),
@@ -97,6 +101,11 @@ urlpatterns = patterns(
     url(r'^workspace/(?P<workspace_storage_id>\d+)/(?P<workspace_item_id>\d+)/wms/$',
         'lizard_map.views.wms',
         name="lizard_map_workspace_storage_wms"),
+    url(r'^workspace/(?P<workspace_storage_id>\d+)/'
+        r'(?P<workspace_item_id>\d+)/tiles/'
+        r'(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$',
+        'lizard_map.views.wms_tile',
+        name="lizard_map_workspace_storage_tile"),
     url(r'^workspace/(?P<workspace_storage_id>\d+)/search_coordinates/',
         'lizard_map.views.search_coordinates',
         name="lizard_map.search_coordinates"),
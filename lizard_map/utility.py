@@ -1,5 +1,10 @@
 """Small utility functions"""
+from django.db import connection
+from lizard_ui import multitenancy
+from lizard_ui.multitenancy import set_host
 from tls import request
+from werkzeug.local import release_local
+import tls
 
 
 def short_string(value, length):
@@ -49,9 +54,32 @@ def analyze_http_user_agent(http_user_agent):
 def get_host():
     """Get the current host.
 
-    Needed in the multitancy Lizard 5 site for cache keys.
+    Needed in the multitancy Lizard 5 site for cache keys. Outside of a
+    request (celery tasks, worker threads) this is the host whose database
+    was set with lizard_ui.multitenancy.set_host, if any.
     """
     host = ''
     if hasattr(request, 'get_host'):
         host = request.get_host()
+    else:
+        host = multitenancy.get_host() or ''
     return host
+
+
+def call_in_request_context(request, function, *args, **kwargs):
+    """Call function in a worker thread as if it ran in the thread that
+    handles request.
+
+    Worker threads don't have the thread local request (see get_host) and
+    database host of the request thread, so set those up first. Afterwards
+    the thread local request and the thread's own database connection are
+    cleaned up.
+    """
+    if request is not None:
+        tls._local.request = request
+        set_host(request.get_host())
+    try:
+        return function(*args, **kwargs)
+    finally:
+        release_local(tls._local)
+        connection.close()
@@ -7,6 +7,8 @@ import datetime
 import logging
 import math
 import re
+import threading
+import time
 import urllib2
 from xml.dom.minidom import parseString
 from dateutil import parser as date_parser
@@ -18,9 +20,15 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.db import transaction
+from django.http import Http404
 from django.http import HttpResponse
 from django.http import (HttpResponseBadRequest, HttpResponseNotFound,
                          HttpResponseForbidden)
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django 1.4: a plain HttpResponse streams an iterator as well.
+    StreamingHttpResponse = HttpResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render
 from django.shortcuts import redirect
@@ -45,6 +53,8 @@ import mapnik
 import requests
 
 from lizard_map import coordinates
+from lizard_map import graph_cache
+from lizard_map import tiles
 from lizard_map.adapter import adapter_entrypoint
 from lizard_map.adapter import adapter_layer_arguments
 from lizard_map.adapter import parse_identifier_json
@@ -64,6 +74,9 @@ from lizard_map.forms import EmptyForm
 from lizard_map.forms import WorkspaceLoadForm
 from lizard_map.forms import WorkspaceSaveForm
 from lizard_map.lizard_widgets import Legend
+from lizard_map.mapnik_pool import mapnik_map_pool
+from lizard_map.mapnik_render import RenderError
+from lizard_map.mapnik_render import mapnik_render_service
 from lizard_map.models import BackgroundMap
 from lizard_map.models import CollageEdit
 from lizard_map.models import CollageEditItem
@@ -73,6 +86,7 @@ from lizard_map.models import WorkspaceEditItem
 from lizard_map.models import WorkspaceStorage
 from lizard_map.models import WorkspaceStorageItem
 from lizard_map.utility import analyze_http_user_agent
+from lizard_map.utility import call_in_request_context
 
 
 CUSTOM_LEGENDS = 'custom_legends'
@@ -84,6 +98,11 @@ MAX_LOCATIONS = getattr(settings, 'MAX_LOCATIONS', 50)
 # a whitelist to strings, before passing them in the raw SQL query
 LOCATION_NAME_CHARACTER_WHITELIST = re.compile(r'''[\W^ ^\,^\-^\.]''')
 
+# Searching the workspace items of a map click.
+SEARCH_MAX_WORKERS = getattr(settings, 'MAP_SEARCH_MAX_WORKERS', 8)
+SEARCH_TIMEOUT = getattr(settings, 'MAP_SEARCH_TIMEOUT', 15)
+SEARCH_TIMINGS_HEADER = 'X-Lizard-Search-Timings'
+
 DEFAULT_START_EXTENT = '-14675, 6668977, 1254790, 6964942'
 DEFAULT_PROJECTION = 'EPSG:900913'
 
@@ -1198,6 +1217,19 @@ Map stuff
 """
 
 
+def _wms_workspace(request, workspace_storage_id=None,
+                   workspace_storage_slug=None):
+    """Return workspace_storage by id or slug, or your own WorkspaceEdit."""
+    if workspace_storage_id is not None:
+        workspace_storage_id = int(workspace_storage_id)
+        return get_object_or_404(
+            WorkspaceStorage, pk=workspace_storage_id)
+    elif workspace_storage_slug is not None:
+        return get_object_or_404(
+            WorkspaceStorage, secret_slug=workspace_storage_slug)
+    return get_workspace_edit_by_request(request)
+
+
 def wms(request, workspace_item_id, workspace_storage_id=None,
         workspace_storage_slug=None):
     """Return PNG as WMS service for given workspace_edit or
@@ -1208,16 +1240,8 @@ def wms(request, workspace_item_id, workspace_storage_id=None,
     """
 
     workspace_item_id = int(workspace_item_id)
-
-    if workspace_storage_id is not None:
-        workspace_storage_id = int(workspace_storage_id)
-        workspace = get_object_or_404(
-            WorkspaceStorage, pk=workspace_storage_id)
-    elif workspace_storage_slug is not None:
-        workspace = get_object_or_404(
-            WorkspaceStorage, secret_slug=workspace_storage_slug)
-    else:
-        workspace = get_workspace_edit_by_request(request)
+    workspace = _wms_workspace(
+        request, workspace_storage_id, workspace_storage_slug)
 
     # WMS standard parameters
     width = int(request.GET.get('WIDTH'))
@@ -1230,68 +1254,148 @@ def wms(request, workspace_item_id, workspace_storage_id=None,
     # TODO: check that they're not none
 
     # Map settings
-    mapnik_map = mapnik.Map(width, height)
-    # Setup mapnik srs.
-    mapnik_map.srs = coordinates.srs_to_mapnik_projection[srs]
-    mapnik_map.background = mapnik.Color('transparent')
-    #m.background = mapnik.Color('blue')
+    mapnik_srs = coordinates.srs_to_mapnik_projection[srs]
 
     workspace_items = workspace.workspace_items.filter(
         visible=True, id=workspace_item_id).reverse()
     # len(workspace_items) should be 1:
     # we no longer combine all generated layers into a single WMS layer
+    png = None
     for workspace_item in workspace_items:
-        logger.debug("Drawing layer for %s..." % workspace_item)
+        with mapnik_map_pool.map(workspace_item, mapnik_srs, width, height,
+                                 layer_ids=req_layers,
+                                 request=request) as mapnik_map:
+            logger.debug("Rendering map...")
+            try:
+                png = mapnik_render_service.render(mapnik_map, bbox)
+            except RenderError:
+                return HttpResponse(status=503)
+    if png is None:
+        # Nothing to render, return an empty image.
+        png = mapnik.Image(width, height).tostring('png')
+    return HttpResponse(png, content_type='image/png')
+
+
+def wms_tile(request, workspace_item_id, z, x, y, workspace_storage_id=None,
+             workspace_storage_slug=None):
+    """Return PNG tile z/x/y (google projection) of a workspace item.
+
+    Tiled alternative for the wms view: tiles are rendered in metatiles
+    and cached, see lizard_map.tiles. Optional GET parameters LAYERS,
+    STYLES and TIME are passed on like in the wms view.
+    """
+    z, x, y = int(z), int(x), int(y)
+    if not tiles.valid_tile(z, x, y):
+        raise Http404
+    workspace = _wms_workspace(
+        request, workspace_storage_id, workspace_storage_slug)
+    workspace_item = get_object_or_404(
+        workspace.workspace_items, visible=True, id=int(workspace_item_id))
+
+    req_layers = request.GET.get('LAYERS', None)
+    if req_layers is not None:
+        req_layers = [layer.strip() for layer in req_layers.split(',')]
+    tile_cache = tiles.TileCache(
+        workspace_item,
+        layer_ids=req_layers,
+        style=request.GET.get('STYLES', ''),
+        time_value=request.GET.get('TIME', ''),
+        request=request)
+    try:
+        png = tile_cache.tile(z, x, y, request=request)
+    except RenderError:
+        return HttpResponse(status=503)
+    return HttpResponse(png, content_type='image/png')
+
+
+class WorkspaceItemSearch(threading.Thread):
+    """Calls adapter.search of a single workspace item, see search."""
+
+    def __init__(self, workspace_item, adapter, google_x, google_y, radius,
+                 request=None, semaphore=None):
+        super(WorkspaceItemSearch, self).__init__()
+        self.daemon = True
+        self.workspace_item = workspace_item
+        self.adapter = adapter
+        self.args = (google_x, google_y)
+        self.kwargs = {'radius': radius}
+        if getattr(adapter, 'search_with_request', False):
+            self.kwargs['request'] = request
+        self.request = request
+        self.semaphore = semaphore
+        self.found = []
+        self.status = 'timeout'
+        self.seconds = None
+
+    def search(self):
+        started = time.time()
         try:
-            layers, styles = workspace_item.adapter.layer(
-                layer_ids=req_layers,
-                request=request)
-            layers.reverse()  # first item should be drawn on top (=last)
-            for layer in layers:
-                mapnik_map.layers.append(layer)
-            for name in styles:
-                mapnik_map.append_style(name, styles[name])
+            self.found = self.adapter.search(*self.args, **self.kwargs)
+            self.status = 'ok'
         except:
-            # This part may NEVER crash. Layers from workspace items
-            # should prevent crashing themselves, but you never know.
-            logger.exception("Error in drawing layer for %s" % workspace_item)
+            logger.exception(
+                "Crashed while calling search on %s" %
+                self.workspace_item)
+            self.status = 'error'
+        self.seconds = time.time() - started
 
-    #Zoom and create image
-    logger.debug("Zooming to box...")
-    mapnik_map.zoom_to_box(mapnik.Box2d(*bbox))
-    # just have mapnik render the png, as it should be faster
-    # unfortunately mapnik doesn't support rendering to a stream (yet?)
-    img = mapnik.Image(width, height)
-    logger.debug("Rendering map...")
-    mapnik.render(mapnik_map, img)
-    response = HttpResponse(img.tostring('png'), content_type='image/png')
-    return response
+    def run(self):
+        with self.semaphore:
+            call_in_request_context(self.request, self.search)
 
+    def timing(self):
+        return {'name': self.workspace_item.name,
+                'adapter_class': self.workspace_item.adapter_class,
+                'status': self.status,
+                'seconds': self.seconds}
 
-def search(workspace, google_x, google_y, radius, request=None):
+
+def search(workspace, google_x, google_y, radius, request=None,
+           timings=None):
     """Search workspace for given coordinates.
 
     Return a list of found results in "adapter.search" dictionary
     format.
-    """
-    found = []
 
+    The workspace items are searched concurrently (at most
+    MAP_SEARCH_MAX_WORKERS at a time). Results of workspace items that
+    didn't finish within MAP_SEARCH_TIMEOUT seconds are left out. If a
+    list is given as timings, a timing dict is appended to it for every
+    workspace item.
+    """
+    searches = []
+    semaphore = threading.BoundedSemaphore(SEARCH_MAX_WORKERS)
     for workspace_item in workspace.workspace_items.filter(
         visible=True):
+        adapter = workspace_item.adapter
+        if adapter is None:
+            continue
+        searches.append(WorkspaceItemSearch(
+                workspace_item, adapter, google_x, google_y, radius,
+                request=request, semaphore=semaphore))
 
-        requestarg = {}
-        if getattr(workspace_item.adapter, 'search_with_request', False):
-            requestarg = {'request': request}
-
-        try:
-            search_results = workspace_item.adapter.search(
-                google_x, google_y, radius=radius, **requestarg)
-            found += search_results
-        except:
-            logger.exception(
-                "Crashed while calling search on %s" %
-                workspace_item)
+    if len(searches) == 1:
+        # No need for threads.
+        searches[0].search()
+    else:
+        for item_search in searches:
+            item_search.start()
+        deadline = time.time() + SEARCH_TIMEOUT
+        for item_search in searches:
+            item_search.join(max(0, deadline - time.time()))
 
+    found = []
+    for item_search in searches:
+        timed_out = item_search.is_alive()
+        timing = item_search.timing()
+        if timed_out:
+            logger.warn("Search on %s timed out, leaving it out.",
+                        item_search.workspace_item)
+            timing.update({'status': 'timeout', 'seconds': None})
+        elif item_search.status == 'ok':
+            found += item_search.found
+        if timings is not None:
+            timings.append(timing)
     return found
 
 
@@ -1350,7 +1454,9 @@ def search_coordinates(request,
             workspace = WorkspaceStorage.objects.get(pk=stored_workspace_id)
 
     # The actual search!
-    found = search(workspace, google_x, google_y, radius, request=request)
+    timings = []
+    found = search(workspace, google_x, google_y, radius, request=request,
+                   timings=timings)
     logger.debug('>>> FOUND <<< %s\n%s' % (format, repr(found)))
 
     if found:
@@ -1365,17 +1471,22 @@ def search_coordinates(request,
             # click propagation problems.
             result['x'] = x + (radius / 10)
             result['y'] = y - (radius / 10)
-            return HttpResponse(json.dumps(result))
-        if format == 'object':
+            response = HttpResponse(json.dumps(result))
+        elif format == 'object':
             result = [{'id': f['identifier'], 'name': f['name']}
                       for f in found]
-            return HttpResponse(json.dumps(result))
+            response = HttpResponse(json.dumps(result))
+        else:
+            # default: as popup
+            response = popup_json(found, request=request)
+    elif format == 'object':
+        response = HttpResponse([])
+    else:
+        response = popup_json([], request=request)
 
-        # default: as popup
-        return popup_json(found, request=request)
-    if format == 'object':
-            return HttpResponse([])
-    return popup_json([], request=request)
+    # Per workspace item search timings, for diagnostics.
+    response[SEARCH_TIMINGS_HEADER] = json.dumps(timings)
+    return response
 
 
 class CollageDetailView(CollageMixin, UiView):
@@ -1754,30 +1865,41 @@ def statistics_csv(request):
     """
     start_date, end_date = current_start_end_dates(request)
     collage = get_collage_edit_by_request(request)
-    collage_items = collage.collage_items.filter(visible=True)
-    statistics = []
-    for collage_item in collage_items:
-        statistics.extend(collage_item.statistics(start_date, end_date))
+    collage_items = list(collage.collage_items.filter(visible=True))
+
+    def rows():
+        yield ['Naam', 'Periode', 'Minimum', 'Maximum', 'Gemiddeld',
+               'Percentiel grens', 'Percentiel waarde',
+               'Grenswaarde', 'Aantal boven grenswaarde',
+               'Aantal onder grenswaarde']
+        # Statistics are calculated per collage item while streaming.
+        for collage_item in collage_items:
+            for row in collage_item.statistics(start_date, end_date):
+                yield [
+                    row['name'], row['period'], row['min'], row['max'],
+                    row['avg'], row['percentile_value'], row['percentile'],
+                    row['boundary_value'], row['count_lt'], row['count_gte']]
 
     # Statistics as csv.
     filename = 'statistieken.csv'
 
     # Make the csv output.
-    response = HttpResponse(mimetype='text/csv')
+    response = StreamingHttpResponse(csv_stream(rows()), mimetype='text/csv')
     response['Content-Disposition'] = ('attachment; filename="%s"' % filename)
-    writer = csv.writer(response)
-    writer.writerow(['Naam', 'Periode', 'Minimum', 'Maximum', 'Gemiddeld',
-                     'Percentiel grens', 'Percentiel waarde',
-                     'Grenswaarde', 'Aantal boven grenswaarde',
-                     'Aantal onder grenswaarde'])
-    for row in statistics:
-        writer.writerow([
-                row['name'], row['period'], row['min'], row['max'], row['avg'],
-                row['percentile_value'], row['percentile'],
-                row['boundary_value'], row['count_lt'], row['count_gte']])
     return response
 
 
+def csv_stream(rows):
+    """Yield rows (lists) as csv lines, one by one."""
+    line = StringIO.StringIO()
+    writer = csv.writer(line)
+    for row in rows:
+        writer.writerow(row)
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+
 # Adapter related views
 
 class AdapterMixin(object):
@@ -1873,6 +1995,8 @@ class AdapterImageView(AdapterMixin, ImageMixin, View):
     - width, height (optional)
     - start_date, end_date (optional, iso8601 format, default current)
     - layout_extra (optional)
+
+    Rendered graphs are cached, see lizard_map.graph_cache.
     """
 
     def get(self, request, *args, **kwargs):
@@ -1888,10 +2012,24 @@ class AdapterImageView(AdapterMixin, ImageMixin, View):
         # Add animation slider position, info from session data.
         layout_extra = self.layout_extra_from_request()
 
-        return current_adapter.image(
-            identifier_list, start_date, end_date,
-            width, height,
-            layout_extra=layout_extra)
+        cache = graph_cache.GraphCache()
+        key = graph_cache.graph_key(
+            kwargs['adapter_class'],
+            self.request.GET.get('adapter_layer_json'),
+            identifier_list, start_date, end_date, width, height,
+            layout_extra,
+            data_version=current_adapter.data_version(identifier_list),
+            user=request.user)
+        entry = cache.get(key)
+        if entry is None:
+            response = current_adapter.image(
+                identifier_list, start_date, end_date,
+                width, height,
+                layout_extra=layout_extra)
+            entry = cache.store(key, response)
+            if entry is None:
+                return response
+        return cache.response(request, entry)
 
 
 class AdapterValuesView(AdapterMixin, UiView):
@@ -1913,25 +2051,31 @@ class AdapterValuesView(AdapterMixin, UiView):
         identifier = self.identifier()
         start_date, end_date = self.start_end_dates_from_request()
 
-        self.values = adapter.values(identifier, start_date, end_date)
-
         self.name = adapter.location(**identifier).get('name', 'export')
 
         if output_type == 'csv':
             filename = ('%s.csv' % (self.name)).encode('us-ascii',
                                                        errors='ignore')
+
+            def rows():
+                yield ['Datum + tijdstip', 'Waarde', 'Eenheid']
+                # The values are fetched while streaming, only a chunk
+                # is in memory at a time.
+                for values in adapter.values_chunks(
+                    identifier, start_date, end_date):
+                    for row in values:
+                        yield [row['datetime'], row['value'], row['unit']]
+
             # Make the csv output.
-            response = HttpResponse(mimetype='text/csv')
+            response = StreamingHttpResponse(csv_stream(rows()),
+                                             mimetype='text/csv')
             response['Content-Disposition'] = (
                 'attachment; filename="%s"' %
                 filename)
-            writer = csv.writer(response)
-            writer.writerow(['Datum + tijdstip', 'Waarde', 'Eenheid'])
-            for row in self.values:
-                writer.writerow([row['datetime'], row['value'], row['unit']])
             return response
         else:
             # Make html table using self.values
+            self.values = adapter.values(identifier, start_date, end_date)
             return super(AdapterValuesView, self).get(
                 request, *args, **kwargs)
 
@@ -1956,6 +2100,8 @@ class AdapterFlotGraphDataView(AdapterMixin, APIView):
     - identifier (required, multiple supported)
     - start_date, end_date (optional, iso8601 format, default current)
     - layout_extra (optional)
+    - width (optional, width of the graph in pixels; the data is downsampled
+      to it if the adapter supports that)
     """
 
     @never_cache
@@ -1971,9 +2117,17 @@ class AdapterFlotGraphDataView(AdapterMixin, APIView):
         # Add animation slider position, info from session data.
         layout_extra = self.layout_extra_from_request()
 
+        extra_params = {}
+        width = self.request.GET.get('width', None)
+        if width and current_adapter.support_flot_graph_width:
+            try:
+                extra_params['width'] = int(width)
+            except ValueError:
+                logger.warn("Ignoring invalid graph width %r.", width)
+
         result = current_adapter.flot_graph_data(
             identifier_list, start_date, end_date,
-            layout_extra=layout_extra)
+            layout_extra=layout_extra, **extra_params)
         return RestResponse(result)
 
 
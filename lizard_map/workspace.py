@@ -1,3 +1,4 @@
+import calendar
 import os
 import json
 import logging
@@ -6,6 +7,7 @@ from django.conf import settings
 from django.template import RequestContext
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext as _
+import numpy
 
 from lizard_map.adapter import adapter_serialize
 from lizard_map.fields import Color
@@ -28,6 +30,82 @@ COLORS_DEFAULT = [
     ]
 
 
+def aggregate_values(values_only, aggregate_functions):
+    """Return dict with the aggregate_functions (see
+    WorkspaceItemAdapter.value_aggregate) applied to the sorted list
+    values_only."""
+    result = {}
+    for key, value in aggregate_functions.items():
+        try:
+            # Values are not always numbers - in case of strings
+            # this will result in a TypeError
+            # the sequence can be empty
+            if key == 'min':
+                result_value = min(values_only)
+            elif key == 'max':
+                result_value = max(values_only)
+            elif key == 'avg':
+                result_value = float(sum(values_only)) / len(values_only)
+            elif key == 'count_lt':
+                if value is None:
+                    result_value = None
+                else:
+                    result_value = 0
+                    for v in values_only:
+                        if v < value:  # value is boundary value
+                            result_value += 1
+            elif key == 'count_gte':
+                if value is None:
+                    result_value = None
+                else:
+                    result_value = 0
+                    for v in values_only:
+                        if v >= value:  # value is boundary value
+                            result_value += 1
+            elif key == 'percentile':
+                if value is None:
+                    result_value = None
+                else:
+                    rank = int(value * len(values_only) / 100.0 + 0.5)
+                    result_value = values_only[rank]
+            else:
+                result_value = None
+        except (ValueError, IndexError, TypeError, ZeroDivisionError):
+            result_value = None
+        result[key] = result_value
+    return result
+
+
+def aggregate_array(sorted_values, aggregate_functions):
+    """Same as aggregate_values, for a sorted numpy array of floats."""
+    count = len(sorted_values)
+    result = {}
+    for key, value in aggregate_functions.items():
+        result_value = None
+        if key in ('count_lt', 'count_gte') and value is not None:
+            count_lt = int(numpy.searchsorted(sorted_values, value,
+                                              side='left'))
+            result_value = count_lt if key == 'count_lt' else count - count_lt
+        elif count:
+            if key == 'min':
+                result_value = float(sorted_values[0])
+            elif key == 'max':
+                result_value = float(sorted_values[-1])
+            elif key == 'avg':
+                result_value = float(sorted_values.mean())
+            elif key == 'percentile' and value is not None:
+                rank = int(value * count / 100.0 + 0.5)
+                if rank < count:
+                    result_value = float(sorted_values[rank])
+        result[key] = result_value
+    return result
+
+
+def _timestamp(dt):
+    """Return seconds since epoch, naive datetimes are UTC."""
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1000000.0
+
+
 class WorkspaceItemAdapter(object):
     """Base class for workspace_item adapters.
 
@@ -46,6 +124,15 @@ class WorkspaceItemAdapter(object):
     allow_custom_legend = False
     support_flot_graph = False
     # ^^^ Set this once flot graphs are supported by the adapter.
+    support_flot_graph_width = False
+    # ^^^ Set this if flot_graph_data() accepts a width (in pixels) to
+    # downsample the data to, see lizard_map.adapter.FlotGraph.
+    reuse_mapnik_map = True
+    # ^^^ Set to False if the result of layer() changes with the data, so
+    # the prepared mapnik map is not pooled (see lizard_map.mapnik_pool).
+    values_chunk_size = None
+    # ^^^ Set to a timedelta to let values_chunks() fetch long periods in
+    # parts of that size, for instance for csv exports.
 
     def __init__(self, workspace_item, layer_arguments=None,
                  adapter_class=None):
@@ -158,59 +245,107 @@ class WorkspaceItemAdapter(object):
         """
         return {}
 
+    def value_aggregate_periods(self, identifier, aggregate_functions,
+                                periods):
+        """
+        Calculates aggregated values of identifier for every (start_date,
+        end_date) tuple in periods. Returns list with a value_aggregate()
+        dict per period.
+
+        The default calls value_aggregate() for every period. Adapters
+        whose value_aggregate() is value_aggregate_default() should use
+        value_aggregate_periods_default(), which fetches the values only
+        once.
+        """
+        return [self.value_aggregate(identifier, aggregate_functions,
+                                     start_date=start_date,
+                                     end_date=end_date)
+                for start_date, end_date in periods]
+
     def values(self, identifier, start_date, end_date):
         """Return values in list of dictionaries (datetime, value, unit)
         """
         raise NotImplementedError
 
+    def values_chunks(self, identifier, start_date, end_date):
+        """Yield the values of values() in consecutive lists (chunks).
+
+        Without values_chunk_size, there is one chunk with all values.
+        Adapters that can page through their data can override this.
+        """
+        if not self.values_chunk_size:
+            yield self.values(identifier, start_date, end_date)
+            return
+
+        last_datetime = None
+        chunk_start = start_date
+        while chunk_start < end_date:
+            chunk_end = min(chunk_start + self.values_chunk_size, end_date)
+            values = self.values(identifier, chunk_start, chunk_end)
+            if last_datetime is not None:
+                # A value on the boundary is returned by both chunks.
+                values = [value for value in values
+                          if value['datetime'] > last_datetime]
+            if values:
+                last_datetime = values[-1]['datetime']
+                yield values
+            chunk_start = chunk_end
+
     def value_aggregate_default(self, identifier, aggregate_functions,
                                 start_date, end_date):
         """
         Default implementation for value_aggregate.
         """
 
-        result = {}
         values = self.values(identifier, start_date, end_date)
         values_only = [value['value'] for value in values]
         values_only.sort()  # for percentile function
-        for key, value in aggregate_functions.items():
-            try:
-                # Values are not always numbers - in case of strings
-                # this will result in a TypeError
-                # the sequence can be empty
-                if key == 'min':
-                    result_value = min(values_only)
-                elif key == 'max':
-                    result_value = max(values_only)
-                elif key == 'avg':
-                    result_value = float(sum(values_only)) / len(values_only)
-                elif key == 'count_lt':
-                    if value is None:
-                        result_value = None
-                    else:
-                        result_value = 0
-                        for v in values_only:
-                            if v < value:  # value is boundary value
-                                result_value += 1
-                elif key == 'count_gte':
-                    if value is None:
-                        result_value = None
-                    else:
-                        result_value = 0
-                        for v in values_only:
-                            if v >= value:  # value is boundary value
-                                result_value += 1
-                elif key == 'percentile':
-                    if value is None:
-                        result_value = None
-                    else:
-                        rank = int(value * len(values_only) / 100.0 + 0.5)
-                        result_value = values_only[rank]
-                else:
-                    result_value = None
-            except (ValueError, IndexError, TypeError, ZeroDivisionError):
-                result_value = None
-            result[key] = result_value
+        return aggregate_values(values_only, aggregate_functions)
+
+    def value_aggregate_periods_default(self, identifier,
+                                        aggregate_functions, periods):
+        """
+        Default implementation for value_aggregate_periods.
+
+        Fetches the values of all periods at once and divides them over
+        the periods. Like values(), a period includes both its start_date
+        and its end_date, so a value on the boundary of two periods counts
+        in both, as it does with value_aggregate_periods(). Periods must be
+        in chronological order.
+        """
+        if not periods:
+            return []
+        values = self.values(identifier, periods[0][0], periods[-1][1])
+        timestamps = numpy.array(
+            [_timestamp(value['datetime']) for value in values])
+        order = numpy.argsort(timestamps, kind='mergesort')
+        timestamps = timestamps[order]
+        try:
+            values_only = numpy.array(
+                [value['value'] for value in values], dtype=float)[order]
+        except (ValueError, TypeError):
+            values_only = None
+        if values_only is not None and numpy.isnan(values_only).any():
+            # None values end up as nan.
+            values_only = None
+        # If values_only is None, there are values that are not numbers,
+        # let aggregate_values sort it out.
+
+        result = []
+        for start_date, end_date in periods:
+            first = numpy.searchsorted(
+                timestamps, _timestamp(start_date), side='left')
+            last = numpy.searchsorted(
+                timestamps, _timestamp(end_date), side='right')
+            if values_only is None:
+                period_values = sorted(
+                    values[i]['value'] for i in order[first:last])
+                result.append(aggregate_values(period_values,
+                                               aggregate_functions))
+            else:
+                result.append(aggregate_array(
+                        numpy.sort(values_only[first:last]),
+                        aggregate_functions))
         return result
 
     def location(self, layout=None, **identifier):
@@ -331,6 +466,17 @@ class WorkspaceItemAdapter(object):
 
         raise NotImplementedError
 
+    def data_version(self, identifiers=None):
+        """Return token that changes when new data arrives, for instance
+        the time of the latest import.
+
+        Rendered graphs are cached with this token in their key (see
+        lizard_map.graph_cache), so they are rendered again as soon as it
+        changes. Without a token (None), cached graphs are only renewed
+        after MAP_GRAPH_CACHE_TIMEOUT.
+        """
+        return None
+
     def symbol_url(self, identifier=None, start_date=None, end_date=None,
                    icon_style=None):
         """Return symbol for identifier.
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
-from math import log, exp
+from math import ceil, log, exp
 
 import datetime
+import numpy
 import pytz
 
 from django.conf import settings
@@ -52,56 +53,62 @@ def rain_stats(values,
     """Calculate stats.
 
     Expects utc, returns site timezone datetimes... Sorry."""
+    return rain_stats_windows(values, area_km2, [td_window],
+                              start_date_utc, end_date_utc)[0]
+
+
+def rain_stats_windows(values,
+                       area_km2,
+                       td_windows,
+                       start_date_utc,
+                       end_date_utc):
+    """Calculate stats for every window in td_windows at once.
+
+    Returns a list with the rain_stats() result of every window."""
 
     logger.debug(('Calculating rain stats for' +
-                  'start=%s, end=%s, td_window=%s') %
-                 (start_date_utc, end_date_utc, td_window))
+                  'start=%s, end=%s, td_windows=%s') %
+                 (start_date_utc, end_date_utc, td_windows))
 
     if not values:
-        return {
-            'td_window': td_window,
-            'max': None,
-            'start': None,
-            'end': None,
-            't': t_to_string(None)}
+        return [{
+                'td_window': td_window,
+                'max': None,
+                'start': None,
+                'end': None,
+                't': t_to_string(None)} for td_window in td_windows]
 
     tz = pytz.timezone(settings.TIME_ZONE)
 
     td_value = UNIT_TO_TIMEDELTA[values[0]['unit']]
-    max_values = moving_sum(values,
-                            td_window,
-                            td_value,
-                            start_date_utc,
-                            end_date_utc)
-
-    if max_values:
-        max_value = max(max_values, key=lambda i: i['value'])
-
-        hours = td_window.days * 24 + td_window.seconds / 3600.0
-        t = herhalingstijd(hours, area_km2, max_value['value'])
-    else:
-        max_value = {'value': None,
-                     'datetime_start_utc': None,
-                     'datetime_end_utc': None}
-        t = None
-
-    if max_value['datetime_start_utc'] is not None:
-        datetime_start_site_tz = max_value[
-            'datetime_start_utc'].astimezone(tz)
-    else:
-        datetime_start_site_tz = None
-    if max_value['datetime_end_utc'] is not None:
-        datetime_end_site_tz = max_value[
-            'datetime_end_utc'].astimezone(tz)
-    else:
-        datetime_end_site_tz = None
-
-    return {
-        'td_window': td_window,
-        'max': max_value['value'],
-        'start': datetime_start_site_tz,
-        'end': datetime_end_site_tz,
-        't': t_to_string(t)}
+    max_values = max_moving_sums(values,
+                                 td_windows,
+                                 td_value,
+                                 start_date_utc,
+                                 end_date_utc)
+
+    result = []
+    for td_window, max_value in zip(td_windows, max_values):
+        if max_value is not None:
+            hours = td_window.days * 24 + td_window.seconds / 3600.0
+            t = herhalingstijd(hours, area_km2, max_value['value'])
+            datetime_start_site_tz = max_value[
+                'datetime_start_utc'].astimezone(tz)
+            datetime_end_site_tz = max_value[
+                'datetime_end_utc'].astimezone(tz)
+        else:
+            max_value = {'value': None}
+            t = None
+            datetime_start_site_tz = None
+            datetime_end_site_tz = None
+
+        result.append({
+                'td_window': td_window,
+                'max': max_value['value'],
+                'start': datetime_start_site_tz,
+                'end': datetime_end_site_tz,
+                't': t_to_string(t)})
+    return result
 
 
 def meter_square_to_km_square(meter_square):
@@ -142,34 +149,8 @@ def moving_sum(values, td_window, td_value, start_date_utc, end_date_utc):
     window_start_last = (end_date_utc - td_window +
                          datetime.timedelta(seconds=2))
 
-    # Calculate start of first window based on td_value. The whole timespan to
-    # which the first value which hypothetically could be as the start_date
-    # minus the td_value, should be in the window.
-    # window_increment is also based on td_value
-    if (td_value.days == 1):
-        # 24 hour data, fix to hour and subtract td_value
-        window_start = start_date_utc.replace(hour=0,
-                                              minute=0,
-                                              second=0,
-                                              microsecond=0) - td_value
-        # It is not known in advance at which hour of day the 24 hour data
-        # is stored, so the window advances by hour and not by 24 hours
-        window_increment = datetime.timedelta(hours=1)
-    elif (td_value.seconds == 3600):
-        window_increment = td_value
-        # 1 hour data, fix to hour and subtract td_value
-        window_start = start_date_utc.replace(hour=0,
-                                              minute=0,
-                                              second=0,
-                                              microsecond=0) - td_value
-    elif (td_value.seconds == 300):
-        window_increment = td_value
-        # 5 minute data, fix to whole five minutes before startdate
-        window_start = start_date_utc.replace(hour=0,
-                                              minute=5 * int(
-                                                start_date_utc.minute / 5),
-                                              second=0,
-                                              microsecond=0) - td_value
+    window_start, window_increment = window_grid(td_value, start_date_utc)
+
     # Fast way to calculate sum values.
     len_values = len(values)
     min_index, max_index = 0, -1  # Nothing todo with backwards indexing...
@@ -216,3 +197,97 @@ def moving_sum(values, td_window, td_value, start_date_utc, end_date_utc):
 
         window_start += window_increment
     return max_values
+
+
+def window_grid(td_value, start_date_utc):
+    """Return start of the first window and the window increment for
+    values with a timespan of td_value."""
+    # Calculate start of first window based on td_value. The whole timespan to
+    # which the first value which hypothetically could be as the start_date
+    # minus the td_value, should be in the window.
+    # window_increment is also based on td_value
+    if (td_value.days == 1):
+        # 24 hour data, fix to hour and subtract td_value
+        window_start = start_date_utc.replace(hour=0,
+                                              minute=0,
+                                              second=0,
+                                              microsecond=0) - td_value
+        # It is not known in advance at which hour of day the 24 hour data
+        # is stored, so the window advances by hour and not by 24 hours
+        window_increment = datetime.timedelta(hours=1)
+    elif (td_value.seconds == 3600):
+        window_increment = td_value
+        # 1 hour data, fix to hour and subtract td_value
+        window_start = start_date_utc.replace(hour=0,
+                                              minute=0,
+                                              second=0,
+                                              microsecond=0) - td_value
+    elif (td_value.seconds == 300):
+        window_increment = td_value
+        # 5 minute data, fix to whole five minutes before startdate
+        window_start = start_date_utc.replace(hour=0,
+                                              minute=5 * int(
+                                                start_date_utc.minute / 5),
+                                              second=0,
+                                              microsecond=0) - td_value
+    else:
+        # Any other whole hours data, treat like 1 hour data.
+        window_increment = td_value
+        window_start = start_date_utc.replace(hour=0,
+                                              minute=0,
+                                              second=0,
+                                              microsecond=0) - td_value
+    return window_start, window_increment
+
+
+def _seconds(td):
+    return td.days * 24 * 3600 + td.seconds + td.microseconds / 1000000
+
+
+def max_moving_sums(values, td_windows, td_value,
+                    start_date_utc, end_date_utc):
+    """Return the maximum of moving_sum() for every window in td_windows.
+
+    Instead of moving the window value by value, the sum of every window
+    on the grid is the difference of two cumulative sums, looked up with
+    a binary search. The values are converted to arrays once for all
+    windows. Returns for every window the moving_sum() item with the
+    highest value (the first one on ties), or None if no window contains
+    any values."""
+    window_start, window_increment = window_grid(td_value, start_date_utc)
+    increment = _seconds(window_increment)
+
+    # Seconds since the start of the first window.
+    ends = numpy.array(
+        [_seconds(value['datetime'] - window_start) for value in values])
+    starts = ends - _seconds(td_value)
+    cumulative = numpy.zeros(len(values) + 1)
+    cumulative[1:] = numpy.cumsum([value['value'] for value in values])
+
+    result = []
+    for td_window in td_windows:
+        # Same end condition as moving_sum().
+        window_start_last = _seconds(
+            end_date_utc - td_window + datetime.timedelta(seconds=2) -
+            window_start)
+        num_windows = max(int(ceil(window_start_last / increment)), 0)
+        window_starts = numpy.arange(num_windows) * increment
+
+        # Both ends of the timespan of a value need to be in the window.
+        first = numpy.searchsorted(starts, window_starts, side='left')
+        after_last = numpy.searchsorted(
+            ends, window_starts + _seconds(td_window), side='right')
+        filled = numpy.flatnonzero(after_last > first)
+        if not len(filled):
+            result.append(None)
+            continue
+
+        sums = cumulative[after_last[filled]] - cumulative[first[filled]]
+        index = int(filled[numpy.argmax(sums)])
+        max_window_start = window_start + index * window_increment
+        result.append({
+                'value': float(sums.max()),
+                'datetime_start_utc': max_window_start,
+                'datetime_end_utc': max_window_start + td_window,
+                })
+    return result
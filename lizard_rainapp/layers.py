@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
+import calendar
 import datetime
-import iso8601
 import locale
 import logging
 import mapnik
+import numpy
 import pytz
 
 from django.conf import settings
@@ -24,7 +25,7 @@ from nens_graph.rainapp import RainappGraph
 
 from lizard_rainapp.calculations import UNIT_TO_TIMEDELTA
 from lizard_rainapp.calculations import meter_square_to_km_square
-from lizard_rainapp.calculations import rain_stats
+from lizard_rainapp.calculations import rain_stats_windows
 from lizard_rainapp.calculations import t_to_string
 from lizard_rainapp.models import CompleteRainValue
 from lizard_rainapp.models import GeoObject
@@ -42,6 +43,39 @@ except locale.Error:
 
 LEGEND_DESCRIPTOR = 'Rainapp'
 UTC = pytz.timezone('UTC')
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def to_timestamp(dt):
+    """Return seconds since epoch of dt, naive datetimes are UTC."""
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1000000
+
+
+def values_to_columns(values):
+    """Return values as (timestamps, values, unit).
+
+    Timestamps (seconds since epoch) and values are numpy arrays, which
+    pickle a lot more compact and faster than a list of dicts with
+    datetimes. A timeseries has a single unit. Missing values (None)
+    are stored as nan, columns_to_values() turns them back into None.
+    """
+    timestamps = numpy.array(
+        [to_timestamp(value['datetime']) for value in values],
+        dtype=numpy.float64)
+    floats = numpy.array([value['value'] for value in values],
+                         dtype=numpy.float64)
+    unit = values[0]['unit'] if values else None
+    return timestamps, floats, unit
+
+
+def columns_to_values(timestamps, values, unit):
+    """Return list of dicts with UTC datetime, value and unit."""
+    return [{'datetime': EPOCH + datetime.timedelta(seconds=timestamp),
+             'value': None if missing else value,
+             'unit': unit}
+            for timestamp, value, missing in zip(timestamps.tolist(),
+                                                 values.tolist(),
+                                                 numpy.isnan(values).tolist())]
 
 
 class RainAppAdapter(FewsJdbc):
@@ -51,6 +85,11 @@ class RainAppAdapter(FewsJdbc):
     identifier: {'location': <locationid>}
     """
     support_flot_graph = True
+    support_flot_graph_width = True
+    # The layer query contains the latest imported datetime.
+    reuse_mapnik_map = False
+    # Export years of 5 minute data a month at a time.
+    values_chunk_size = datetime.timedelta(days=31)
 
     def __init__(self, *args, **kwargs):
         super(RainAppAdapter, self).__init__(
@@ -95,6 +134,15 @@ class RainAppAdapter(FewsJdbc):
                         (location_id, named_locations))
             return "Unknown location"  # TODO
 
+    def data_version(self, identifiers=None):
+        """Return datetime of the latest complete import."""
+        if not self.rainapp_config:
+            return None
+        return CompleteRainValue.objects.filter(
+            parameterkey=self.parameterkey,
+            config=self.rainapp_config).aggregate(
+            md=Max('datetime'))['md']
+
     def layer(self, *args, **kwargs):
         """Return mapnik layers and styles."""
 
@@ -299,6 +347,17 @@ class RainAppAdapter(FewsJdbc):
         more'. Else the cache will always miss. Expects and returns UTC
         datetimes, with or without tzinfo
         """
+        timestamps, values, unit = self._cached_columns(
+            identifier, start_date, end_date)
+        return columns_to_values(timestamps, values, unit)
+
+    def _cached_columns(self, identifier, start_date, end_date):
+        """Return values between start_date and end_date as (timestamps,
+        values, unit), see values_to_columns().
+
+        The columns are cached as a whole, the requested range is sliced
+        out with a binary search.
+        """
 
         start_date_cache = datetime.datetime(
             start_date.year, start_date.month, start_date.day)
@@ -307,43 +366,33 @@ class RainAppAdapter(FewsJdbc):
                 end_date.year, end_date.month, end_date.day) +
                 datetime.timedelta(days=1))
 
-        cache_key = hash('%s::%s::%s::%s::%s::%s' % (
+        cache_key = 'lizard_rainapp.columns::%s' % hash(
+            '%s::%s::%s::%s::%s::%s' % (
                 self.jdbc_source.id, self.filterkey, self.parameterkey,
                 identifier['location'], start_date_cache, end_date_cache))
-        # Datetimes are in string and stored in datetime_str.
-        values = cache.get(cache_key)
-        if values is None:
+        columns = cache.get(cache_key)
+        if columns is None:
             logger.debug('Caching values for %s' % identifier['location'])
-            values = self.values(identifier, start_date, end_date)
-            # Convert datetimes to strings, the
-            # iso8601.iso8601.FixedOffset will not de-pickle.
-            for value in values:
-                value['datetime_str'] = value['datetime'].isoformat()
-                del value['datetime']
-            cache.set(cache_key, values, 5 * 60)
+            columns = values_to_columns(
+                self.values(identifier, start_date, end_date))
+            cache.set(cache_key, columns, 5 * 60)
             logger.debug('Cache written')
         else:
             logger.debug('Got timeseries from cache')
 
-        if not values:
-            return []
-
-        # Convert datetime strings to datetime in values
-        for value in values:
-            value['datetime'] = iso8601.parse_date(value['datetime_str'])
-            del value['datetime_str']
-
-        # Make start_date and end_date tz aware
-        start_date = start_date.replace(tzinfo=values[0]['datetime'].tzinfo)
-        end_date = end_date.replace(tzinfo=values[0]['datetime'].tzinfo)
-
+        timestamps, values, unit = columns
         # Remove datetimes out of range.
-        while values and values[0]['datetime'] < start_date:
-            del values[0]
-        while values and values[-1]['datetime'] > end_date:
-            del values[-1]
-
-        return values
+        first = numpy.searchsorted(timestamps, to_timestamp(start_date),
+                                   side='left')
+        last = numpy.searchsorted(timestamps, to_timestamp(end_date),
+                                  side='right')
+        return timestamps[first:last], values[first:last], unit
+
+    def value_aggregate_periods(self, identifier, aggregate_functions,
+                                periods):
+        """Fetch the values once for all collage statistics periods."""
+        return self.value_aggregate_periods_default(
+            identifier, aggregate_functions, periods)
 
     def html(self, identifiers=None, layout_options=None):
         """
@@ -401,12 +450,11 @@ class RainAppAdapter(FewsJdbc):
                 'name': infoname,
                 'location': self._get_location_name(identifier),
                 'period_summary_row': period_summary_row,
-                'table': [rain_stats(values,
-                                     area_km2,
-                                     td_window,
-                                     start_date_utc,
-                                     end_date_utc)
-                          for td_window in td_windows],
+                'table': rain_stats_windows(values,
+                                            area_km2,
+                                            td_windows,
+                                            start_date_utc,
+                                            end_date_utc),
                 'image_graph_url': image_graph_url,
                 'flot_graph_data_url': flot_graph_data_url,
                 'url': self.workspace_mixin_item.url(
@@ -437,11 +485,13 @@ class RainAppAdapter(FewsJdbc):
         start_date,
         end_date,
         layout_extra=None,
+        width=None,
     ):
         return self._render_graph(
             identifiers,
             start_date,
             end_date,
             layout_extra=layout_extra,
-            GraphClass=FlotGraph
+            GraphClass=FlotGraph,
+            width=width
         )
@@ -0,0 +1,64 @@
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import, division
+
+import datetime
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+import pytz
+
+from lizard_rainapp.calculations import max_moving_sums
+from lizard_rainapp.calculations import moving_sum
+
+NUMBER = 5
+TD_WINDOWS = [datetime.timedelta(days=2),
+              datetime.timedelta(days=1),
+              datetime.timedelta(hours=3),
+              datetime.timedelta(hours=1)]
+
+
+def five_minute_values(start_date, end_date):
+    values = []
+    dt = start_date
+    td_value = datetime.timedelta(minutes=5)
+    while dt <= end_date:
+        values.append({'datetime': dt,
+                       'value': random.random(),
+                       'unit': 'mm/5min'})
+        dt += td_value
+    return values
+
+
+def max_by_moving_sum(values, td_value, start_date, end_date):
+    """The old way: a moving_sum per window."""
+    result = []
+    for td_window in TD_WINDOWS:
+        sums = moving_sum(values, td_window, td_value, start_date, end_date)
+        result.append(max(sums, key=lambda i: i['value']))
+    return result
+
+
+class Command(BaseCommand):
+    args = '[days]'
+    help = """Compare the rain statistics of a popup (four windows) over
+5 minute data, calculated with moving_sum (old) and max_moving_sums (new)."""
+
+    def handle(self, *args, **options):
+        days = int(args[0]) if args else 31
+        end_date = datetime.datetime(2013, 1, 1, tzinfo=pytz.utc)
+        start_date = end_date - datetime.timedelta(days=days)
+        values = five_minute_values(start_date, end_date)
+        td_value = datetime.timedelta(minutes=5)
+
+        old = timeit.timeit(
+            lambda: max_by_moving_sum(
+                values, td_value, start_date, end_date), number=NUMBER)
+        new = timeit.timeit(
+            lambda: max_moving_sums(
+                values, TD_WINDOWS, td_value, start_date, end_date),
+            number=NUMBER)
+        print('Rain stats for %d days of 5 minute data (%d values):' % (
+                days, len(values)))
+        print('  moving_sum:      %8.2f ms per popup' % (old / NUMBER * 1e3))
+        print('  max_moving_sums: %8.2f ms per popup' % (new / NUMBER * 1e3))
@@ -0,0 +1,92 @@
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import, division
+
+import cPickle as pickle
+import datetime
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+import iso8601
+import numpy
+import pytz
+
+from lizard_rainapp.layers import columns_to_values
+from lizard_rainapp.layers import to_timestamp
+from lizard_rainapp.layers import values_to_columns
+
+NUMBER = 20
+
+
+def old_payload(values):
+    """The old cache format: list of dicts with datetime strings."""
+    payload = []
+    for value in values:
+        value = value.copy()
+        value['datetime_str'] = value['datetime'].isoformat()
+        del value['datetime']
+        payload.append(value)
+    return payload
+
+
+def old_hit(pickled, start_date, end_date):
+    values = pickle.loads(pickled)
+    for value in values:
+        value['datetime'] = iso8601.parse_date(value['datetime_str'])
+        del value['datetime_str']
+    while values and values[0]['datetime'] < start_date:
+        del values[0]
+    while values and values[-1]['datetime'] > end_date:
+        del values[-1]
+    return values
+
+
+def new_hit(pickled, start_date, end_date):
+    timestamps, values, unit = pickle.loads(pickled)
+    first = numpy.searchsorted(timestamps, to_timestamp(start_date),
+                               side='left')
+    last = numpy.searchsorted(timestamps, to_timestamp(end_date),
+                              side='right')
+    return columns_to_values(
+        timestamps[first:last], values[first:last], unit)
+
+
+class Command(BaseCommand):
+    args = '[days]'
+    help = """Compare cache hit latency and size of the cached values of
+the rain app for 5 minute data, in the old (list of dicts) and new
+(columns) format."""
+
+    def handle(self, *args, **options):
+        days = int(args[0]) if args else 31
+        end_date = datetime.datetime(2013, 1, 1, tzinfo=pytz.utc)
+        start_date = end_date - datetime.timedelta(days=days)
+        values = []
+        dt = start_date
+        while dt <= end_date:
+            values.append({'datetime': dt,
+                           'value': random.random(),
+                           'unit': 'mm/5min'})
+            dt += datetime.timedelta(minutes=5)
+        # Ask for the middle part, like a period within the cached days.
+        slice_start = start_date + datetime.timedelta(hours=12)
+        slice_end = end_date - datetime.timedelta(hours=12)
+
+        old = pickle.dumps(old_payload(values), pickle.HIGHEST_PROTOCOL)
+        new = pickle.dumps(values_to_columns(values), pickle.HIGHEST_PROTOCOL)
+        old_time = timeit.timeit(
+            lambda: old_hit(old, slice_start, slice_end), number=NUMBER)
+        new_time = timeit.timeit(
+            lambda: new_hit(new, slice_start, slice_end), number=NUMBER)
+        # Without building the list of dicts.
+        columns_time = timeit.timeit(
+            lambda: pickle.loads(new), number=NUMBER)
+
+        print('Cache hit for %d days of 5 minute data (%d values):' % (
+                days, len(values)))
+        print('  list of dicts: %8.2f ms, %8d bytes' % (
+                old_time / NUMBER * 1e3, len(old)))
+        print('  columns:       %8.2f ms, %8d bytes' % (
+                new_time / NUMBER * 1e3, len(new)))
+        print('  (unpickling columns only: %.3f ms)' % (
+                columns_time / NUMBER * 1e3))
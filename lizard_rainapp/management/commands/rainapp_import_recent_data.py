@@ -3,15 +3,23 @@
 from __future__ import division
 
 from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db import transaction
 
 from lizard_rainapp.models import CompleteRainValue
 from lizard_rainapp.models import GeoObject
 from lizard_rainapp.models import RainValue
 from lizard_rainapp.models import RainappConfig
 
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
 import datetime
+import json
 import logging
+import multiprocessing
 import sys
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +37,102 @@ class NoDataError(Exception):
     pass
 
 
-def import_recent_data(rainapp_config, datetime_ref):
-    """Copy the rainvalues most recent to datetime_ref into local db."""
+class TimeBudgetExceeded(Exception):
+    pass
+
+
+class ImportSummary(object):
+    """Machine readable summary of the import of a single config.
+
+    Parameters can be imported in parallel, so the seconds per stage are
+    summed over the parameters and can exceed the wall clock time.
+    """
+
+    def __init__(self, rainapp_config):
+        self.config = rainapp_config.slug
+        self.status = 'ok'
+        self.rows_fetched = 0
+        self.rows_written = 0
+        self.seconds = {}
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, rows_fetched=0, rows_written=0):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+            self.rows_fetched += rows_fetched
+            self.rows_written += rows_written
+
+    def fail(self, status):
+        """Mark the import as failed, a timeout wins over an error."""
+        with self._lock:
+            if self.status != 'timeout':
+                self.status = status
+
+    def as_dict(self):
+        return {
+            'config': self.config,
+            'status': self.status,
+            'rows_fetched': self.rows_fetched,
+            'rows_written': self.rows_written,
+            'seconds': dict((stage, round(seconds, 3)) for
+                            stage, seconds in self.seconds.items()),
+            'total_seconds': round(
+                (self.finished or time.time()) - self.started, 3),
+            }
+
+
+def run_in_thread(function, *args):
+    """Start function in a thread that closes its database connection
+    when done."""
+    def run():
+        try:
+            function(*args)
+        finally:
+            connection.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def run_in_threads(function, items, workers):
+    """Call function for every item in at most workers threads, that
+    close their database connection when done."""
+    items = list(items)
+    workers = min(workers, len(items))
+    items = iter(items)
+    lock = threading.Lock()
+
+    def run():
+        while True:
+            with lock:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            function(item)
+
+    threads = [run_in_thread(run) for i in range(workers)]
+    for thread in threads:
+        thread.join()
+
+
+def import_recent_data(rainapp_config, datetime_ref, pool=None,
+                       deadline=None, slots=None):
+    """Copy the rainvalues most recent to datetime_ref into local db.
+
+    If a (thread) pool is given, the locations are fetched using the
+    pool. If a semaphore is given as slots as well, the parameters are
+    imported in parallel, each holding a slot while it is fetched and
+    stored, so all configs sharing the semaphore together import at most
+    as many parameters at a time as it allows. If the probe or the import
+    of a parameter isn't finished before deadline (a time.time() value),
+    the remaining parameters are skipped.
+
+    Returns an ImportSummary.
+    """
+    summary = ImportSummary(rainapp_config)
     js = rainapp_config.jdbcsource
     fid = rainapp_config.filter_id
 
@@ -38,6 +140,7 @@ def import_recent_data(rainapp_config, datetime_ref):
                 (rainapp_config.name, js.slug, fid))
 
     logger.info('Getting parameters from fews and locations from django.')
+    started = time.time()
     parameters = js.get_named_parameters(filter_id=fid)
     pids = [p['parameterid'] for p in parameters]
     lids = [g.municipality_id for g in
@@ -46,7 +149,9 @@ def import_recent_data(rainapp_config, datetime_ref):
     if not lids:
         logger.critical("No geo objects for config %s! Shapefile not loaded?" %
                         (rainapp_config.name,))
-        return
+        summary.fail('error')
+        summary.finished = time.time()
+        return summary
 
     logger.info('Probing location %s for latest values.' % lids[0])
 
@@ -62,6 +167,15 @@ def import_recent_data(rainapp_config, datetime_ref):
     # Separate loop for probing so that any error occurs right at the start
     pids_without_data = []
     for pid in pids:
+        if deadline is not None and time.time() > deadline:
+            skipped = ', '.join(pids[pids.index(pid):])
+            logger.error("Time budget of config %s exceeded while probing, "
+                         "skipped parameters %s." % (rainapp_config.name,
+                                                     skipped))
+            summary.add('probe', time.time() - started)
+            summary.fail('timeout')
+            summary.finished = time.time()
+            return summary
         ts_kwargs.update({
             'parameter_id': pid,
             'start_date': datetime_ref - LOOK_BACK_PERIOD[pid],
@@ -81,77 +195,169 @@ def import_recent_data(rainapp_config, datetime_ref):
 
     for pid in pids_without_data:
         pids.remove(pid)
-
-    for pid in pids:
-        print 'pid=' + pid
-
-        unit = js.get_unit(pid)
-        ts_kwargs.update({
-            'parameter_id': pid,
-            'start_date': last_value_date[pid],
-            'end_date': last_value_date[pid],
-        })
-
-        completerainvalue = {
-            'parameterkey': pid,
-            'datetime': last_value_date[pid],
-            'config': rainapp_config,
-        }
-
-        logger.info('Syncing data for parameter %s.' % pid)
-        for i, lid in enumerate(lids):
-            ts_kwargs.update({
-                    'location_id': lid,
-                    })
-
-            try:
-                data = js.get_timeseries(**ts_kwargs)
-            except:
-                error_type = sys.exc_info()[0]
-                info_str = ('Error getting timeseries for %s. The error ' +
-                            'was %s; putting -2.') % (lid, error_type)
-                logger.info(info_str)
-                data = [{'time': last_value_date[pid], 'value': -2}]
-
-            if not data:
-                logger.info('no data for %s, putting -1.' % lid)
-                data = [{'time': last_value_date[pid], 'value': -1}]
-
-            if len(data) > 1:
-                info_str = ('Ambiguous data for parameter %s at ' +
-                            'location %s. Putting -3.') % (pid, lid)
-                logger.info(info_str)
-                data = [{'time': last_value_date[pid], 'value': -3}]
-
-            rainvalue = {
-                'geo_object': GeoObject.objects.get(municipality_id=lid),
-                'parameterkey': pid,
-                'unit': unit,
-                'datetime': data[0]['time'].replace(tzinfo=None),
-                'value': data[0]['value'],
-                'config': rainapp_config,
-                }
-
-            # Check whether this value already exists - except for the value,
-            # of course.
-            existing_value = rainvalue.copy()
-            del existing_value['value']
-
-            try:
-                rain = RainValue.objects.get(**existing_value)
-            except RainValue.DoesNotExist:
-                rain = RainValue(**existing_value)
-            rain.value = rainvalue['value']
-            rain.save()
-
-            if (i + 1) / REPORT_GROUP_SIZE == int((i + 1) /
-                                                  REPORT_GROUP_SIZE):
-                logger.info('synced %s values.' % (i + 1))
-
-            # After all data is received, a completerainvalueobject is
-            # stored, to indicate to other code that the rainvalues
-            # for this datetime can be used.
-            CompleteRainValue(**completerainvalue).save()
+    summary.add('probe', time.time() - started)
+
+    def import_parameter(pid):
+        if slots is not None:
+            with slots:
+                return _import_parameter(pid)
+        return _import_parameter(pid)
+
+    def _import_parameter(pid):
+        try:
+            unit = js.get_unit(pid)
+            parameter_kwargs = dict(ts_kwargs,
+                                    parameter_id=pid,
+                                    start_date=last_value_date[pid],
+                                    end_date=last_value_date[pid])
+
+            logger.info('Syncing data for parameter %s.' % pid)
+            started = time.time()
+            values = fetch_values(js, parameter_kwargs, lids,
+                                  last_value_date[pid], pool=pool,
+                                  deadline=deadline)
+            summary.add('fetch', time.time() - started,
+                        rows_fetched=len(values))
+
+            started = time.time()
+            written = store_values(rainapp_config, pid, unit, values,
+                                   last_value_date[pid])
+            summary.add('store', time.time() - started,
+                        rows_written=written)
+        except TimeBudgetExceeded:
+            logger.error("Time budget of config %s exceeded, skipped "
+                         "parameter %s." % (rainapp_config.name, pid))
+            summary.fail('timeout')
+        except:
+            logger.exception("Import of parameter %s of config %s failed." %
+                             (pid, rainapp_config.name))
+            summary.fail('error')
+
+    if pool is None or slots is None:
+        for pid in pids:
+            import_parameter(pid)
+    else:
+        run_in_threads(import_parameter, pids, len(pids))
+
+    summary.finished = time.time()
+    return summary
+
+
+def fetch_value(js, ts_kwargs, lid, last_value_date):
+    """Return (location id, datetime, value) of a single location.
+
+    Problems are stored as special values: -1 for no data, -2 for an
+    error and -3 for ambiguous data.
+    """
+    ts_kwargs = dict(ts_kwargs, location_id=lid)
+
+    try:
+        data = js.get_timeseries(**ts_kwargs)
+    except:
+        error_type = sys.exc_info()[0]
+        info_str = ('Error getting timeseries for %s. The error ' +
+                    'was %s; putting -2.') % (lid, error_type)
+        logger.info(info_str)
+        data = [{'time': last_value_date, 'value': -2}]
+
+    if not data:
+        logger.info('no data for %s, putting -1.' % lid)
+        data = [{'time': last_value_date, 'value': -1}]
+
+    if len(data) > 1:
+        info_str = ('Ambiguous data for parameter %s at ' +
+                    'location %s. Putting -3.') % (
+            ts_kwargs['parameter_id'], lid)
+        logger.info(info_str)
+        data = [{'time': last_value_date, 'value': -3}]
+
+    return lid, data[0]['time'].replace(tzinfo=None), data[0]['value']
+
+
+def fetch_values(js, ts_kwargs, lids, last_value_date, pool=None,
+                 deadline=None):
+    """Return list of (location id, datetime, value) for every location.
+
+    Raises TimeBudgetExceeded when deadline passes before all locations
+    are fetched.
+    """
+    def fetch(lid):
+        if deadline is not None and time.time() > deadline:
+            raise TimeBudgetExceeded()
+        return fetch_value(js, ts_kwargs, lid, last_value_date)
+
+    if pool is not None:
+        result = pool.map_async(fetch, lids)
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            raise TimeBudgetExceeded()
+
+    values = []
+    for i, lid in enumerate(lids):
+        values.append(fetch(lid))
+        if (i + 1) % REPORT_GROUP_SIZE == 0:
+            logger.info('fetched %s values.' % (i + 1))
+    return values
+
+
+def store_values(rainapp_config, pid, unit, values, last_value_date):
+    """Store the (location id, datetime, value) tuples as RainValues.
+
+    Existing RainValues are looked up in one query, new ones are created
+    with a single bulk insert. Everything happens in one transaction that
+    ends with storing a CompleteRainValue, to indicate to other code that
+    the rainvalues for this datetime can be used.
+
+    Returns the number of RainValues written.
+    """
+    geo_object_ids = dict(
+        GeoObject.objects.filter(config=rainapp_config).values_list(
+            'municipality_id', 'id'))
+    datetimes = set(dt for (lid, dt, value) in values)
+
+    with transaction.commit_on_success():
+        existing = dict(
+            ((rain.geo_object_id, rain.datetime), rain) for rain in
+            RainValue.objects.filter(
+                config=rainapp_config, parameterkey=pid, unit=unit,
+                datetime__in=datetimes))
+
+        new_values = []
+        written = 0
+        for lid, dt, value in values:
+            geo_object_id = geo_object_ids.get(lid)
+            if geo_object_id is None:
+                logger.warning('No geo object for location %s.' % lid)
+                continue
+            rain = existing.get((geo_object_id, dt))
+            if rain is None:
+                rain = RainValue(
+                    geo_object_id=geo_object_id, parameterkey=pid,
+                    unit=unit, datetime=dt, value=value,
+                    config=rainapp_config)
+                new_values.append(rain)
+                # Locations could be listed twice.
+                existing[(geo_object_id, dt)] = rain
+            elif rain.value != value:
+                rain.value = value
+                if rain.pk is not None:
+                    RainValue.objects.filter(pk=rain.pk).update(value=value)
+            else:
+                continue
+            written += 1
+        RainValue.objects.bulk_create(new_values)
+        logger.info('synced %s values, %s of which new.' % (
+                written, len(new_values)))
+
+        CompleteRainValue(
+            parameterkey=pid,
+            datetime=last_value_date,
+            config=rainapp_config).save()
+    return written
 
 
 def delete_older_data(datetime_threshold):
@@ -165,7 +371,24 @@ def delete_older_data(datetime_threshold):
 
 class Command(BaseCommand):
     args = ""
-    help = "TODO"
+    help = "Import the most recent rain values of all rainapp configs."
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+                    type='int',
+                    default=1,
+                    help=('Number of parallel requests to the jdbc '
+                          'sources. With more than one, configs and their '
+                          'parameters are imported in parallel.')),
+        make_option('--time-budget',
+                    type='float',
+                    default=None,
+                    help=('Seconds each config may take, parameters that '
+                          'are not finished in time are skipped.')),
+        make_option('--summary',
+                    action='store_true',
+                    default=False,
+                    help='Print a json summary per config when done.'),
+        )
 
     def handle(self, *args, **options):
 
@@ -174,5 +397,38 @@ class Command(BaseCommand):
         datetime_threshold = now - datetime.timedelta(days=3)
         delete_older_data(datetime_threshold=datetime_threshold)
 
-        for rainapp_config in RainappConfig.objects.all():
-            import_recent_data(rainapp_config, datetime_ref=now)
+        workers = options['workers']
+        time_budget = options['time_budget']
+        pool = None
+        slots = None
+        if workers > 1:
+            pool = ThreadPool(workers)
+            # Shared by all configs, so that no more than workers
+            # parameters are fetched and stored at the same time.
+            slots = threading.BoundedSemaphore(workers)
+
+        summaries = []
+
+        def import_config(rainapp_config):
+            deadline = None
+            if time_budget is not None:
+                deadline = time.time() + time_budget
+            summary = import_recent_data(rainapp_config, datetime_ref=now,
+                                         pool=pool, deadline=deadline,
+                                         slots=slots)
+            logger.info("Import summary: %s" % json.dumps(summary.as_dict()))
+            summaries.append(summary)
+
+        rainapp_configs = list(RainappConfig.objects.all())
+        if pool is None:
+            for rainapp_config in rainapp_configs:
+                import_config(rainapp_config)
+        else:
+            run_in_threads(import_config, rainapp_configs, workers)
+            pool.close()
+            pool.join()
+
+        if options['summary']:
+            self.stdout.write(json.dumps(
+                    [summary.as_dict() for summary in summaries], indent=2))
+            self.stdout.write('\n')
@@ -1,4 +1,10 @@
+import datetime
 import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import mock
 from django.test import TestCase
 from pkg_resources import resource_filename
 
@@ -9,8 +15,15 @@ import_geoobject_shapefile  # Pyflakes
 from import_geoobject_shapefile import load_shapefile
 from import_geoobject_shapefile import load_shapefiles
 from import_geoobject_shapefile import clear_old_data
+from rainapp_import_recent_data import TimeBudgetExceeded
+from rainapp_import_recent_data import fetch_values
+from rainapp_import_recent_data import import_recent_data
+from rainapp_import_recent_data import run_in_threads
+from rainapp_import_recent_data import store_values
 
+from lizard_rainapp.models import CompleteRainValue
 from lizard_rainapp.models import GeoObject
+from lizard_rainapp.models import RainValue
 from lizard_rainapp.models import RainappConfig
 
 
@@ -84,3 +97,108 @@ class TestImportShapefiles(TestCase):
         count = load_shapefile('section', options)
         self.assertEqual(GeoObject.objects.count(), count)
         self.assertEqual(452, count)
+
+
+class TestStoreValues(TestCase):
+    def setUp(self):
+        self.config = RainappConfig(name="test", jdbcsource_id=0,
+                                    filter_id="test", slug="test")
+        self.config.save()
+        for lid in ('1', '2'):
+            GeoObject(municipality_id=lid, name="test", x=0, y=0, area=0,
+                      geometry=GEOSGeometry(SOME_GEOOBJECT),
+                      config=self.config).save()
+        self.dt = datetime.datetime(2013, 1, 1)
+
+    def test_store_values(self):
+        values = [('1', self.dt, 0.5), ('2', self.dt, -1)]
+        written = store_values(self.config, 'P.radar.1h', 'mm', values,
+                               self.dt)
+        self.assertEqual(written, 2)
+        self.assertEqual(RainValue.objects.count(), 2)
+        self.assertEqual(CompleteRainValue.objects.count(), 1)
+
+    def test_store_values_updates(self):
+        store_values(self.config, 'P.radar.1h', 'mm',
+                     [('1', self.dt, 0.5), ('2', self.dt, -1)], self.dt)
+        written = store_values(self.config, 'P.radar.1h', 'mm',
+                               [('1', self.dt, 0.5), ('2', self.dt, 3)],
+                               self.dt)
+        self.assertEqual(written, 1)
+        self.assertEqual(RainValue.objects.count(), 2)
+        self.assertEqual(
+            RainValue.objects.get(geo_object__municipality_id='2').value, 3)
+
+
+class TestFetchValues(TestCase):
+    def setUp(self):
+        self.dt = datetime.datetime(2013, 1, 1)
+        self.js = mock.Mock()
+        self.ts_kwargs = {'parameter_id': 'P.radar.1h'}
+
+    def test_special_values(self):
+        def get_timeseries(location_id, **kwargs):
+            if location_id == 'error':
+                raise IOError
+            if location_id == 'ambiguous':
+                return [{'time': self.dt, 'value': 1}] * 2
+            return []
+        self.js.get_timeseries.side_effect = get_timeseries
+        values = fetch_values(self.js, self.ts_kwargs,
+                              ['error', 'ambiguous', 'empty'], self.dt)
+        self.assertEqual([value for (lid, dt, value) in values],
+                         [-2, -3, -1])
+
+    def test_pool(self):
+        self.js.get_timeseries.return_value = [{'time': self.dt, 'value': 1}]
+        pool = ThreadPool(4)
+        values = fetch_values(self.js, self.ts_kwargs,
+                              [str(i) for i in range(10)], self.dt,
+                              pool=pool)
+        pool.close()
+        self.assertEqual([lid for (lid, dt, value) in values],
+                         [str(i) for i in range(10)])
+
+    def test_deadline(self):
+        self.assertRaises(TimeBudgetExceeded, fetch_values, self.js,
+                          self.ts_kwargs, ['1'], self.dt,
+                          deadline=time.time() - 1)
+
+
+class TestRunInThreads(TestCase):
+    def test_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        most = [0]
+        done = []
+
+        def function(item):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+                done.append(item)
+
+        run_in_threads(function, range(10), 3)
+        self.assertEqual(sorted(done), range(10))
+        self.assertTrue(most[0] <= 3)
+
+
+class TestImportRecentData(TestCase):
+    def setUp(self):
+        self.config = mock.Mock()
+        self.config.slug = 'test'
+        self.config.jdbcsource.get_named_parameters.return_value = [
+            {'parameterid': 'P.radar.1h'}, {'parameterid': 'P.radar.3h'}]
+
+    @mock.patch('lizard_rainapp.management.commands.'
+                'rainapp_import_recent_data.GeoObject')
+    def test_probe_deadline(self, geo_object):
+        geo_object.objects.filter.return_value = [
+            mock.Mock(municipality_id='1')]
+        summary = import_recent_data(self.config, datetime.datetime.now(),
+                                     deadline=time.time() - 1)
+        self.assertEqual(summary.status, 'timeout')
+        self.assertFalse(self.config.jdbcsource.get_timeseries.called)
@@ -1,13 +1,16 @@
 from datetime import datetime
 from datetime import timedelta
 import logging
+import random
 
 from django.test import TestCase
 import pytz
 
 from lizard_rainapp.calculations import herhalingstijd
+from lizard_rainapp.calculations import max_moving_sums
 from lizard_rainapp.calculations import meter_square_to_km_square
 from lizard_rainapp.calculations import moving_sum
+from lizard_rainapp.calculations import rain_stats_windows
 
 logger = logging.getLogger(__name__)
 
@@ -105,3 +108,39 @@ class ComputeTestSuite(TestCase):
         ms = moving_sum(**moving_sum_kwargs)
         sums = [m['value'] for m in ms]
         self.assertEqual(max(sums), 2)
+
+    def test_max_moving_sums(self):
+        """Test max_moving_sums against moving_sum."""
+        random.seed(0)
+        start_date = UTC.localize(datetime(year=2011, month=9, day=6))
+        end_date = UTC.localize(datetime(year=2011, month=9, day=9,
+                                         hour=23, minute=59, second=59))
+        td_windows = [timedelta(days=2), timedelta(days=1),
+                      timedelta(hours=3), timedelta(hours=1)]
+
+        for td_step in (timedelta(minutes=5), timedelta(hours=1),
+                        timedelta(hours=24)):
+            for offset in (timedelta(0), timedelta(minutes=30)):
+                values = generate_values(
+                    datetime(year=2011, month=9, day=5) + offset,
+                    datetime(year=2011, month=9, day=11),
+                    td_step, 'AnyUnit', 0)
+                for value in values:
+                    # Quarters, so sums are exact in both implementations.
+                    value['value'] = random.randint(0, 8) / 4.0
+
+                max_values = max_moving_sums(values, td_windows, td_step,
+                                             start_date, end_date)
+                for td_window, max_value in zip(td_windows, max_values):
+                    expected = moving_sum(values, td_window, td_step,
+                                          start_date, end_date)
+                    if not expected:
+                        self.assertEqual(max_value, None)
+                        continue
+                    expected = max(expected, key=lambda i: i['value'])
+                    self.assertEqual(max_value, expected)
+
+    def test_rain_stats_windows_without_values(self):
+        stats = rain_stats_windows([], 1, [timedelta(hours=1)], None, None)
+        self.assertEqual(stats[0]['max'], None)
+        self.assertEqual(stats[0]['t'], '-')
@@ -0,0 +1,40 @@
+from datetime import datetime
+from datetime import timedelta
+
+from django.test import TestCase
+import pytz
+
+from lizard_rainapp.layers import columns_to_values
+from lizard_rainapp.layers import values_to_columns
+
+UTC = pytz.timezone('UTC')
+
+
+class ColumnsTestSuite(TestCase):
+
+    def test_round_trip(self):
+        """Values survive conversion to columns and back."""
+        start = UTC.localize(datetime(year=2013, month=1, day=1))
+        values = [{'datetime': start + timedelta(minutes=5 * i),
+                   'value': i / 2.0,
+                   'unit': 'mm/5min'} for i in range(10)]
+        self.assertEqual(columns_to_values(*values_to_columns(values)),
+                         values)
+
+    def test_missing_value(self):
+        """None values come back as None, not as nan."""
+        start = UTC.localize(datetime(year=2013, month=1, day=1))
+        values = [{'datetime': start, 'value': None, 'unit': 'mm/5min'},
+                  {'datetime': start + timedelta(minutes=5), 'value': 1.5,
+                   'unit': 'mm/5min'}]
+        self.assertEqual(columns_to_values(*values_to_columns(values)),
+                         values)
+
+    def test_microseconds(self):
+        start = UTC.localize(datetime(2013, 1, 1, 0, 0, 0, 500000))
+        values = [{'datetime': start, 'value': 1.0, 'unit': 'mm/5min'}]
+        self.assertEqual(columns_to_values(*values_to_columns(values)),
+                         values)
+
+    def test_empty(self):
+        self.assertEqual(columns_to_values(*values_to_columns([])), [])
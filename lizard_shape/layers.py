@@ -1,11 +1,6 @@
-from pyproj import Proj
-from pyproj import transform
-from shapely.geometry import Point
-from shapely.wkt import loads
 import datetime
 import logging
 import mapnik
-import osgeo.ogr
 import pkg_resources
 
 from django.core.urlresolvers import reverse
@@ -14,7 +9,6 @@ from django.utils import simplejson as json
 
 from lizard_map.adapter import Graph
 from lizard_map.coordinates import detect_prj
-from lizard_map.coordinates import google_projection
 from lizard_map.models import WorkspaceItemError
 from lizard_map.utility import float_to_string
 from lizard_map.workspace import WorkspaceItemAdapter
@@ -23,6 +17,7 @@ from lizard_shape.models import ShapeField
 from lizard_shape.models import ShapeLegend
 from lizard_shape.models import ShapeLegendClass
 from lizard_shape.models import ShapeLegendPoint
+from lizard_shape.shapefile_index import shapefile_index
 
 logger = logging.getLogger(__name__)
 
@@ -254,26 +249,11 @@ class AdapterShapefile(WorkspaceItemAdapter):
     def extent(self, identifiers=None):
         """Calculate extent using ogr GetExtent function
         """
-        layer = mapnik.Layer(self.layer_name, detect_prj(self.prj))
-
-        layer.datasource = mapnik.Shapefile(
-            file=self.layer_filename)
-
-        ds = osgeo.ogr.Open(self.layer_filename)
-        lyr = ds.GetLayer()
-        lyr.ResetReading()
-        w, e, s, n = lyr.GetExtent()
-
-        w, s = transform(
-            Proj(detect_prj(self.prj)), google_projection, w, s)
-        e, n = transform(
-            Proj(detect_prj(self.prj)), google_projection, e, n)
-
-        return {
-            'north': n,
-            'west': w,
-            'south': s,
-            'east': e}
+        index = shapefile_index(self.layer_filename, self.prj)
+        if index is None:
+            return super(AdapterShapefile, self).extent(
+                identifiers=identifiers)
+        return index.google_extent()
 
     def search(self, x, y, radius=None):
         """
@@ -306,117 +286,90 @@ class AdapterShapefile(WorkspaceItemAdapter):
             logger.debug("Adjusting radius...")
             radius = radius * 0.8
 
-        transformed_x, transformed_y = transform(
-            google_projection, Proj(detect_prj(self.prj)), x, y)
-        query_point = Point(transformed_x, transformed_y)
-
-        ds = osgeo.ogr.Open(self.layer_filename)
-        try:
-            lyr = ds.GetLayer()
-        except AttributeError:
+        index = shapefile_index(self.layer_filename, self.prj)
+        if index is None:
             # #3033
             # This one occurs when the file does not exist.
             logger.error("The search function crashed. Probably due "
                          "to a missing shapefile.")
             return []
 
+        transformed_x, transformed_y = index.to_shape_coords(x, y)
+
         if radius is not None:
 
             # The radius needs to be transformed as well, but how?
             # A transformed square will no longer be a square!
             # This needs further attention...
 
-            transformed_x_radius, transformed_y_radius = transform(
-                google_projection, Proj(detect_prj(self.prj)),
-                x + radius, y + radius)
+            transformed_x_radius, transformed_y_radius = (
+                index.to_shape_coords(x + radius, y + radius))
 
             radius = max(abs(transformed_x - transformed_x_radius),
                          abs(transformed_y - transformed_y_radius))
 
-            lyr.SetSpatialFilterRect(
-                transformed_x - radius,
-                transformed_y - radius,
-                transformed_x + radius,
-                transformed_y + radius)
-
-        lyr.ResetReading()
-        feat = lyr.GetNextFeature()
-
         results = []
 
-        while feat is not None:
-            geom = feat.GetGeometryRef()
-            if geom:
-                item = loads(geom.ExportToWkt())
-                distance = query_point.distance(item)
-                feat_items = feat.items()
-
-                if not radius or (radius is not None and distance < radius):
-                    # Add stripped keys, because column names can contain
-                    # spaces after the 'real' name.
-                    for key in feat_items.keys():
-                        feat_items[key.strip()] = feat_items[key]
-
-                    # Found an item.
-                    if self.search_property_name not in feat_items:
-                        # This means that the search_property_name is not a
-                        # valid field in the shapefile dbf.
-                        logger.error(
-                            ('Search: The field "%s" cannot be found in '
-                             'shapefile "%s". Available fields: %r'
-                             'Check your settings in '
-                             'lizard_shape.models.Shape.') %
-                            (self.search_property_name, self.layer_name,
-                             feat_items.keys()))
-                        break  # You don't have to search other rows.
-                    name = str(feat_items[self.search_property_name])
-
-                    if self.display_fields:
-                        if self.display_fields[0]['field'] not in feat_items:
-                            # This means that the value_field is not a
-                            # valid field in the shapefile dbf.
-                            logger.error(
-                                ('Search: The field "%s" cannot be found in '
-                                 'shapefile "%s". Check display_fields. '
-                                 'Options are: %s') %
-                                (self.display_fields[0]['field'],
-                                 self.layer_name,
-                                 feat_items.keys()))
-                            break  # You don't have to search other rows.
-                        name += ' - %s=%s' % (
-                            self.display_fields[0]['name'],
-                            str(float_to_string(feat_items[
-                                        self.display_fields[0]['field']])))
-
-                    result = {'distance': distance,
-                              'name': name,
-                              'workspace_item': self.workspace_item}
-                    try:
-                        result.update(
-                            {'google_coords':
-                                 transform(Proj(detect_prj(self.prj)),
-                                           google_projection,
-                                           *item.coords[0])})
-                    except NotImplementedError:
-                        logger.warning(
-                            "Got a NotImplementedError while transforming "
-                            "coordinates from %s to google with pyproj "
-                            "for shapefile %s. Not returning google "
-                            "coordinates.",
-                            self.prj, self.shape)
-
-                    if (self.search_property_id and
-                        self.search_property_id in feat_items):
-                        result.update(
-                            {'identifier':
-                                 {'id': feat_items[self.search_property_id]}})
-                    else:
-                        logger.error("Problem with search_property_id: %s. "
-                                     "List of available properties: %r" %
-                                     (self.search_property_id,
-                                      feat_items.keys()))
-                    results.append(result)
-            feat = lyr.GetNextFeature()
+        for distance, position in index.search(
+            transformed_x, transformed_y, radius):
+            feat_items = index.items[position]
+
+            # Found an item.
+            if self.search_property_name not in feat_items:
+                # This means that the search_property_name is not a
+                # valid field in the shapefile dbf.
+                logger.error(
+                    ('Search: The field "%s" cannot be found in '
+                     'shapefile "%s". Available fields: %r'
+                     'Check your settings in '
+                     'lizard_shape.models.Shape.') %
+                    (self.search_property_name, self.layer_name,
+                     feat_items.keys()))
+                break  # You don't have to search other rows.
+            name = str(feat_items[self.search_property_name])
+
+            if self.display_fields:
+                if self.display_fields[0]['field'] not in feat_items:
+                    # This means that the value_field is not a
+                    # valid field in the shapefile dbf.
+                    logger.error(
+                        ('Search: The field "%s" cannot be found in '
+                         'shapefile "%s". Check display_fields. '
+                         'Options are: %s') %
+                        (self.display_fields[0]['field'],
+                         self.layer_name,
+                         feat_items.keys()))
+                    break  # You don't have to search other rows.
+                name += ' - %s=%s' % (
+                    self.display_fields[0]['name'],
+                    str(float_to_string(feat_items[
+                                self.display_fields[0]['field']])))
+
+            result = {'distance': distance,
+                      'name': name,
+                      'workspace_item': self.workspace_item}
+            try:
+                result.update(
+                    {'google_coords': index.google_coords(position)})
+            except NotImplementedError:
+                logger.warning(
+                    "Got a NotImplementedError while transforming "
+                    "coordinates from %s to google with pyproj "
+                    "for shapefile %s. Not returning google "
+                    "coordinates.",
+                    self.prj, self.shape)
+
+            if (self.search_property_id and
+                self.search_property_id in feat_items):
+                result.update(
+                    {'identifier':
+                         {'id': feat_items[self.search_property_id]}})
+            else:
+                logger.error("Problem with search_property_id: %s. "
+                             "List of available properties: %r" %
+                             (self.search_property_id,
+                              feat_items.keys()))
+            results.append(result)
         results = sorted(results, key=lambda a: a['distance'])
         if len(results) > MAX_SEARCH_RESULTS:
             logger.info('A lot of results found (%d), just taking top %s.',
@@ -451,12 +404,6 @@ class AdapterShapefile(WorkspaceItemAdapter):
         Optional: force_list forces the output in list format
         """
 
-        ds = osgeo.ogr.Open(self.layer_filename)
-        lyr = ds.GetLayer()
-        lyr.ResetReading()
-        feat = lyr.GetNextFeature()
-
-        item, google_x, google_y, feat_items = None, None, None, None
         id_list = []
         if id is not None:
             id_list.append(id)
@@ -472,59 +419,52 @@ class AdapterShapefile(WorkspaceItemAdapter):
 
         result = []
 
-        # Find one features.
-        while feat is not None:
-            geom = feat.GetGeometryRef()
-            feat_items = feat.items()
-            # Add stripped keys. Sometimes columnnames contain spaces
-            # at the end.
-            for key in feat_items.keys():
-                feat_items[key.strip()] = feat_items[key]
-            if self.search_property_id not in feat_items:
-                logger.error("Search property id '%s' not available. "
-                             "Options are: %r" % (self.search_property_id,
-                                                  feat_items.keys()))
-            if (geom and
-                self.search_property_id in feat_items and
-                id_list.count(feat_items[self.search_property_id]) > 0):
-
-                # item = loads(geom.ExportToWkt())
-
-                # Polygons get an error when getting coords. Coords
-                # are not needed any more, so leave them out.
-
-                # google_x, google_y = coordinates.rd_to_google(
-                #     *item.coords[0])
-
-                # contains {'name': <name>, 'value': <value>,
-                # 'value_type: 1/2/3'}
-                values = []
-
-                for field in self.display_fields:
-                    if str(field['field']) not in feat_items:
-                        # Trying to show a field that's not in feat_items
-                        values.append({'name': field['name'],
-                                       'value': 'Not present in data',
-                                       'value_type': 1})
-                    else:
-                        values.append({'name': field['name'],
-                                       'value':
-                                           feat_items[str(field['field'])],
-                                       'value_type': field['field_type']})
-
-                name = feat_items[self.search_property_name]
-                result.append({
-                        'name': name,
-                        'shortname': name,
-                        'value_name': self.value_name,
-                        'value': feat_items[self.value_field],
-                        'values': values,
-                        'object': feat_items,
-                        'workspace_item': self.workspace_item,
-                        'identifier': {'id': feat_items[
-                                self.search_property_id]}})
-
-            feat = lyr.GetNextFeature()
+        index = shapefile_index(self.layer_filename, self.prj)
+        if index is None:
+            logger.error("Shapefile %s not available." % self.layer_filename)
+            positions = []
+        elif self.search_property_id not in index.field_names:
+            logger.error("Search property id '%s' not available. "
+                         "Options are: %r" % (self.search_property_id,
+                                              list(index.field_names)))
+            positions = []
+        else:
+            positions = index.positions(self.search_property_id, id_list)
+
+        # Find the features.
+        for position in positions:
+            feat_items = index.items[position]
+
+            # Polygons get an error when getting coords. Coords
+            # are not needed any more, so leave them out.
+
+            # contains {'name': <name>, 'value': <value>,
+            # 'value_type: 1/2/3'}
+            values = []
+
+            for field in self.display_fields:
+                if str(field['field']) not in feat_items:
+                    # Trying to show a field that's not in feat_items
+                    values.append({'name': field['name'],
+                                   'value': 'Not present in data',
+                                   'value_type': 1})
+                else:
+                    values.append({'name': field['name'],
+                                   'value':
+                                       feat_items[str(field['field'])],
+                                   'value_type': field['field_type']})
+
+            name = feat_items[self.search_property_name]
+            result.append({
+                    'name': name,
+                    'shortname': name,
+                    'value_name': self.value_name,
+                    'value': feat_items[self.value_field],
+                    'values': values,
+                    'object': feat_items,
+                    'workspace_item': self.workspace_item,
+                    'identifier': {'id': feat_items[
+                            self.search_property_id]}})
 
         logger.debug("%d result(s) found" % len(result))
 
@@ -0,0 +1,95 @@
+from __future__ import print_function
+
+import pkg_resources
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from pyproj import Proj
+from pyproj import transform
+from shapely.geometry import Point
+from shapely.wkt import loads
+import osgeo.ogr
+
+from lizard_map.coordinates import detect_prj
+from lizard_map.coordinates import google_projection
+from lizard_shape import shapefile_index
+from lizard_shape.layers import AdapterShapefile
+
+NUMBER = 100
+RADIUS = 2000.0
+
+
+def search_by_scan(filename, prj, x, y, radius):
+    """The old way: open the shapefile and convert every feature near the
+    click to shapely."""
+    transformed_x, transformed_y = transform(
+        google_projection, Proj(detect_prj(prj)), x, y)
+    query_point = Point(transformed_x, transformed_y)
+    lyr = osgeo.ogr.Open(filename).GetLayer()
+    transformed_x_radius, transformed_y_radius = transform(
+        google_projection, Proj(detect_prj(prj)), x + radius, y + radius)
+    radius = max(abs(transformed_x - transformed_x_radius),
+                 abs(transformed_y - transformed_y_radius))
+    lyr.SetSpatialFilterRect(
+        transformed_x - radius, transformed_y - radius,
+        transformed_x + radius, transformed_y + radius)
+    lyr.ResetReading()
+    results = []
+    feat = lyr.GetNextFeature()
+    while feat is not None:
+        geom = feat.GetGeometryRef()
+        if geom:
+            item = loads(geom.ExportToWkt())
+            distance = query_point.distance(item)
+            if distance < radius:
+                feat.items()
+                try:
+                    transform(Proj(detect_prj(prj)), google_projection,
+                              *item.coords[0])
+                except NotImplementedError:
+                    pass
+                results.append(distance)
+        feat = lyr.GetNextFeature()
+    return sorted(results)
+
+
+class Command(BaseCommand):
+    args = '[shapefile]'
+    help = """Compare the cost of a click on a shapefile layer, searching by
+scanning the shapefile (old) and with the shapefile index (new). Defaults
+to the KRWwaterlichamen shapefile of lizard_map."""
+
+    def handle(self, *args, **options):
+        if args:
+            filename = args[0]
+        else:
+            filename = pkg_resources.resource_filename(
+                'lizard_map', 'test_shapefiles/KRWwaterlichamen_vlakken.shp')
+        adapter = AdapterShapefile(
+            None, layer_arguments={
+                'layer_name': 'Benchmark',
+                'layer_filename': filename,
+                'search_property_name': 'OWANAAM',
+                'search_property_id': 'OWAIDENT'})
+
+        # Clicks within the extent of the shapefile.
+        extent = adapter.extent()
+        clicks = [(random.uniform(extent['west'], extent['east']),
+                   random.uniform(extent['south'], extent['north']))
+                  for i in range(NUMBER)]
+
+        scan = timeit.timeit(
+            lambda: [search_by_scan(filename, None, x, y, RADIUS * 0.8)
+                     for x, y in clicks], number=1)
+        build = timeit.timeit(
+            lambda: shapefile_index.ShapefileIndex(filename), number=1)
+        shapefile_index.shapefile_index(filename)
+        index = timeit.timeit(
+            lambda: [adapter.search(x, y, RADIUS) for x, y in clicks],
+            number=1)
+        print('%d clicks on %s:' % (NUMBER, filename))
+        print('  shapefile scan:  %8.2f ms per click' % (scan / NUMBER * 1e3))
+        print('  shapefile index: %8.2f ms per click '
+              '(building the index once: %.2f ms)' % (
+                index / NUMBER * 1e3, build * 1e3))
@@ -3,12 +3,16 @@ import logging
 
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 from django.utils import simplejson as json
 from django.utils.translation import ugettext as _
 from lizard_map.mapnik_helper import point_rule
 from lizard_map.fields import ColorField
+from lizard_map.mapnik_pool import bump_legend_version
 from lizard_map.models import Legend
 from lizard_map.models import LegendPoint
+from lizard_shape import shapefile_index
 #from nens.sobek import HISFile
 from treebeard.al_tree import AL_Node
 import mapnik
@@ -497,3 +501,14 @@ class His(models.Model):
     def hisfile(self):
         result = HISFile(self.filename.path)
         return result
+
+
+# Mapnik maps pooled by lizard_map contain the styles of these models.
+for legend_model in (ShapeLegend, ShapeLegendPoint, ShapeLegendClass,
+                     ShapeLegendSingleClass):
+    post_save.connect(bump_legend_version, sender=legend_model)
+    post_delete.connect(bump_legend_version, sender=legend_model)
+
+# A saved shape may have new files.
+post_save.connect(shapefile_index.clear, sender=Shape)
+post_delete.connect(shapefile_index.clear, sender=Shape)
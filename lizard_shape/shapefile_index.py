@@ -0,0 +1,197 @@
+"""In-memory index of shapefiles, for searching and looking up features.
+
+AdapterShapefile.search used to open the shapefile with OGR on every click,
+convert the geometry of every feature near the click to shapely via WKT and
+create the pyproj projection of the shapefile a couple of times per feature.
+Location (and so every popup) scanned all features to find a couple of ids
+and extent opened the file again.
+
+A ShapefileIndex reads a shapefile once: the shapely geometries, their
+bounding boxes in a numpy array, the attribute table (with stripped field
+names) and the extent. A search is then a vectorized bounding box query plus
+exact distances for the few candidates, looking up features by id is a dict
+lookup per id.
+
+Indexes are kept per process, keyed on filename and projection, and rebuilt
+when the modification time of the shapefile changes or a Shape is saved or
+deleted.
+"""
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+from pyproj import Proj
+from pyproj import transform
+from shapely.geometry import Point
+from shapely.wkt import loads
+import numpy
+import osgeo.ogr
+
+from lizard_map.coordinates import detect_prj
+from lizard_map.coordinates import google_projection
+
+logger = logging.getLogger(__name__)
+
+# Number of shapefiles kept indexed per process.
+SHAPEFILE_INDEX_SIZE = 20
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+class ShapefileIndex(object):
+    """Geometries and attributes of the features of a shapefile.
+
+    Features without geometry are left out, like the adapter always did.
+    """
+
+    def __init__(self, filename, prj=None):
+        self.filename = filename
+        self.proj = Proj(detect_prj(prj))
+        self.geometries = []
+        self.items = []
+
+        ds = osgeo.ogr.Open(filename)
+        if ds is None:
+            raise IOError("Can't open shapefile %s." % filename)
+        lyr = ds.GetLayer()
+        lyr.ResetReading()
+        # (west, east, south, north)
+        self.extent = lyr.GetExtent()
+        bounds = []
+        feat = lyr.GetNextFeature()
+        while feat is not None:
+            geom = feat.GetGeometryRef()
+            if geom:
+                feat_items = feat.items()
+                # Add stripped keys, because column names can contain
+                # spaces after the 'real' name.
+                for key in feat_items.keys():
+                    feat_items[key.strip()] = feat_items[key]
+                geometry = loads(geom.ExportToWkt())
+                self.geometries.append(geometry)
+                self.items.append(feat_items)
+                # Empty geometries have no bounds and are never found.
+                bounds.append(geometry.bounds or (numpy.nan,) * 4)
+            feat = lyr.GetNextFeature()
+        self.bounds = numpy.array(bounds, dtype=numpy.float64).reshape(-1, 4)
+        # All features have the same fields.
+        self.field_names = set(self.items[0].keys()) if self.items else set()
+        # field -> {value: [position, ...]}, filled on demand.
+        self._by_field = {}
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def google_extent(self):
+        """Return extent dict (north, west, south, east) in google
+        coordinates."""
+        w, e, s, n = self.extent
+        w, s = transform(self.proj, google_projection, w, s)
+        e, n = transform(self.proj, google_projection, e, n)
+        return {
+            'north': n,
+            'west': w,
+            'south': s,
+            'east': e}
+
+    def positions(self, field, values):
+        """Return positions of the features with one of values in field,
+        in the order of the shapefile."""
+        by_value = self._by_field.get(field)
+        if by_value is None:
+            by_value = {}
+            for position, feat_items in enumerate(self.items):
+                if field in feat_items:
+                    by_value.setdefault(
+                        feat_items[field], []).append(position)
+            self._by_field[field] = by_value
+
+        positions = set()
+        for value in values:
+            positions.update(by_value.get(value, ()))
+        return sorted(positions)
+
+    def to_shape_coords(self, google_x, google_y):
+        """Return google coordinates transformed to the projection of the
+        shapefile."""
+        return transform(google_projection, self.proj, google_x, google_y)
+
+    def google_coords(self, position):
+        """Return google coordinates of the first point of a feature.
+
+        Raises NotImplementedError for polygons, like shapely does.
+        """
+        return transform(self.proj, google_projection,
+                         *self.geometries[position].coords[0])
+
+    def search(self, x, y, radius=None):
+        """Return list of (distance, position) of the features within
+        radius of (x, y), closest first. Coordinates and radius are in
+        the projection of the shapefile.
+
+        Without radius, all features are returned.
+        """
+        if radius is None:
+            candidates = range(len(self.geometries))
+        else:
+            bounds = self.bounds
+            candidates = numpy.flatnonzero(
+                (bounds[:, 0] <= x + radius) & (bounds[:, 2] >= x - radius) &
+                (bounds[:, 1] <= y + radius) & (bounds[:, 3] >= y - radius))
+
+        point = Point(x, y)
+        found = []
+        for position in candidates:
+            distance = point.distance(self.geometries[position])
+            if not radius or distance < radius:
+                found.append((distance, int(position)))
+        found.sort()
+        return found
+
+
+def _mtime(filename):
+    """Return latest modification time of the .shp and .dbf file."""
+    mtime = os.path.getmtime(filename)
+    dbf_filename = os.path.splitext(filename)[0] + '.dbf'
+    if os.path.exists(dbf_filename):
+        mtime = max(mtime, os.path.getmtime(dbf_filename))
+    return mtime
+
+
+def shapefile_index(filename, prj=None):
+    """Return ShapefileIndex of filename, or None if it can't be read."""
+    try:
+        mtime = _mtime(filename)
+    except OSError:
+        return None
+
+    key = (filename, prj)
+    with _indexes_lock:
+        found = _indexes.pop(key, None)
+        if found is not None and found[0] == mtime:
+            # Mark as recently used.
+            _indexes[key] = found
+            return found[1]
+
+    logger.debug("Indexing shapefile %s...", filename)
+    try:
+        index = ShapefileIndex(filename, prj)
+    except IOError, e:
+        logger.error(e)
+        return None
+    with _indexes_lock:
+        _indexes[key] = (mtime, index)
+        while len(_indexes) > SHAPEFILE_INDEX_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear(sender=None, **kwargs):
+    """Drop all shapefile indexes of this process.
+
+    Connected to the post_save and post_delete signals of Shape.
+    """
+    with _indexes_lock:
+        _indexes.clear()
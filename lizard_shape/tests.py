@@ -7,6 +7,7 @@ from django.db import IntegrityError
 from django.forms import ValidationError
 from django.test import TestCase
 from django.test.client import Client
+import mock
 import pkg_resources
 
 import lizard_shape.layers
@@ -20,6 +21,7 @@ from lizard_shape.models import ShapeLegendClass
 from lizard_shape.models import ShapeLegendPoint
 from lizard_shape.models import ShapeTemplate
 from lizard_shape.models import ShapeNameError
+from lizard_shape import shapefile_index
 
 
 class IntegrationTest(TestCase):
@@ -382,3 +384,55 @@ class AdapterShapefileTestSuite(TestCase):
         self.assertTrue('south' in result)
         self.assertTrue('east' in result)
         self.assertTrue('west' in result)
+
+
+class ShapefileIndexTest(TestCase):
+    def setUp(self):
+        shapefile_index.clear()
+        self.filename = pkg_resources.resource_filename(
+            'lizard_map', 'test_shapefiles/KRWwaterlichamen_vlakken.shp')
+
+    def test_index_is_cached(self):
+        index1 = shapefile_index.shapefile_index(self.filename)
+        index2 = shapefile_index.shapefile_index(self.filename)
+        self.assertTrue(index1 is index2)
+        self.assertTrue(len(index1) > 0)
+
+    def test_changed_file_is_indexed_again(self):
+        index1 = shapefile_index.shapefile_index(self.filename)
+        with mock.patch('lizard_shape.shapefile_index._mtime',
+                        return_value=0):
+            index2 = shapefile_index.shapefile_index(self.filename)
+        self.assertFalse(index1 is index2)
+
+    def test_clear(self):
+        index1 = shapefile_index.shapefile_index(self.filename)
+        shapefile_index.clear()
+        index2 = shapefile_index.shapefile_index(self.filename)
+        self.assertFalse(index1 is index2)
+
+    def test_missing_file(self):
+        self.assertEquals(
+            shapefile_index.shapefile_index('/does/not/exist.shp'), None)
+
+    def test_search(self):
+        index = shapefile_index.shapefile_index(self.filename)
+        self.assertEquals(len(index.search(0, 0)), len(index))
+        distance, position = index.search(0, 0)[0]
+        x, y = index.geometries[position].representative_point().coords[0]
+        found = index.search(x, y, 1.0)
+        self.assertTrue(found)
+        self.assertTrue(all(distance < 1.0 for distance, _ in found))
+
+    def test_positions(self):
+        index = shapefile_index.shapefile_index(self.filename)
+        ident = index.items[1]['OWAIDENT']
+        self.assertTrue(1 in index.positions('OWAIDENT', [ident]))
+        self.assertEquals(index.positions('OWAIDENT', ['unknown']), [])
+        self.assertEquals(index.positions('unknown field', [ident]), [])
+
+    def test_google_extent(self):
+        index = shapefile_index.shapefile_index(self.filename)
+        extent = index.google_extent()
+        self.assertTrue(extent['west'] < extent['east'])
+        self.assertTrue(extent['south'] < extent['north'])
@@ -27,6 +27,8 @@ ICON_STYLE = {'icon': 'twitter.png',
 
 
 class AdapterStickyTwitterized(workspace.WorkspaceItemAdapter):
+    # The layer query depends on the date range of the request.
+    reuse_mapnik_map = False
 
     def __init__(self, *args, **kwargs):
         """
@@ -1,14 +1,31 @@
 """Dummy implementation of lizard5_site multitenancy.
 
 This way the lizard5 multitenancy implementation can stay the same.
+
+set_host() also remembers the host per thread, so that get_host() can
+tell caches which site's database is used in threads without a request
+(celery tasks and their worker threads).
 """
+import threading
+
+_local = threading.local()
 
 
-def set_host(*args, **kwargs):
+def _router_set_host(*args, **kwargs):
     pass
 
 
 try:
-    from lizard5_site.router import set_host
+    from lizard5_site.router import set_host as _router_set_host
 except ImportError:
     pass
+
+
+def set_host(host=None, *args, **kwargs):
+    _local.host = host
+    _router_set_host(host, *args, **kwargs)
+
+
+def get_host():
+    """Return the host set for this thread with set_host, or None."""
+    return getattr(_local, 'host', None)
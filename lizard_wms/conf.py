@@ -8,6 +8,10 @@ class LizardWmsConf(AppConf):
     PROXIED_WMS_SERVERS = {
 #        'http://geoserver6.lizard.net/geoserver': '/geoserver6/',
         }
+    # Seconds a GetFeatureInfo response is cached, 0 disables caching.
+    FEATURE_INFO_CACHE_TIMEOUT = 60
+    # Number of connections kept open per WMS host.
+    POOL_MAXSIZE = 10
 
     class Meta:
         prefix = 'wms'
@@ -0,0 +1,90 @@
+"""Pooled and cached GetFeatureInfo requests.
+
+A single click on the map easily results in the same GetFeatureInfo request
+twice (``AdapterWMS.search`` and ``AdapterWMS.html``) for every layer and the
+filter page asks for the same hundred features several times per render.
+
+- Every WMS host gets one shared ``requests.Session``, so connections are
+  kept alive and reused instead of being set up for every request.
+
+- Parsed responses are cached for a short while, keyed on the url and the
+  normalized request payload.
+
+Settings (see ``lizard_wms.conf``):
+
+- WMS_FEATURE_INFO_CACHE_TIMEOUT: seconds a response is cached, 0 disables
+  the cache (default 60).
+- WMS_POOL_MAXSIZE: connections kept open per WMS host (default 10).
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import threading
+import urlparse
+
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+import requests
+
+from lizard_wms.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WMS_TIMEOUT = 10
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session(url):
+    """Return the shared requests session for the host of url."""
+    parsed = urlparse.urlsplit(url)
+    host = (parsed.scheme, parsed.netloc)
+    with _sessions_lock:
+        if host not in _sessions:
+            new_session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.WMS_POOL_MAXSIZE)
+            new_session.mount('%s://%s' % host, adapter)
+            _sessions[host] = new_session
+        return _sessions[host]
+
+
+def cache_key(url, payload):
+    """Return cache key for a GetFeatureInfo request.
+
+    Parameter names are case insensitive in WMS and the order doesn't
+    matter, so normalize them before hashing.
+    """
+    normalized = sorted((unicode(key).upper(), unicode(value))
+                        for key, value in payload.items()
+                        if value is not None)
+    key_hash = hashlib.md5(url.encode('utf-8'))
+    for key, value in normalized:
+        key_hash.update(('&%s=%s' % (key, value)).encode('utf-8'))
+    return 'lizard_wms.feature_info::%s' % key_hash.hexdigest()
+
+
+def get_feature_info(url, payload, parse_response):
+    """Return parse_response(response) for a GetFeatureInfo request,
+    from the cache if possible.
+
+    Only responses with status 200 are cached, so a hiccup of the WMS
+    server doesn't stick.
+    """
+    timeout = settings.WMS_FEATURE_INFO_CACHE_TIMEOUT
+    key = cache_key(url, payload)
+    if timeout:
+        result = cache.get(key)
+        if result is not None:
+            logger.debug("GetFeatureInfo for %s found in cache.", url)
+            return result
+
+    response = session(url).get(url, params=payload, timeout=WMS_TIMEOUT)
+    result = parse_response(response)
+    if timeout and response.status_code == 200:
+        cache.set(key, result, timeout)
+    return result
@@ -28,12 +28,12 @@ from lizard_map.views import get_view_state
 from lizard_maptree.models import Category
 
 import owslib.wms
-import requests
 
 from lizard_security.manager import FilteredManager
 from lizard_security.models import DataSet
 
 from lizard_wms.widgets import WmsWorkspaceAcceptable
+from lizard_wms import feature_info
 from lizard_wms import popup_renderers
 
 FIXED_WMS_API_VERSION = '1.1.1'
@@ -554,8 +554,8 @@ like {"key": "value", "key2": "value2"}.
                                           version, bbox, width, height, x, y,
                                           cql_filters, cql_filter_string,
                                           _buffer)
-            response = requests.get(self.url, params=payload, timeout=10)
-            layer_result = self._parse_response(response)
+            layer_result = feature_info.get_feature_info(
+                self.url, payload, self._parse_response)
 
             # Store the last result, too, if applicable.
             if layer_result:
@@ -0,0 +1,59 @@
+from __future__ import print_function, unicode_literals
+from __future__ import absolute_import, division
+
+import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from lizard_wms import feature_info
+
+
+class FeatureInfoTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_session_per_host(self):
+        session1 = feature_info.session('http://test.com/wms?a=b')
+        session2 = feature_info.session('http://test.com/other')
+        session3 = feature_info.session('http://example.com/wms')
+        self.assertTrue(session1 is session2)
+        self.assertFalse(session1 is session3)
+
+    def test_cache_key_is_normalized(self):
+        key1 = feature_info.cache_key('http://test.com',
+                                      {'LAYERS': 'a', 'X': 1, 'Y': 2})
+        key2 = feature_info.cache_key('http://test.com',
+                                      {'y': '2', 'layers': 'a', 'x': '1'})
+        key3 = feature_info.cache_key('http://test.com',
+                                      {'LAYERS': 'a', 'X': 1, 'Y': 3})
+        self.assertEquals(key1, key2)
+        self.assertNotEquals(key1, key3)
+
+    def test_second_request_is_cached(self):
+        response = mock.Mock()
+        response.status_code = 200
+        session = mock.Mock()
+        session.get.return_value = response
+        parse = mock.Mock(return_value=[{'name': 'a'}])
+        with mock.patch('lizard_wms.feature_info.session',
+                        return_value=session):
+            result1 = feature_info.get_feature_info(
+                'http://test.com', {'X': 1}, parse)
+            result2 = feature_info.get_feature_info(
+                'http://test.com', {'X': 1}, parse)
+        self.assertEquals(result1, result2)
+        self.assertEquals(session.get.call_count, 1)
+
+    def test_errors_are_not_cached(self):
+        response = mock.Mock()
+        response.status_code = 500
+        session = mock.Mock()
+        session.get.return_value = response
+        parse = mock.Mock(return_value=[])
+        with mock.patch('lizard_wms.feature_info.session',
+                        return_value=session):
+            feature_info.get_feature_info('http://test.com', {'X': 1}, parse)
+            feature_info.get_feature_info('http://test.com', {'X': 1}, parse)
+        self.assertEquals(session.get.call_count, 2)
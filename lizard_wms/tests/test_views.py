@@ -12,6 +12,7 @@ from django.test.client import Client
 import lizard_ui
 # from lizard_wms.models import FilterPage
 from lizard_wms.tests import factories
+from lizard_wms.views import FilterPageDownload
 from lizard_wms.views import FilterPageView
 
 
@@ -88,6 +89,22 @@ class FilterPageViewTest(TestCase):
                 {'city': ['Arnhem', 'Nieuwegein'],
                  'inhabitant': ['Arjan', 'Reinout', 'Remco']})
 
+    def test_features_fetched_once(self):
+        with mock.patch('lizard_wms.views.FilterPageView.bbox', '0,0,1,1'):
+            with mock.patch('lizard_wms.models.WMSSource.get_feature_info',
+                            return_value=[{'city': 'Delft'}]) as fetch:
+                self.view.values_per_dropdown
+                self.view.features()
+        self.assertEquals(fetch.call_count, 1)
+
+    def test_csv_rows(self):
+        download = FilterPageDownload()
+        rows = list(download.csv_rows(
+                [('city', 'City'), ('inhabitant', 'Inhabitant')],
+                [{'city': 'Nieuwegein', 'inhabitant': 'Reinout'}]))
+        self.assertEquals(rows, [b'City,Inhabitant\r\n',
+                                 b'Nieuwegein,Reinout\r\n'])
+
 
 class FilterPageViewFunctionalTest(TestCase):
 
@@ -111,3 +128,17 @@ class FilterPageViewFunctionalTest(TestCase):
                         lambda x: features):
             response = self.client.get(self.url)
         self.assertEquals(response.status_code, 200)
+
+    def test_export(self):
+        url = reverse('lizard_wms.filter_page_export',
+                      kwargs={'slug': self.filter_page.slug})
+        with mock.patch('lizard_wms.views.FilterPageView.features',
+                        lambda x, cql_filter_string=None: [{}, {}]):
+            response = self.client.get(url)
+            rows = list(response)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Disposition'],
+                          'attachment; filename="%s.csv"' %
+                          self.filter_page.slug)
+        # The header and the two features.
+        self.assertEquals(len(b''.join(rows).splitlines()), 3)
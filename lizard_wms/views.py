@@ -5,6 +5,7 @@ from __future__ import print_function
 import json
 import logging
 from collections import defaultdict
+from io import BytesIO
 
 # from django.utils.translation import ugettext as _
 from lizard_wms.conf import settings
@@ -15,6 +16,7 @@ from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.utils.html import escapejs
 from lizard_map.views import MapView
+from lizard_map.views import StreamingHttpResponse
 from lizard_ui.layout import Action
 import unicodecsv
 
@@ -30,29 +32,40 @@ class FilterPageView(MapView):
     """Simple view with a map."""
     template_name = 'lizard_wms/filter_page.html'
 
+    # The template accesses most of the properties below several times per
+    # render, so everything that hits the database or the WMS server is
+    # memoized on the view instance (which lives for one request).
+
     @property
     def workspace(self):
         """Return workspace, but ensure our wms source is included."""
-        ws = super(FilterPageView, self).workspace
-        ws_acceptable = self.wms_source.workspace_acceptable()
-        ws.add_workspace_item(ws_acceptable.name,
-                              ws_acceptable.adapter_name,
-                              ws_acceptable.adapter_layer_json)
-        # ^^^ Note: add_workspace_item() first looks whether the item is
-        # already available before adding. So it is a good way of ensuring it
-        # is present, without the risk of duplication.
-        return ws
+        if not hasattr(self, '_filter_page_workspace'):
+            ws = super(FilterPageView, self).workspace
+            ws_acceptable = self.wms_source.workspace_acceptable()
+            ws.add_workspace_item(ws_acceptable.name,
+                                  ws_acceptable.adapter_name,
+                                  ws_acceptable.adapter_layer_json)
+            # ^^^ Note: add_workspace_item() first looks whether the item is
+            # already available before adding. So it is a good way of
+            # ensuring it is present, without the risk of duplication.
+            self._filter_page_workspace = ws
+        return self._filter_page_workspace
 
     @property
     def filter_page(self):
         """Return our FilterPage object."""
-        slug = self.kwargs['slug']
-        return get_object_or_404(models.FilterPage, slug=slug)
+        if not hasattr(self, '_filter_page'):
+            slug = self.kwargs['slug']
+            self._filter_page = get_object_or_404(models.FilterPage,
+                                                  slug=slug)
+        return self._filter_page
 
     @property
     def wms_source(self):
         """Return our FilterPage's WMSSource."""
-        return self.filter_page.wms_source
+        if not hasattr(self, '_wms_source'):
+            self._wms_source = self.filter_page.wms_source
+        return self._wms_source
 
     @property
     def edit_link(self):
@@ -82,14 +95,29 @@ class FilterPageView(MapView):
         return result
 
     def features(self, cql_filter_string=None):
-        return self.wms_source.get_feature_info(
-            bbox=self.bbox,
-            feature_count=100,
-            cql_filter_string=cql_filter_string)
+        """Return features within our bbox, fetched once per request.
+
+        Identical requests of other users are served from the
+        GetFeatureInfo cache, see ``lizard_wms.feature_info``.
+        """
+        if not hasattr(self, '_features'):
+            self._features = {}
+        if cql_filter_string not in self._features:
+            self._features[cql_filter_string] = (
+                self.wms_source.get_feature_info(
+                    bbox=self.bbox,
+                    feature_count=100,
+                    cql_filter_string=cql_filter_string) or [])
+        return self._features[cql_filter_string]
 
     @property
     def filters(self):
         """Return filters from GET parameters."""
+        if not hasattr(self, '_filters'):
+            self._filters = self._filters_from_get_parameters()
+        return self._filters
+
+    def _filters_from_get_parameters(self):
         result = {}
         allowed_keys = [name for (name, title) in self.available_filters]
         logger.debug("Allowed keys: %s", allowed_keys)
@@ -107,14 +135,16 @@ class FilterPageView(MapView):
 
     @property
     def values_per_dropdown(self):
-        intermediate_result = defaultdict(set)
-        for feature in self.features():
-            for k, v in feature.items():
-                intermediate_result[k].add(v)
-        result = {}
-        for k, v in intermediate_result.items():
-            result[k] = sorted(v)
-        return result
+        if not hasattr(self, '_values_per_dropdown'):
+            intermediate_result = defaultdict(set)
+            for feature in self.features():
+                for k, v in feature.items():
+                    intermediate_result[k].add(v)
+            result = {}
+            for k, v in intermediate_result.items():
+                result[k] = sorted(v)
+            self._values_per_dropdown = result
+        return self._values_per_dropdown
 
     @property
     def bbox(self):
@@ -130,12 +160,20 @@ class FilterPageView(MapView):
 
         For now: the visible featurelines. Later: our own list.
         """
-        return [(featureline.name, featureline.title) for featureline in
+        if not hasattr(self, '_available_filters'):
+            self._available_filters = [
+                (featureline.name, featureline.title) for featureline in
                 self.filter_page.available_filters.all()]
+        return self._available_filters
 
     @property
     def dropdowns(self):
         """Return list of dropdowns."""
+        if not hasattr(self, '_dropdowns'):
+            self._dropdowns = self._build_dropdowns()
+        return self._dropdowns
+
+    def _build_dropdowns(self):
         result = []
         choiced_made = self.filters
         values_per_dropdown = self.values_per_dropdown
@@ -186,26 +224,38 @@ class FilterPageView(MapView):
 
 class FilterPageDownload(FilterPageView):
 
-    def get(self, *args, **kwargs):
-        """Return a csv file."""
-        filename = '%s.csv' % self.kwargs['slug']
-        response = HttpResponse(mimetype='text/csv')
-        response['Content-Disposition'] = (
-            'attachment; filename="%s"' % filename)
+    def csv_rows(self, names_titles, features):
+        """Yield the csv file row by row.
 
-        names_titles = self.wms_source.featureline_set.filter(
-            visible=True).values_list('name', 'description')
+        Like lizard_map's csv_stream(), but with unicodecsv, as feature
+        values are unicode."""
         field_names = [name for (name, title) in names_titles]
         headers = {}
         for name, title, in names_titles:
             headers[name] = title
-        writer = unicodecsv.DictWriter(response, field_names, dialect='excel',
+
+        row = BytesIO()
+        writer = unicodecsv.DictWriter(row, field_names, dialect='excel',
                                        extrasaction='ignore')
-        writer.writerow(headers)
-        for feature in self.features(
-            cql_filter_string=self.cql_filter_string):
+        for feature in [headers] + features:
             writer.writerow(feature)
+            yield row.getvalue()
+            row.seek(0)
+            row.truncate()
+
+    def get(self, *args, **kwargs):
+        """Return a csv file, streamed to the client."""
+        # Query everything up front, the rows are written while the
+        # response is sent.
+        names_titles = list(self.wms_source.featureline_set.filter(
+            visible=True).values_list('name', 'description'))
+        features = self.features(cql_filter_string=self.cql_filter_string)
 
+        filename = '%s.csv' % self.kwargs['slug']
+        response = StreamingHttpResponse(
+            self.csv_rows(names_titles, features), mimetype='text/csv')
+        response['Content-Disposition'] = (
+            'attachment; filename="%s"' % filename)
         return response
 
 